@@ -0,0 +1,100 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from constants import DEFAULT_ALERT_DEBOUNCE_IN_SECONDS, DEFAULT_PRICE_WINDOW_IN_DAYS, SECONDS_PER_DAY
+from product import StockStatus
+
+# Transitions that can trigger a notification in continuous mode
+RESTOCK = 'restock'
+SOLD_OUT = 'sold_out'
+PRICE_DROP = 'price_drop'
+AVERAGE_DROP = 'average_drop'  # Price fell a percentage below its own average, checked across the price history
+ALERT_EVENTS = (RESTOCK, SOLD_OUT, PRICE_DROP, AVERAGE_DROP)
+
+
+class AlertState:
+    """What was last reported for one product, and when it may be reported again"""
+    __slots__ = ('status', 'below_threshold', 'quiet_until')
+
+    def __init__(self):
+        self.status = None
+        self.below_threshold = False
+        self.quiet_until = 0.0
+
+
+class AlertTracker:
+    """Edge-triggered alerts for products that stay monitored through restocks, sell-outs and price changes.
+
+    An alert fires when a product's state differs from the state last reported for it. After an alert the product is
+    quiet for `debounce` seconds: changes in that window are not reported, and only a state that still differs once
+    the window is over fires, so a page flapping between in and out of stock sends one alert per window. State is a
+    few fields per product, so a stable watchlist costs the same after a day as after weeks.
+    """
+
+    def __init__(self, events: Sequence[str] = (RESTOCK,), price_below_cents: Optional[int] = None,
+                 debounce: float = DEFAULT_ALERT_DEBOUNCE_IN_SECONDS, drop_percent: Optional[float] = None,
+                 drop_window: float = DEFAULT_PRICE_WINDOW_IN_DAYS * SECONDS_PER_DAY):
+        unknown = set(events) - set(ALERT_EVENTS)
+        if unknown:
+            raise ValueError(f"Unknown alert events {', '.join(sorted(unknown))}, expected: {', '.join(ALERT_EVENTS)}")
+        self.events = frozenset(events)
+        self.price_below_cents = price_below_cents
+        # Percent below its average over `drop_window` seconds a price has to fall for an average drop alert
+        self.drop_percent = drop_percent
+        self.drop_window = drop_window
+        self.debounce = debounce
+        self._states: Dict[str, AlertState] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, url: str, status: StockStatus, price_cents: Optional[int], now: float) -> List[str]:
+        """Record a check result and return the alerts it triggers"""
+        status = StockStatus(status)
+        if status is StockStatus.UNKNOWN:
+            return []
+
+        with self._lock:
+            state = self._states.get(url)
+            if state is None:
+                state = self._states[url] = AlertState()
+            if now < state.quiet_until:
+                return []
+
+            below_threshold = (self.price_below_cents is not None and price_cents is not None
+                               and price_cents < self.price_below_cents)
+            alerts = []
+            # A product that is in stock the first time it's seen counts as a restock, like the one-shot mode
+            if status is StockStatus.IN_STOCK and state.status is not StockStatus.IN_STOCK:
+                alerts.append(RESTOCK)
+            elif status is StockStatus.OUT_OF_STOCK and state.status is StockStatus.IN_STOCK:
+                alerts.append(SOLD_OUT)
+            if below_threshold and not state.below_threshold:
+                alerts.append(PRICE_DROP)
+
+            # Transitions that aren't enabled still move the baseline, so they never fire later by surprise
+            state.status = status
+            state.below_threshold = below_threshold
+            alerts = [alert for alert in alerts if alert in self.events]
+            if alerts:
+                state.quiet_until = now + self.debounce
+            return alerts
+
+    def export_states(self) -> List[tuple]:
+        """What was last reported for every product, as plain tuples"""
+        with self._lock:
+            return [(url, state.status.value if state.status else None, state.below_threshold, state.quiet_until)
+                    for url, state in self._states.items()]
+
+    def import_states(self, rows: Iterable[tuple]):
+        with self._lock:
+            for url, status, below_threshold, quiet_until in rows:
+                state = self._states[url] = AlertState()
+                state.status = StockStatus(status) if status else None
+                state.below_threshold = below_threshold
+                state.quiet_until = quiet_until
+
+    def forget(self, url: str):
+        with self._lock:
+            self._states.pop(url, None)
+
+    def __len__(self) -> int:
+        return len(self._states)
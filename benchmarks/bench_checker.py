@@ -0,0 +1,167 @@
+"""Measure StockChecker throughput against a local stand-in server.
+
+Usage: python -m benchmarks.bench_checker [--sizes 10 100 1000 10000] [--scenarios sweep check]
+                                          [--latency 0.05] [--error-rate 0.01] [--page-size 100000]
+                                          [--save results.json] [--baseline results.json]
+
+'sweep' runs one StockChecker.check_stock sweep over every URL, 'check' calls check_product_stock directly from a
+thread pool. Each scenario runs in its own process so CPU time and peak RSS are not shared between scenarios.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stand_in_server import StandInServer
+from constants import DEFAULT_CONCURRENCY
+from parsers import PARSERS, DEFAULT_PARSER, get_parser
+from printer import CustomPrinter
+from retailers import register_domain
+from stock_checker import StockChecker
+
+# Relative change against the baseline that is reported as a regression
+REGRESSION_THRESHOLD = 0.10
+
+
+class TimedStockChecker(StockChecker):
+    """StockChecker that records the latency of every check"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def check_product_stock(self, url):
+        start = time.perf_counter()
+        try:
+            return super().check_product_stock(url)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+def _serve(connection, server_options):
+    server = StandInServer(**server_options)
+    connection.send(server.port)
+    server.serve_forever()
+
+
+def _peak_rss_mib() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_scenario(port, scenario, size, concurrency, parser_name):
+    """Run one scenario in the current process and return its measurements"""
+    register_domain(f"127.0.0.1:{port}", 'macys')  # The stand-in server runs in another process
+    urls = [f"http://127.0.0.1:{port}/shop/product/item-{i}?ID={i}" for i in range(size)]
+    checker = TimedStockChecker(printer=CustomPrinter(use_colors=False), concurrency=concurrency, host_rate=0,
+                                parser=get_parser(parser_name), transport_options={'max_retries': 0})
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if scenario == 'sweep':
+            checker.check_stock(urls, interval=0, max_checks=1)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(checker.check_product_stock, urls))
+    elapsed = time.perf_counter() - start
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    checks = len(checker.latencies)
+    return {'scenario': scenario, 'urls': size, 'seconds': elapsed, 'sweeps_per_second': 1 / elapsed,
+            'checks_per_second': checks / elapsed, 'p50_ms': _percentile(checker.latencies, 0.50) * 1000,
+            'p99_ms': _percentile(checker.latencies, 0.99) * 1000,
+            'cpu_ms_per_check': cpu / checks * 1000 if checks else 0.0, 'peak_rss_mib': _peak_rss_mib()}
+
+
+def _run_scenario_process(results, *args):
+    results.put(run_scenario(*args))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark StockChecker against a local stand-in server')
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    arg_parser.add_argument('--scenarios', nargs='+', choices=['sweep', 'check'], default=['sweep', 'check'])
+    arg_parser.add_argument('-c', '--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    arg_parser.add_argument('--parser', choices=list(PARSERS), default=DEFAULT_PARSER)
+    arg_parser.add_argument('--latency', type=float, default=0.05, help='Server seconds per response')
+    arg_parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of 503 responses')
+    arg_parser.add_argument('--page-size', type=int, default=100 * 1024, help='Approximate bytes per page')
+    arg_parser.add_argument('--pages-dir', help='Serve recorded .html pages instead of synthetic ones')
+    arg_parser.add_argument('--save', help='Write the results to this JSON file')
+    arg_parser.add_argument('--baseline', help='Compare against results saved with --save')
+    arguments = arg_parser.parse_args()
+    printer = CustomPrinter()
+
+    # The server runs in its own process so its CPU time and memory don't count against the checker
+    parent_connection, child_connection = multiprocessing.Pipe()
+    server_process = multiprocessing.Process(target=_serve, daemon=True, args=(child_connection, {
+        'latency': arguments.latency, 'error_rate': arguments.error_rate, 'page_size': arguments.page_size,
+        'pages_dir': arguments.pages_dir}))
+    server_process.start()
+    port = parent_connection.recv()
+
+    results = []
+    try:
+        for scenario in arguments.scenarios:
+            for size in arguments.sizes:
+                printer.info(f"Running {scenario} over {size} URLs...")
+                queue = multiprocessing.Queue()
+                process = multiprocessing.Process(target=_run_scenario_process, args=(
+                    queue, port, scenario, size, arguments.concurrency, arguments.parser))
+                process.start()
+                results.append(queue.get())
+                process.join()
+    finally:
+        server_process.terminate()
+
+    baseline = {}
+    if arguments.baseline:
+        with open(arguments.baseline) as f:
+            baseline = {(result['scenario'], result['urls']): result for result in json.load(f)}
+
+    rows = []
+    regressions = 0
+    for result in results:
+        row = [result['scenario'], result['urls'], f"{result['sweeps_per_second']:.3f}",
+               f"{result['checks_per_second']:.1f}", f"{result['p50_ms']:.1f}", f"{result['p99_ms']:.1f}",
+               f"{result['cpu_ms_per_check']:.2f}", f"{result['peak_rss_mib']:.0f}"]
+        previous = baseline.get((result['scenario'], result['urls']))
+        if previous:
+            change = result['checks_per_second'] / previous['checks_per_second'] - 1
+            regressions += change < -REGRESSION_THRESHOLD
+            row.append(f"{change:+.0%}")
+        rows.append(row)
+
+    headers = ["Scenario", "URLs", "Sweeps/s", "Checks/s", "p50 ms", "p99 ms", "CPU ms/check", "Peak RSS MiB"]
+    if baseline:
+        headers.append("vs Baseline")
+    printer.section('Checker Benchmark')
+    printer.table(headers, rows)
+    print()
+
+    if arguments.save:
+        with open(arguments.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        printer.success(f"Results saved to {arguments.save}")
+    if regressions:
+        printer.error(f"{regressions} scenarios are more than {REGRESSION_THRESHOLD:.0%} slower than the baseline")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
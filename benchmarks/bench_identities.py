@@ -0,0 +1,64 @@
+"""Measure how sweep throughput scales with the number of session pool identities against per-client rate limits.
+
+Usage: python -m benchmarks.bench_identities [-n 200] [--identities 1 2 4 8] [--client-rate 5] [--latency 0.02]
+
+The stand-in server gives every client (User-Agent) its own budget of --client-rate requests per second and answers
+429 beyond it. Each identity is given the same rate, so a sweep should speed up in proportion to the identities used
+while staying clear of the server's limit.
+"""
+import argparse
+import contextlib
+import os
+import time
+
+from benchmarks.stand_in_server import StandInServer
+from printer import CustomPrinter
+from session_pool import build_identities
+from stock_checker import StockChecker
+
+
+def run_sweep(server: StandInServer, urls, identity_count, rate, concurrency):
+    """One sweep over every URL, returning (seconds, answered checks, 429 responses)"""
+    throttled_before = server.requests_throttled
+    checker = StockChecker(printer=CustomPrinter(use_colors=False, quiet=True), concurrency=concurrency,
+                           host_rate=rate, transport_options={'max_retries': 5},
+                           identities=build_identities(identity_count))
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = checker.check_batch(urls)
+    elapsed = time.perf_counter() - start
+    checker.close()
+    answered = sum(status is not None for _, status, _ in results)
+    return elapsed, answered, server.requests_throttled - throttled_before
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark session pool identities against per-client limits')
+    arg_parser.add_argument('-n', '--urls', type=int, default=200, help='Products per sweep')
+    arg_parser.add_argument('--identities', type=int, nargs='+', default=[1, 2, 4, 8])
+    arg_parser.add_argument('--client-rate', type=float, default=5.0, help='Server requests per second per client')
+    arg_parser.add_argument('--latency', type=float, default=0.02, help='Server seconds per response')
+    arg_parser.add_argument('-c', '--concurrency', type=int, default=16)
+    arguments = arg_parser.parse_args()
+    printer = CustomPrinter()
+
+    server = StandInServer(latency=arguments.latency, page_size=20 * 1024, client_rate=arguments.client_rate,
+                           client_burst=arguments.client_rate).start()
+    urls = [server.product_url(product_id) for product_id in range(arguments.urls)]
+    rows = []
+    try:
+        for count in arguments.identities:
+            printer.info(f"Sweeping {len(urls)} products through {count} identities...")
+            elapsed, answered, throttled = run_sweep(server, urls, count, arguments.client_rate,
+                                                     arguments.concurrency)
+            rows.append([count, f"{elapsed:.2f}", f"{answered / elapsed:.1f}", f"{answered}/{len(urls)}", throttled])
+    finally:
+        server.stop()
+
+    printer.section('Identity Benchmark')
+    printer.table(["Identities", "Seconds", "Checks/s", "Answered", "429s"], rows)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Measure how long the CLI takes to start, and check that it starts without its heavy dependencies.
+
+Usage: python -m benchmarks.bench_import [--runs 5] [--budget-ms 120] [--top 10]
+
+Imports `main` in fresh interpreters with `-X importtime` and reports the median time spent importing it, its slowest
+imports and the wall time of `python main.py --help`. Exits non-zero when the import takes longer than the budget or
+loads one of the modules that should only be imported once they are needed (HTTP, HTML parsing, NumPy, SQLite,
+email and SMS).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from printer import CustomPrinter
+
+REPOSITORY = Path(__file__).resolve().parent.parent
+# Modules `main` must not import before there is something to monitor or notify
+DEFERRED_MODULES = ('requests', 'bs4', 'lxml', 'numpy', 'sqlite3', 'smtplib', 'email.mime.text', 'mac_imessage',
+                    'http.server')
+
+
+def import_times(module: str):
+    """(cumulative microseconds, module name, nesting depth) of every import a fresh interpreter makes for a module,
+    leaving out the interpreter's own startup imports"""
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(REPOSITORY),
+                                                                            os.environ.get('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=REPOSITORY,
+                            env=environment, capture_output=True, text=True, check=True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            times.append((int(cumulative), name.strip(), (len(name) - len(name.lstrip()) - 1) // 2))
+            # An import is listed after everything it imported, so the module's imports follow the last top-level one
+            if times[-1][2] == 0 and times[-1][1] != module:
+                times.clear()
+    return times
+
+
+def help_seconds() -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, 'main.py', '--help'], cwd=REPOSITORY, capture_output=True, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark CLI startup')
+    arg_parser.add_argument('--runs', type=int, default=5)
+    arg_parser.add_argument('--budget-ms', type=float, default=120, help='Maximum median time to import main')
+    arg_parser.add_argument('--top', type=int, default=10, help='Slowest imports of main to list')
+    arguments = arg_parser.parse_args()
+    printer = CustomPrinter()
+
+    runs = [import_times('main') for _ in range(arguments.runs)]
+    totals = [next(cumulative for cumulative, name, depth in times if name == 'main' and depth == 0)
+              for times in runs]
+    help_runs = [help_seconds() for _ in range(arguments.runs)]
+
+    # Direct imports of main in the run with the median total
+    median_run = sorted(zip(totals, range(len(runs))))[len(runs) // 2][1]
+    children = sorted(((cumulative, name) for cumulative, name, depth in runs[median_run] if depth == 1),
+                      reverse=True)
+    loaded = {name for times in runs for _, name, _ in times}
+    eager = [module for module in DEFERRED_MODULES if module in loaded]
+
+    printer.section('Import Time Benchmark')
+    printer.table(["Import main", "Budget", "main.py --help"],
+                  [[f"{statistics.median(totals) / 1000:.1f} ms", f"{arguments.budget_ms:g} ms",
+                    f"{statistics.median(help_runs) * 1000:.0f} ms"]])
+    print()
+    printer.table(["Imported by main", "Cumulative"],
+                  [[name, f"{cumulative / 1000:.1f} ms"] for cumulative, name in children[:arguments.top]])
+    print()
+
+    failed = False
+    if statistics.median(totals) / 1000 > arguments.budget_ms:
+        printer.error(f"Importing main takes longer than the {arguments.budget_ms:g} ms budget")
+        failed = True
+    if eager:
+        printer.error(f"Imported at startup instead of on first use: {', '.join(eager)}")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
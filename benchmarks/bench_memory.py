@@ -0,0 +1,96 @@
+"""Measure resident memory per tracked product for each product store.
+
+Usage: python -m benchmarks.bench_memory [-n 100000]
+"""
+import argparse
+import gc
+import hashlib
+import random
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from benchmarks.pages import BRANDS
+from printer import CustomPrinter
+from product import ProductInfo
+from product_cache import ProductTable
+
+
+@dataclass
+class LegacyProductInfo:
+    """The original dict-backed dataclass, kept here as the comparison baseline"""
+    id: str
+    name: str
+    brand: str
+    price: Optional[str] = None
+    status: str = "Unknown"
+    description: Optional[str] = None
+    reviews_count: Optional[str] = None
+    rating: Optional[str] = None
+    last_checked: Optional[datetime] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_digest: Optional[str] = None
+
+
+def product_fields(index, rng):
+    """Field values as a parser would produce them: freshly built strings, not shared literals"""
+    regular = rng.randint(20, 200)
+    return {'id': str(10000000 + index), 'name': f"Product {index} Classic Fit Cotton Shirt",
+            'brand': ''.join(rng.choice(BRANDS)), 'price': f"${regular}.99 Sale ${regular * 7 // 10}.49",
+            'status': ''.join(rng.choice(["In Stock", "Out of Stock"])), 'rating': f"{rng.randint(10, 50) / 10}",
+            'reviews_count': f"({rng.randint(0, 900)} reviews)", 'last_checked': datetime.now(),
+            'content_digest': hashlib.blake2b(str(index).encode(), digest_size=16).digest()}
+
+
+def measure(build, count):
+    """Bytes allocated per product by a store built from `count` products"""
+    rng = random.Random(0)
+    gc.collect()
+    tracemalloc.start()
+    store = build(((f"https://www.macys.com/shop/product/item?ID={index}", product_fields(index, rng))
+                   for index in range(count)))
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del store
+    return allocated / count
+
+
+def build_legacy(products):
+    store = {}
+    for url, fields in products:
+        fields['content_digest'] = fields['content_digest'].hex()
+        store[url] = LegacyProductInfo(**fields)
+    return store
+
+
+def build_slotted(products):
+    return {url: ProductInfo(**fields) for url, fields in products}
+
+
+def build_table(products):
+    table = ProductTable()
+    for url, fields in products:
+        table.put(url, ProductInfo(**fields))
+    return table
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Measure memory per tracked product')
+    arg_parser.add_argument('-n', '--products', type=int, default=100000)
+    arguments = arg_parser.parse_args()
+    printer = CustomPrinter()
+
+    results = [("dataclass (original)", measure(build_legacy, arguments.products)),
+               ("ProductInfo (slots)", measure(build_slotted, arguments.products)),
+               ("ProductTable (columnar)", measure(build_table, arguments.products))]
+    baseline = results[0][1]
+    printer.section('Memory Benchmark')
+    printer.table(["Store", "Bytes/Product", "vs Original"],
+                  [[name, f"{per_product:.0f}", f"{per_product / baseline - 1:+.0%}"] for name, per_product in results])
+
+
+if __name__ == "__main__":
+    main()
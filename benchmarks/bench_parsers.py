@@ -0,0 +1,64 @@
+"""Compare the parser backends on saved product pages.
+
+Usage: python -m benchmarks.bench_parsers [page.html ...] [-n ITERATIONS]
+Without page files a synthetic in-stock and out-of-stock page are generated.
+"""
+import argparse
+import time
+from pathlib import Path
+
+from benchmarks.pages import render_product_page
+from parsers import PARSERS, get_parser
+from printer import CustomPrinter
+
+
+def parse_page(parser, html):
+    document = parser.load(html)
+    info = parser.extract_product_info(document)
+    info.last_checked = None
+    info.variants = None  # Only the jsonld backend reads sizes and colors
+    return parser.is_out_of_stock(document), info
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark the product page parser backends')
+    arg_parser.add_argument('pages', nargs='*', help='Saved product page HTML files')
+    arg_parser.add_argument('-n', '--iterations', type=int, default=20, help='Parses per page and backend')
+    arguments = arg_parser.parse_args()
+    printer = CustomPrinter()
+
+    if arguments.pages:
+        pages = [(path, Path(path).read_text(encoding='utf-8', errors='replace')) for path in arguments.pages]
+    else:
+        pages = [('synthetic-in-stock', render_product_page('1234567')),
+                 ('synthetic-out-of-stock', render_product_page('7654321', in_stock=False))]
+
+    parsers = [get_parser(name) for name in PARSERS]
+    rows = []
+    mismatches = 0
+    for label, html in pages:
+        expected = parse_page(parsers[0], html)
+        for parser in parsers:
+            result = parse_page(parser, html)
+            if result != expected:
+                mismatches += 1
+                printer.error(f"{parser.name} disagrees with {parsers[0].name} on {label}: {result}")
+
+            start = time.perf_counter()
+            for _ in range(arguments.iterations):
+                parse_page(parser, html)
+            elapsed = (time.perf_counter() - start) / arguments.iterations
+            rows.append([label, parser.name, f"{len(html) / 1024:.0f} KiB", f"{elapsed * 1000:.2f} ms",
+                         f"{len(html) / elapsed / 1024 / 1024:.1f} MiB/s"])
+
+    printer.section('Parser Benchmark')
+    printer.table(["Page", "Parser", "Size", "Per Parse", "Throughput"], rows)
+    print()
+    if mismatches:
+        printer.error(f"{mismatches} parser results did not match")
+        raise SystemExit(1)
+    printer.success("All parsers produced the same product information")
+
+
+if __name__ == "__main__":
+    main()
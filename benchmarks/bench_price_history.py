@@ -0,0 +1,87 @@
+"""Measure how long a drop-vs-average check across the whole watchlist takes.
+
+Usage: python -m benchmarks.bench_price_history [-n 10000] [--changes 50] [--days 60]
+
+Fills a price history with N products whose prices each change --changes times over --days days, then times the
+vectorized `new_drops` check against a per-product Python loop computing the same time-weighted averages.
+"""
+import argparse
+import random
+import time
+
+from constants import SECONDS_PER_DAY
+from price_history import PriceHistory
+from printer import CustomPrinter
+from product import ProductInfo, format_cents
+
+DROP_PERCENT = 20
+WINDOW_DAYS = 30
+
+
+def fill(history: PriceHistory, count: int, changes: int, days: float, now: float) -> float:
+    """Record `changes` prices per product spread over `days`, returning the seconds spent recording"""
+    rng = random.Random(0)
+    regular = [rng.randint(20, 200) * 100 + 99 for _ in range(count)]
+    start = time.perf_counter()
+    for step in range(changes):
+        at = now - days * SECONDS_PER_DAY * (1 - step / changes)
+        for product in range(count):
+            # Mostly small moves around the regular price, now and then a deep sale
+            sale = regular[product] * rng.choice((100, 95, 90, 85, 60 if rng.random() < 0.05 else 90)) // 100
+            history.record(f"https://www.macys.com/shop/product/item?ID={product}",
+                           ProductInfo(str(product), "", "", f"{format_cents(regular[product])} Sale "
+                                                            f"{format_cents(sale)}"), at=at)
+    return time.perf_counter() - start
+
+
+def python_drops(history: PriceHistory, percent: float, window: float, now: float):
+    """The same check one product at a time, as the comparison baseline"""
+    columns = [history._row_columns[name][:history._rows].tolist() for name in ('product', 'at', 'until', 'price')]
+    series = {}
+    for product, at, until, price in zip(*columns):
+        series.setdefault(product, []).append((at, until, price))
+    below = []
+    for product, prices in series.items():
+        total = duration = 0.0
+        for at, until, price in prices:
+            held = max(0.0, min(until, now) - max(at, now - window))
+            total += held * price
+            duration += held
+        if duration and 1 - prices[-1][2] / (total / duration) >= percent / 100:
+            below.append(history._urls[product])
+    return below
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark price history analytics')
+    arg_parser.add_argument('-n', '--products', type=int, default=10_000)
+    arg_parser.add_argument('--changes', type=int, default=50, help='Price changes per product')
+    arg_parser.add_argument('--days', type=float, default=60, help='Days the changes are spread over')
+    arguments = arg_parser.parse_args()
+    printer = CustomPrinter()
+
+    now = time.time()
+    window = WINDOW_DAYS * SECONDS_PER_DAY
+    history = PriceHistory(None)
+    printer.info(f"Recording {arguments.changes} prices for each of {arguments.products} products...")
+    record_seconds = fill(history, arguments.products, arguments.changes, arguments.days, now)
+    observations = arguments.products * arguments.changes
+
+    start = time.perf_counter()
+    drops = history.new_drops(DROP_PERCENT, window, now)
+    vectorized = time.perf_counter() - start
+    start = time.perf_counter()
+    baseline = python_drops(history, DROP_PERCENT, window, now)
+    loop = time.perf_counter() - start
+    if sorted(drops) != sorted(baseline):
+        printer.error("The vectorized and the Python check disagree")
+
+    printer.section('Price History Benchmark')
+    printer.table(["Products", "Rows", "Record", "Drop Check", "Python Loop", "Drops"],
+                  [[arguments.products, history._rows, f"{observations / record_seconds:,.0f}/s",
+                    f"{vectorized * 1000:.1f} ms", f"{loop * 1000:.0f} ms", len(drops)]])
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Measure checkpoint size, how long a snapshot holds up the monitoring loop, and how fast a monitor resumes.
+
+Usage: python -m benchmarks.bench_resume [-n 100000] [--continuous]
+
+Builds a monitor tracking N products with cached product information in the compact in-memory table (the case
+where product information has to go into the checkpoint), checkpoints it, then times a fresh monitor from loading
+the checkpoint to having its first batch of due products in hand.
+"""
+import argparse
+import gc
+import os
+import random
+import tempfile
+import time
+
+from alerts import AlertTracker, RESTOCK, SOLD_OUT
+from benchmarks.bench_memory import product_fields
+from checkpoint import Checkpointer
+from printer import CustomPrinter
+from product import ProductInfo
+from product_cache import ProductTable
+from scheduler import PollScheduler
+from stock_checker import StockChecker
+
+
+def make_checker(path, continuous):
+    return StockChecker(printer=CustomPrinter(use_colors=False), product_cache=ProductTable(),
+                        alert_tracker=AlertTracker([RESTOCK, SOLD_OUT]) if continuous else None,
+                        checkpointer=Checkpointer(path))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark checkpoint and resume')
+    arg_parser.add_argument('-n', '--products', type=int, default=100_000)
+    arg_parser.add_argument('--continuous', action='store_true', help='Include alert state for every product')
+    arguments = arg_parser.parse_args()
+    printer = CustomPrinter()
+
+    urls = [f"https://www.macys.com/shop/product/item-{i}?ID={i}" for i in range(arguments.products)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'checkpoint')
+        checker = make_checker(path, arguments.continuous)
+        checker.scheduler = PollScheduler(60)
+        now = time.monotonic()
+        rng = random.Random(0)
+        for idx, url in enumerate(urls):
+            in_stock = idx % 10 == 0
+            product_info = ProductInfo(**product_fields(idx, rng))
+            checker.cache_product_info(url, product_info)
+            if in_stock and not arguments.continuous:
+                checker.completed_urls.add(url)
+                continue
+            checker.scheduler.add(url)
+            checker.scheduler.record(url, in_stock, product_info, now=now + idx % 60)
+            if checker.alert_tracker:
+                checker.alert_tracker.observe(url, product_info.status, product_info.price_cents, time.time())
+
+        start = time.perf_counter()
+        checker.save_checkpoint()
+        blocked = time.perf_counter() - start
+        checker.checkpointer.close()
+        written = time.perf_counter() - start
+        size = os.path.getsize(path)
+        del checker  # A resuming monitor starts in a fresh process
+        gc.collect()
+
+        resumed = make_checker(path, arguments.continuous)
+        start = time.perf_counter()
+        resumed.scheduler = PollScheduler(60)
+        resumed.restore_checkpoint(resumed.checkpointer.load(), urls)
+        # Saved due times lie up to a couple of intervals ahead, take the batch that falls due first
+        first_batch = resumed.scheduler.pop_due(now=time.monotonic() + resumed.scheduler.next_due_in())
+        resume_seconds = time.perf_counter() - start
+
+    printer.section('Checkpoint Benchmark')
+    printer.table(["Products", "Checkpoint", "Loop Blocked", "Written After", "Resumed In", "First Batch"],
+                  [[arguments.products, f"{size / 1024 / 1024:.1f} MiB", f"{blocked * 1000:.0f} ms",
+                    f"{written * 1000:.0f} ms", f"{resume_seconds * 1000:.0f} ms", len(first_batch)]])
+    print()
+
+
+if __name__ == "__main__":
+    main()
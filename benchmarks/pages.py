@@ -0,0 +1,96 @@
+"""Synthetic Macy's product pages for benchmarks and local stand-in servers"""
+import json
+import random
+
+OUT_OF_STOCK_BLOCK = '<div class="error-color large">Sorry, this item is currently unavailable.</div>'
+
+SIZES = ["S", "M", "L", "XL"]
+COLORS = ["Black", "Navy", "White", "Red", "Olive"]
+BRANDS = ["Nike", "Calvin Klein", "Levi's", "Ralph Lauren", "Tommy Hilfiger", "Michael Kors", "Adidas", "Coach"]
+
+
+def _filler(rng, size):
+    """Navigation, script and markup noise similar to what surrounds the product block on a real page"""
+    parts = []
+    written = 0
+    while written < size:
+        block = rng.choice([
+            '<div class="nav-item"><a href="/shop/category?id={n}">Category {n}</a></div>',
+            '<script>window.__DATA_{n}__ = {{"id": {n}, "items": [1, 2, 3], "flag": true}};</script>',
+            '<ul class="footer-links"><li><a href="/help/{n}">Help {n}</a></li><li>Item {n}</li></ul>',
+            '<div class="recommendation"><span class="rec-title">Similar item {n}</span>'
+            '<div class="rec-price">$1{n}.99</div></div>',
+        ]).format(n=rng.randint(1, 99999))
+        parts.append(block)
+        written += len(block)
+    return "\n".join(parts)
+
+
+def product_fields(product_id, seed=None) -> dict:
+    """Brand, name, prices and rating of a synthetic product"""
+    rng = random.Random(product_id if seed is None else seed)
+    brand = rng.choice(BRANDS)
+    regular = rng.randint(20, 200) + 0.99
+    return {'id': str(product_id), 'brand': brand, 'name': f"Product {product_id}",
+            'regular': regular, 'sale': round(regular * 0.7, 2), 'rating': rng.randint(10, 50) / 10,
+            'reviews': rng.randint(0, 900), 'rng': rng, 'seed': product_id if seed is None else seed}
+
+
+def product_variants(fields, in_stock=True) -> list:
+    """(sku, color, size, available) for each variant, with at least one available when the product is in stock"""
+    rng = random.Random(f"{fields['seed']}-variants")
+    colors = rng.sample(COLORS, 2)
+    variants = [[f"{fields['id']}-{color}-{size}", color, size, in_stock and rng.random() < 0.5]
+                for color in colors for size in SIZES]
+    if in_stock and not any(variant[3] for variant in variants):
+        variants[0][3] = True
+    return variants
+
+
+def render_json_ld(fields, in_stock=True) -> str:
+    """The schema.org Product block real product pages embed for search engines"""
+    availability = 'https://schema.org/InStock' if in_stock else 'https://schema.org/OutOfStock'
+    data = {'@context': 'https://schema.org', '@type': 'Product', 'productID': fields['id'], 'name': fields['name'],
+            'brand': {'@type': 'Brand', 'name': fields['brand']},
+            'offers': {'@type': 'AggregateOffer', 'priceCurrency': 'USD', 'highPrice': f"{fields['sale']:.2f}",
+                       'lowPrice': f"{fields['sale']:.2f}", 'availability': availability,
+                       'priceSpecification': {'@type': 'UnitPriceSpecification',
+                                              'priceType': 'https://schema.org/StrikethroughPrice',
+                                              'price': f"{fields['regular']:.2f}"},
+                       'offers': [{'@type': 'Offer', 'sku': sku, 'price': f"{fields['sale']:.2f}",
+                                   'itemOffered': {'@type': 'Product', 'color': color, 'size': size},
+                                   'availability': f"https://schema.org/{'InStock' if available else 'OutOfStock'}"}
+                                  for sku, color, size, available in product_variants(fields, in_stock)]},
+            'aggregateRating': {'@type': 'AggregateRating', 'ratingValue': str(fields['rating']),
+                                'reviewCount': fields['reviews']}}
+    return f'<script type="application/ld+json">{json.dumps(data)}</script>'
+
+
+def render_api_product(fields, in_stock=True) -> dict:
+    """One product entry in the shape served by the product API stub"""
+    return {'id': fields['id'], 'detail': {'name': fields['name'], 'brand': {'name': fields['brand']}},
+            'pricing': {'price': {'tieredPrice': [{'label': 'Reg.', 'values': [{'value': fields['regular']}]},
+                                                  {'label': 'Sale', 'values': [{'value': fields['sale']}]}]}},
+            'availability': {'available': in_stock},
+            'reviewStatistics': {'aggregate': {'rating': fields['rating'], 'count': fields['reviews']}}}
+
+
+def render_product_page(product_id, in_stock=True, size=300 * 1024, seed=None):
+    """Render a product page of roughly `size` bytes, with the unavailable message when out of stock"""
+    fields = product_fields(product_id, seed)
+    rng = fields['rng']
+    product = (f'<h1 class="product-title"><label class="subtitle-2">{fields["brand"]}</label>'
+               f'<span class="subtitle-1">{fields["name"]}</span></h1>\n'
+               f'<div class="price"><span>${fields["regular"]:.2f}</span> '
+               f'<span>Sale ${fields["sale"]:.2f}</span></div>\n'
+               f'<div class="rating"><span class="rating-average">{fields["rating"]}</span>'
+               f'<span class="rating-description">({fields["reviews"]} reviews)</span></div>\n'
+               f'<span class="product-id">Web ID: {product_id}</span>\n')
+    if not in_stock:
+        product += OUT_OF_STOCK_BLOCK + '\n'
+
+    head = _filler(rng, size // 3)
+    tail = _filler(rng, size - size // 3)
+    return (f'<!DOCTYPE html><html><head><title>Product {product_id} | Macy\'s</title>\n'
+            f'{render_json_ld(fields, in_stock)}</head><body>\n'
+            f'{head}\n<main class="pdp">\n{product}</main>\n{tail}\n</body></html>')
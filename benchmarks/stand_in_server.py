@@ -0,0 +1,200 @@
+"""Local stand-in for Macy's product pages.
+
+Usage: python -m benchmarks.stand_in_server [--port 8000] [--latency 0.05] [--error-rate 0.01] [--page-size 300000]
+
+Serves /shop/product/<name>?ID=<id> with synthetic pages (or recorded pages from --pages-dir), in stock or showing
+the "currently unavailable" message depending on --out-of-stock-ratio. A stub of the structured product API answers
+/xapi/digital/v1/product/<id>,<id>,... with the same products as JSON (synthetic data even with --pages-dir).
+With --client-rate each client, told apart by its User-Agent, gets its own request budget and is answered 429 with a
+Retry-After once it runs out, like a retailer throttling one visitor.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks.pages import OUT_OF_STOCK_BLOCK, product_fields, render_api_product, render_product_page
+from rate_limiter import TokenBucket
+from retailers import register_domain
+
+# Number of distinct pages rendered up front; requests pick one and substitute their product ID
+TEMPLATE_COUNT = 8
+TEMPLATE_PRODUCT_ID = '__PRODUCT_ID__'
+PRODUCT_API_PATH = '/xapi/digital/v1/product/'
+# Seconds a throttled client is asked to wait
+THROTTLE_RETRY_AFTER_IN_SECONDS = 1
+
+
+class StandInServer:
+    """Threaded HTTP server that imitates Macy's product pages with configurable latency, errors and page size"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, page_size=300 * 1024,
+                 out_of_stock_ratio=0.5, pages_dir=None, seed=0, client_rate=0.0, client_burst=1):
+        self.latency = latency
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.requests_throttled = 0
+        self.requests_by_client = {}
+        self._client_buckets = {}
+        self.error_rate = error_rate
+        self.out_of_stock_ratio = out_of_stock_ratio
+        self.requests_served = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._templates = self._load_templates(pages_dir, page_size)
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_port
+
+    def product_url(self, product_id) -> str:
+        return f"http://127.0.0.1:{self.port}/shop/product/item-{product_id}?ID={product_id}"
+
+    @property
+    def api_url(self) -> str:
+        """Product API URL template for the stand-in, with an {ids} placeholder"""
+        return f"http://127.0.0.1:{self.port}{PRODUCT_API_PATH}{{ids}}"
+
+    def is_in_stock(self, product_id: str) -> bool:
+        """Stable per-product stock status so repeated sweeps see the same answer"""
+        return (zlib.crc32(product_id.encode()) % 1000) / 1000 >= self.out_of_stock_ratio
+
+    def start(self):
+        # Its pages imitate Macy's, so its URLs are checked like Macy's
+        register_domain(f"127.0.0.1:{self.port}", 'macys')
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="stand-in-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def admit(self, client: str) -> bool:
+        """Spend a request from a client's budget, returning False if it has none left"""
+        with self._lock:
+            self.requests_by_client[client] = self.requests_by_client.get(client, 0) + 1
+            if self.client_rate <= 0:
+                return True
+            bucket = self._client_buckets.get(client)
+            if bucket is None:
+                bucket = self._client_buckets[client] = TokenBucket(self.client_rate, self.client_burst)
+            # A client over budget is refused instead of queued, so it doesn't keep its token
+            if bucket.wait_time() > 0:
+                self.requests_throttled += 1
+                return False
+            bucket.reserve()
+            return True
+
+    def render(self, product_id: str, in_stock: bool) -> bytes:
+        templates = self._templates[in_stock]
+        template = templates[zlib.crc32(product_id.encode()) % len(templates)]
+        return template.replace(TEMPLATE_PRODUCT_ID, product_id).encode('utf-8')
+
+    def render_api(self, product_ids) -> bytes:
+        """Product API response for a batch of product IDs, matching the synthetic pages"""
+        products = [render_api_product(product_fields(product_id, zlib.crc32(product_id.encode()) % TEMPLATE_COUNT),
+                                       self.is_in_stock(product_id))
+                    for product_id in product_ids]
+        return json.dumps({'product': products}).encode('utf-8')
+
+    def _load_templates(self, pages_dir, page_size):
+        if pages_dir:
+            pages = [path.read_text(encoding='utf-8', errors='replace')
+                     for path in sorted(Path(pages_dir).glob('*.htm*'))]
+            if not pages:
+                raise ValueError(f"No .html pages found in {pages_dir}")
+            # Recorded pages serve as out of stock when they show the unavailable message, in stock otherwise
+            out_of_stock = [page for page in pages if 'currently unavailable' in page.lower()]
+            in_stock = [page for page in pages if page not in out_of_stock]
+            return {True: in_stock or [page.replace(OUT_OF_STOCK_BLOCK, '') for page in out_of_stock],
+                    False: out_of_stock or [page.replace('</body>', OUT_OF_STOCK_BLOCK + '</body>')
+                                            for page in in_stock]}
+
+        return {in_stock: [render_product_page(TEMPLATE_PRODUCT_ID, in_stock=in_stock, size=page_size, seed=seed)
+                           for seed in range(TEMPLATE_COUNT)]
+                for in_stock in (True, False)}
+
+    def _handler_class(self):
+        server = self
+
+        class StandInHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests_served += 1
+                    failed = server._random.random() < server.error_rate
+                if not server.admit(self.headers.get('User-Agent', '')):
+                    self.send_response(429)
+                    self.send_header('Retry-After', str(THROTTLE_RETRY_AFTER_IN_SECONDS))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+
+                parts = urlsplit(self.path)
+                if parts.path.startswith(PRODUCT_API_PATH):
+                    product_ids = [product_id for product_id in parts.path[len(PRODUCT_API_PATH):].split(',')
+                                   if product_id]
+                    body, content_type = server.render_api(product_ids), 'application/json'
+                else:
+                    product_id = parse_qs(parts.query).get('ID', [''])[0]
+                    if not parts.path.startswith('/shop/product/') or not product_id:
+                        self.send_error(404)
+                        return
+                    body, content_type = None, 'text/html; charset=utf-8'
+                if failed:
+                    self.send_error(503)
+                    return
+
+                if body is None:
+                    body = server.render(product_id, server.is_in_stock(product_id))
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return StandInHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve stand-in Macy's product pages")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before each response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    parser.add_argument('--page-size', type=int, default=300 * 1024, help='Approximate bytes per synthetic page')
+    parser.add_argument('--out-of-stock-ratio', type=float, default=0.5, help='Fraction of products out of stock')
+    parser.add_argument('--client-rate', type=float, default=0.0,
+                        help='Requests per second allowed per client (User-Agent) before answering 429')
+    parser.add_argument('--pages-dir', help='Serve recorded .html pages from this directory instead')
+    arguments = parser.parse_args()
+
+    server = StandInServer(port=arguments.port, latency=arguments.latency, error_rate=arguments.error_rate,
+                           page_size=arguments.page_size, out_of_stock_ratio=arguments.out_of_stock_ratio,
+                           pages_dir=arguments.pages_dir, client_rate=arguments.client_rate)
+    print(f"Serving stand-in product pages on {server.product_url('1234567')}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import contextlib
+import gc
+import json
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from constants import DEFAULT_CHECKPOINT_PATH, DEFAULT_CHECKPOINT_INTERVAL_IN_SECONDS
+from metrics import REGISTRY
+from printer import CustomPrinter
+from product import ProductInfo
+
+# Bumped whenever the layout of the state changes, older checkpoints are then ignored
+CHECKPOINT_VERSION = 2
+# Fast compression: checkpoints are rewritten every minute and read once per start
+COMPRESSION_LEVEL = 1
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """Hold off garbage collection while a checkpoint's worth of objects is created, none of which are garbage"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class Checkpointer:
+    """Periodic snapshots of monitor state, written atomically from a background thread.
+
+    The monitor captures its state as plain tuples between batches, which is quick, and the writer thread encodes it
+    as JSON, compresses it and writes it to a temporary file that replaces the checkpoint in one rename, so a crash
+    mid-write leaves the previous checkpoint intact. A snapshot taken while the previous one is still being written
+    is skipped. The checkpoint is read on every start, so it is never unpickled: a planted file can't run code.
+    """
+
+    def __init__(self, path: str = DEFAULT_CHECKPOINT_PATH, interval: float = DEFAULT_CHECKPOINT_INTERVAL_IN_SECONDS,
+                 printer: CustomPrinter = None, resume: bool = True):
+        self.path = path
+        self.interval = interval
+        self.resume = resume  # When False the last checkpoint is ignored, and replaced by the next one
+        self.printer = printer
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mstock-checkpoint")
+        self._writing: Optional[Future] = None
+        self._last_saved = time.monotonic()
+        self._lock = threading.Lock()
+
+    def due(self) -> bool:
+        return time.monotonic() - self._last_saved >= self.interval
+
+    def save(self, state: dict, products: Callable[[], Iterable[tuple]] = None, wait: bool = False) -> bool:
+        """Hand a snapshot to the writer thread. `products` is called on that thread to collect (url, fields) pairs.
+
+        Returns False if the snapshot was skipped because the previous one is still being written.
+        """
+        with self._lock:
+            if self._writing and not self._writing.done():
+                if not wait:
+                    return False
+                self._writing.result()
+            self._last_saved = time.monotonic()
+            self._writing = self._executor.submit(self._write, dict(state, version=CHECKPOINT_VERSION,
+                                                                     saved_at=time.time()), products)
+        if wait:
+            self._writing.result()
+        return True
+
+    def load(self) -> Optional[dict]:
+        """The last checkpoint, or None if there is none or it can't be read"""
+        if not self.resume:
+            return None
+        try:
+            with open(self.path, 'rb') as f, gc_paused():
+                state = json.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        except (OSError, zlib.error, ValueError) as e:
+            if self.printer:
+                self.printer.warning(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+        if not isinstance(state, dict) or state.get('version') != CHECKPOINT_VERSION:
+            if self.printer:
+                self.printer.warning(f"Ignoring checkpoint {self.path} from another version")
+            return None
+        return state
+
+    def clear(self):
+        """Delete the checkpoint once the snapshot being written is done, when there is nothing left to resume"""
+        with self._lock:
+            if self._writing:
+                self._writing.result()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            if self.printer:
+                self.printer.error(f"Error removing checkpoint: {e}")
+
+    @staticmethod
+    def products(state: dict) -> List[Tuple[str, tuple]]:
+        """(url, compact fields) of the products saved in a checkpoint"""
+        if not state.get('products'):
+            return []
+        return [(url, ProductInfo.decode_raw_fields(fields)) for url, fields in json.loads(state['products'])]
+
+    def close(self):
+        """Wait for the snapshot being written"""
+        self._executor.shutdown(wait=True)
+
+    def _write(self, state: dict, products: Optional[Callable[[], Iterable[tuple]]]):
+        try:
+            with REGISTRY.timer('mstock_phase_seconds', phase='checkpoint'):
+                if products is not None:
+                    # Encoded on their own so a resume can decode them in the background, after checking started
+                    state['products'] = json.dumps([(url, ProductInfo.encode_raw_fields(fields))
+                                                    for url, fields in products()], separators=(',', ':'))
+                data = zlib.compress(json.dumps(state, separators=(',', ':')).encode('utf-8'), COMPRESSION_LEVEL)
+                temporary_path = f"{self.path}.tmp"
+                with open(temporary_path, 'wb') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temporary_path, self.path)
+            REGISTRY.set_gauge('mstock_checkpoint_bytes', len(data))
+        except Exception as e:
+            REGISTRY.increment('mstock_check_errors_total', kind='checkpoint')
+            if self.printer:
+                self.printer.error(f"Error writing checkpoint: {e}")
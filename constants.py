@@ -1,5 +1,44 @@
+SECONDS_PER_DAY = 24 * 60 * 60
+# Deprecated: URLs are matched by the retailer adapters. Kept for callers that still import it
 MACYS_PRODUCT_URL_PREFIX = 'https://www.macys.com/shop/product/'
 DEFAULT_CHECK_INTERVAL_IN_SECONDS = 60
+DEFAULT_CONCURRENCY = 8
+PRODUCT_API_URL = 'https://www.macys.com/xapi/digital/v1/product/{ids}'
+PRODUCT_API_BATCH_SIZE = 20
+DEFAULT_HOST_RATE_PER_SECOND = 2.0
+SERIAL_ITEM_DELAY_IN_SECONDS = 2
+DEFAULT_CONNECT_TIMEOUT_IN_SECONDS = 5
+DEFAULT_READ_TIMEOUT_IN_SECONDS = 20
+DEFAULT_MAX_RETRIES = 3
+BACKOFF_BASE_IN_SECONDS = 1
+BACKOFF_MAX_IN_SECONDS = 30
+CIRCUIT_BREAKER_THRESHOLD = 5
+CIRCUIT_BREAKER_COOLDOWN_IN_SECONDS = 60
+IDENTITY_REST_IN_SECONDS = 5
+IDENTITY_MAX_REST_IN_SECONDS = 120
+MAX_STABLE_INTERVAL_MULTIPLIER = 8
+STABLE_CHECKS_FOR_MAX_INTERVAL = 20
+MAX_ERROR_BACKOFF_STEPS = 5
+PRIORITY_INTERVAL_MULTIPLIERS = {'high': 0.5, 'normal': 1.0, 'low': 2.0}
+DEFAULT_NOTIFICATION_COALESCE_WINDOW_IN_SECONDS = 10
+DEFAULT_ALERT_DEBOUNCE_IN_SECONDS = 10 * 60
+DEFAULT_NOTIFICATION_MAX_RETRIES = 3
+NOTIFICATION_RETRY_DELAY_IN_SECONDS = 2
+DEFAULT_NOTIFICATION_TIMEOUT_IN_SECONDS = 30
+DEFAULT_CACHE_PATH = '.mstock_cache.sqlite3'
+DEFAULT_CACHE_TTL_IN_SECONDS = 7 * SECONDS_PER_DAY
+DEFAULT_CACHE_MAX_ENTRIES = 10000
+DEFAULT_JOURNAL_PATH = '.mstock_journal.sqlite3'
+DEFAULT_PRICE_HISTORY_PATH = '.mstock_prices.npz'
+DEFAULT_PRICE_WINDOW_IN_DAYS = 30
+DEFAULT_CHECKPOINT_PATH = '.mstock_checkpoint'
+DEFAULT_CHECKPOINT_INTERVAL_IN_SECONDS = 60
+DEFAULT_PAGE_ARCHIVE_PATH = '.mstock_pages.sqlite3'
+WATCHLIST_RELOAD_CHECK_IN_SECONDS = 2
+DEFAULT_DASHBOARD_FPS = 4
+DISPLAY_MODES = ('log', 'dashboard', 'quiet')
+DEFAULT_CONTROL_PORT = 8765
+DEFAULT_CONTROL_TOKEN_PATH = '.mstock_control_token'
 COLORS = {'red': '\033[91m', 'green': '\033[92m', 'yellow': '\033[93m', 'blue': '\033[94m', 'magenta': '\033[95m',
           'cyan': '\033[96m', 'white': '\033[97m', 'reset': '\033[0m', 'bold': '\033[1m', 'dim': '\033[2m',
           'underline': '\033[4m'}
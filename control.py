@@ -0,0 +1,246 @@
+import hmac
+import json
+import os
+import secrets
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from constants import PRIORITY_INTERVAL_MULTIPLIERS
+from metrics import REGISTRY
+from utils import normalize_url, stream_urls
+
+# Largest request body the control API reads
+MAX_BODY_BYTES = 1024 * 1024
+JSON_CONTENT_TYPE = 'application/json'
+
+# Commands the monitoring loop drains from its command queue
+ADD_URLS = 'add'
+REMOVE_URLS = 'remove'
+SET_INTERVAL = 'interval'
+STOP = 'stop'
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ControlServer:
+    """Local HTTP API for a running monitor, on a TCP port of 127.0.0.1 or a Unix socket.
+
+    Reads (status, product information, metrics) are answered straight from the monitor, while changes are queued
+    on `monitor.commands` and applied by the monitoring loop between batches, so they never race a check in flight.
+
+    GET    /status                    monitored products, check interval and whether the monitor is stopping
+    GET    /products[?url=URL]        cached product information of every (or one) monitored product
+    POST   /urls      {"urls": [...], "priority": "normal"}   start monitoring products
+    DELETE /urls      {"urls": [...]}                        stop monitoring products
+    PUT    /interval  {"seconds": 60}                        change the check interval
+    GET    /metrics[?format=json]     Prometheus text or a JSON summary of the metrics
+    POST   /shutdown                  finish the checks in flight, flush state and exit
+
+    Changes must be sent as `Content-Type: application/json`, and requests whose Host header isn't the control
+    address are refused, so a web page open in a browser can't reach the API. On a TCP port, which any local user
+    can connect to, changes also need `Authorization: Bearer <token>` with the token generated at startup and written
+    to `token_path`. A Unix socket is only accessible to the current user, so it needs no token.
+    """
+
+    def __init__(self, monitor, port: int = None, socket_path: str = None, host: str = '127.0.0.1',
+                 token_path: str = None):
+        if (port is None) == (socket_path is None):
+            raise ValueError("Expected either a control port or a control socket")
+        self.monitor = monitor
+        self.socket_path = socket_path
+        self.token_path = None
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)  # Left behind by a monitor that didn't shut down cleanly
+            self._httpd = ThreadingUnixHTTPServer(socket_path, self._handler_class())
+            os.chmod(socket_path, 0o600)
+            self.token = None
+            self.allowed_hosts = None  # Clients pick any name for a socket, and browsers can't connect to one
+        else:
+            self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+            self._httpd.daemon_threads = True
+            self.token = secrets.token_urlsafe(32)
+            port = self._httpd.server_port
+            self.allowed_hosts = {f"[{host}]:{port}" if ':' in host else f"{host}:{port}"}
+            if host in ('127.0.0.1', '::1'):
+                self.allowed_hosts.add(f"localhost:{port}")
+            if token_path:
+                self._write_token(token_path)
+        self._thread = None
+
+    @property
+    def address(self) -> str:
+        if self.socket_path:
+            return f"unix:{self.socket_path}"
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'ControlServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mstock-control", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        if self.token_path and os.path.exists(self.token_path):
+            os.unlink(self.token_path)
+
+    def _write_token(self, path: str):
+        """Write the token to a file only the current user can read"""
+        if os.path.exists(path):
+            os.unlink(path)  # Left behind by a monitor that didn't shut down cleanly, maybe with wider permissions
+        with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as file:
+            file.write(self.token)
+        self.token_path = path
+
+    def host_allowed(self, host: str) -> bool:
+        return self.allowed_hosts is None or host in self.allowed_hosts
+
+    def token_valid(self, authorization: str) -> bool:
+        if self.token is None:
+            return True
+        scheme, _, token = (authorization or '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(token.strip(), self.token)
+
+    def status(self) -> dict:
+        return {'monitored': len(self.monitor.monitored_urls()), 'interval': self.monitor.interval,
+                'stopping': self.monitor.stopping}
+
+    def products(self, url: str = None):
+        if url is not None:
+            url = normalize_url(url)
+            if url not in set(self.monitor.monitored_urls()):
+                return None
+            urls = [url]
+        else:
+            urls = self.monitor.monitored_urls()
+        products = []
+        for monitored_url in urls:
+            product_info = self.monitor.product_info(monitored_url)
+            products.append({'url': monitored_url, 'product': product_info.to_dict() if product_info else None})
+        return products[0] if url is not None else products
+
+    def add_urls(self, body: dict) -> dict:
+        priority = body.get('priority', 'normal')
+        if priority not in PRIORITY_INTERVAL_MULTIPLIERS:
+            raise ValueError(f"Unknown priority '{priority}', expected one of: "
+                             f"{', '.join(PRIORITY_INTERVAL_MULTIPLIERS)}")
+        urls, invalid = [], []
+        for url, valid in stream_urls(self._url_list(body)):
+            (urls if valid else invalid).append(url)
+        if urls:
+            self.monitor.commands.put((ADD_URLS, urls, priority))
+        return {'queued': urls, 'invalid': invalid}
+
+    def remove_urls(self, body: dict) -> dict:
+        urls = list(dict.fromkeys(normalize_url(url) for url in self._url_list(body)))
+        if urls:
+            self.monitor.commands.put((REMOVE_URLS, urls))
+        return {'queued': urls}
+
+    def set_interval(self, body: dict) -> dict:
+        seconds = body.get('seconds')
+        if isinstance(seconds, bool) or not isinstance(seconds, (int, float)) or seconds <= 0:
+            raise ValueError("Expected a positive number of seconds")
+        self.monitor.commands.put((SET_INTERVAL, seconds))
+        return {'queued': seconds}
+
+    def shutdown(self) -> dict:
+        self.monitor.request_stop()
+        return {'stopping': True}
+
+    @staticmethod
+    def _url_list(body: dict) -> list:
+        urls = body.get('urls')
+        if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+            raise ValueError('Expected "urls" to be a list of urls')
+        return urls
+
+    def _handler_class(self):
+        control = self
+
+        class ControlHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if not self._host_allowed():
+                    return
+                parts = urlsplit(self.path)
+                query = parse_qs(parts.query)
+                if parts.path == '/status':
+                    self._send_json(200, control.status())
+                elif parts.path == '/products':
+                    products = control.products(query['url'][0] if 'url' in query else None)
+                    if products is None:
+                        self._send_json(404, {'error': 'Product is not monitored'})
+                    else:
+                        self._send_json(200, products)
+                elif parts.path == '/metrics':
+                    if query.get('format') == ['json']:
+                        self._send_json(200, REGISTRY.to_dict())
+                    else:
+                        self._send(200, REGISTRY.render_prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+                else:
+                    self._send_json(404, {'error': 'Not found'})
+
+            def do_POST(self):
+                self._dispatch({'/urls': control.add_urls, '/shutdown': lambda body: control.shutdown()})
+
+            def do_DELETE(self):
+                self._dispatch({'/urls': control.remove_urls})
+
+            def do_PUT(self):
+                self._dispatch({'/interval': control.set_interval})
+
+            def _dispatch(self, routes):
+                if not self._host_allowed():
+                    return
+                route = routes.get(urlsplit(self.path).path)
+                if route is None:
+                    self._send_json(404, {'error': 'Not found'})
+                    return
+                if not control.token_valid(self.headers.get('Authorization')):
+                    self._send_json(401, {'error': 'Expected the control token as "Authorization: Bearer <token>"'})
+                    return
+                # Browsers send text/plain and form bodies across origins without asking first, but never JSON
+                content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+                if content_type != JSON_CONTENT_TYPE:
+                    self._send_json(415, {'error': f'Expected Content-Type: {JSON_CONTENT_TYPE}'})
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length') or 0)
+                    if length > MAX_BODY_BYTES:
+                        raise ValueError("Request body too large")
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                    if not isinstance(body, dict):
+                        raise ValueError("Expected a JSON object")
+                    self._send_json(202, route(body))
+                except ValueError as e:
+                    self._send_json(400, {'error': str(e)})
+
+            def _host_allowed(self) -> bool:
+                """Refuse requests for other host names, which is how a web page reaches the API via DNS rebinding"""
+                if control.host_allowed(self.headers.get('Host')):
+                    return True
+                self._send_json(403, {'error': 'Unexpected Host header'})
+                return False
+
+            def _send_json(self, code, data):
+                self._send(code, json.dumps(data, default=str).encode('utf-8'), JSON_CONTENT_TYPE)
+
+            def _send(self, code, body: bytes, content_type: str):
+                self.send_response(code)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return ControlHandler
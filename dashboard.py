@@ -0,0 +1,165 @@
+import shutil
+import sys
+import time
+from datetime import datetime
+from typing import Optional
+
+from constants import COLORS, DEFAULT_DASHBOARD_FPS
+from product import ProductInfo
+
+SUMMARY_HEADERS = ["ID", "Brand", "Product", "Status", "Price", "Last Checked"]
+CHECK_STATUS_TEXT = {True: ("In Stock", 'green'), False: ("Out of Stock", 'red'), None: ("Unknown", 'yellow')}
+
+# ANSI control sequences used to redraw lines in place
+CLEAR_LINE = '\033[2K'
+CLEAR_TO_END = '\033[J'
+HIDE_CURSOR = '\033[?25l'
+SHOW_CURSOR = '\033[?25h'
+
+
+def _truncate(text: str, length: int) -> str:
+    return text[:length] + "..." if len(text) > length else text
+
+
+def summary_row(url: str, info: Optional[ProductInfo], status: str = None) -> list:
+    """One row of the status summary table, with long values truncated"""
+    if not info:
+        return ["N/A", "N/A", _truncate(url.rsplit('/', 1)[-1], 20), status or "Unknown", "N/A", "Never"]
+    last_checked = info.last_checked.strftime("%H:%M:%S") if info.last_checked else "Never"
+    return [_truncate(info.id, 8), _truncate(info.brand or "", 15), _truncate(info.name or "", 20),
+            status or str(info.status), info.price or "N/A", last_checked]
+
+
+class Dashboard:
+    """Live status table that redraws only the rows that changed, at most `fps` times a second.
+
+    Must be updated from a single thread. When the output is not a terminal, changed rows are appended as plain lines
+    instead of being redrawn.
+    """
+
+    def __init__(self, stream=None, fps: float = DEFAULT_DASHBOARD_FPS, use_colors: bool = True):
+        self.stream = stream or sys.stdout
+        self.interactive = self.stream.isatty()
+        self.frame_interval = 1 / fps if fps > 0 else 0
+        self.use_colors = use_colors and self.interactive
+        self.title = "MStock"
+        self.status_line = ""
+        self._appended_status = ""
+        self._rows = {}  # url -> (position, cells, color)
+        self._order = []
+        self._widths = [len(header) for header in SUMMARY_HEADERS]
+        self._dirty = set()
+        self._layout_changed = True
+        self._drawn_rows = 0  # rows on screen after the last frame
+        self._drawn_lines = 0  # lines on screen after the last frame, the cursor sits just below them
+        self._last_frame = 0.0
+        if self.interactive:
+            self.stream.write(HIDE_CURSOR)
+
+    def update(self, url: str, status: Optional[bool], info: Optional[ProductInfo]):
+        """Record the latest result for a product"""
+        text, color = CHECK_STATUS_TEXT[status]
+        cells = summary_row(url, info, text)
+        entry = self._rows.get(url)
+        if entry and entry[1] == cells:
+            return
+        if entry is None:
+            position = len(self._order)
+            self._order.append(url)
+        else:
+            position = entry[0]
+        self._rows[url] = (position, cells, color)
+        self._dirty.add(url)
+
+        # Column widths only ever grow, and only a wider column forces a full redraw
+        for column, cell in enumerate(cells):
+            if len(cell) > self._widths[column]:
+                self._widths[column] = len(cell)
+                self._layout_changed = True
+
+    def set_status(self, text: str):
+        self.status_line = text
+
+    def refresh(self, force: bool = False):
+        """Draw pending changes, unless the previous frame was drawn less than a frame interval ago"""
+        now = time.monotonic()
+        if not force and now - self._last_frame < self.frame_interval:
+            return
+        self._last_frame = now
+
+        if not self.interactive:
+            self._append_changes()
+        elif self._layout_changed or self._visible_rows() < self._drawn_rows:
+            self._draw_all()
+        else:
+            self._draw_changes()
+        self._dirty.clear()
+        self.stream.flush()
+
+    def close(self):
+        """Draw the final frame and give the terminal back"""
+        self.refresh(force=True)
+        if self.interactive:
+            self.stream.write(SHOW_CURSOR)
+            self.stream.flush()
+
+    def _visible_rows(self) -> int:
+        # Leave room for the title, header, separator, status line and the prompt
+        return min(len(self._order), max(1, shutil.get_terminal_size().lines - 5))
+
+    def _format_row(self, url: str) -> str:
+        _, cells, color = self._rows[url]
+        padded = [cell.ljust(width) for cell, width in zip(cells, self._widths)]
+        padded[3] = self._style(padded[3], color)
+        return " | ".join(padded)
+
+    def _footer(self) -> str:
+        hidden = len(self._order) - self._visible_rows()
+        more = f" (+{hidden} more not shown)" if hidden > 0 else ""
+        return self._style(f"{datetime.now():%H:%M:%S} {self.status_line}{more}", 'dim')
+
+    def _draw_all(self):
+        visible = self._visible_rows()
+        lines = [self._style(self.title, 'bold'),
+                 self._style(" | ".join(h.ljust(w) for h, w in zip(SUMMARY_HEADERS, self._widths)), 'bold'),
+                 "-" * (sum(self._widths) + 3 * (len(self._widths) - 1))]
+        lines.extend(self._format_row(url) for url in self._order[:visible])
+        lines.append(self._footer())
+
+        self._move_up(self._drawn_lines)
+        self.stream.write(CLEAR_TO_END + "\n".join(lines) + "\n")
+        self._drawn_rows = visible
+        self._drawn_lines = len(lines)
+        self._layout_changed = False
+
+    def _draw_changes(self):
+        visible = self._visible_rows()
+        # Rewrite changed rows that are already on screen, then the footer and any new rows below them
+        for url in self._dirty:
+            position = self._rows[url][0]
+            if position < self._drawn_rows:
+                offset = self._drawn_lines - (3 + position)
+                self._move_up(offset)
+                self.stream.write(f"\r{CLEAR_LINE}{self._format_row(url)}\r\033[{offset}B")
+
+        self._move_up(1)
+        new_rows = [self._format_row(url) for url in self._order[self._drawn_rows:visible]]
+        self.stream.write(CLEAR_TO_END + "\n".join(new_rows + [self._footer()]) + "\n")
+        self._drawn_lines += len(new_rows)
+        self._drawn_rows = visible
+
+    def _append_changes(self):
+        for url in sorted(self._dirty, key=lambda changed: self._rows[changed][0]):
+            self.stream.write(" | ".join(self._rows[url][1]) + "\n")
+        if self.status_line != self._appended_status:
+            self.stream.write(self.status_line + "\n")
+            self._appended_status = self.status_line
+
+    def _move_up(self, lines: int):
+        if lines:
+            self.stream.write(f"\r\033[{lines}A")
+
+    def _style(self, text: str, *styles) -> str:
+        if not self.use_colors:
+            return text
+        return ''.join(COLORS[style] for style in styles) + text + COLORS['reset']
@@ -0,0 +1,221 @@
+"""Append-only journal of product status and price transitions.
+
+Usage: python journal.py [--file .mstock_journal.sqlite3] {restocked,frequency,out-of-stock,history} ...
+"""
+import argparse
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from constants import DEFAULT_JOURNAL_PATH, SECONDS_PER_DAY
+from printer import CustomPrinter
+from product import StockStatus, format_cents
+from sqlite_store import BatchedConnection
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS transitions (id INTEGER PRIMARY KEY, url TEXT NOT NULL, at REAL NOT NULL, '
+    'status TEXT NOT NULL, previous_status TEXT, price_cents INTEGER, previous_price_cents INTEGER, '
+    'restock INTEGER NOT NULL DEFAULT 0, out_of_stock_seconds REAL)',
+    'CREATE INDEX IF NOT EXISTS transitions_url_at ON transitions (url, at)',
+    'CREATE INDEX IF NOT EXISTS transitions_at ON transitions (at)',
+    # Restocks carry how long the product was out of stock, so medians are read straight off these indexes
+    'CREATE INDEX IF NOT EXISTS transitions_restock_url ON transitions (url, out_of_stock_seconds) WHERE restock = 1',
+    'CREATE INDEX IF NOT EXISTS transitions_restock_duration ON transitions (out_of_stock_seconds) WHERE restock = 1',
+)
+
+
+@dataclass
+class Transition:
+    url: str
+    at: float
+    status: StockStatus
+    previous_status: Optional[StockStatus]
+    price_cents: Optional[int]
+    previous_price_cents: Optional[int]
+    out_of_stock_seconds: Optional[float] = None
+
+    @property
+    def is_restock(self) -> bool:
+        return self.previous_status is StockStatus.OUT_OF_STOCK and self.status is StockStatus.IN_STOCK
+
+
+class StatusJournal:
+    """Records every stock status or price change observed for a product in an indexed SQLite file"""
+
+    def __init__(self, path: str = DEFAULT_JOURNAL_PATH):
+        self.path = path
+        # Transitions are committed in batches
+        self._db = BatchedConnection(path, SCHEMA)
+        self._lock = threading.Lock()
+        self._latest: Dict[str, Tuple[StockStatus, Optional[int], Optional[float]]] = {}  # status, price, out since
+
+    def record(self, url: str, status: StockStatus, price_cents: Optional[int] = None,
+               at: float = None) -> Optional[Transition]:
+        """Journal an observation if it changes the product's status or price. Returns the recorded transition"""
+        status = StockStatus(status)
+        if status is StockStatus.UNKNOWN:
+            return None
+        at = time.time() if at is None else at
+
+        with self._lock:
+            previous = self._latest.get(url) or self._load_latest(url)
+            if previous:
+                previous_status, previous_price, out_since = previous
+                # A product without a price this time keeps its last known price
+                price_cents = previous_price if price_cents is None else price_cents
+                if status is previous_status and price_cents == previous_price:
+                    return None
+            else:
+                previous_status = previous_price = out_since = None
+
+            transition = Transition(url, at, status, previous_status, price_cents, previous_price)
+            if transition.is_restock and out_since is not None:
+                transition.out_of_stock_seconds = at - out_since
+            if status is StockStatus.OUT_OF_STOCK and previous_status is not StockStatus.OUT_OF_STOCK:
+                out_since = at
+            elif status is not StockStatus.OUT_OF_STOCK:
+                out_since = None
+            self._latest[url] = (status, price_cents, out_since)
+
+            self._db.write('INSERT INTO transitions (url, at, status, previous_status, price_cents, '
+                           'previous_price_cents, restock, out_of_stock_seconds) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           (url, at, status.value, previous_status.value if previous_status else None, price_cents,
+                            previous_price, int(transition.is_restock), transition.out_of_stock_seconds))
+            return transition
+
+    def restocked_since(self, since: float) -> List[Transition]:
+        """Restocks at or after an epoch time, most recent first"""
+        return self._transitions('SELECT url, at, status, previous_status, price_cents, previous_price_cents, '
+                                 'out_of_stock_seconds FROM transitions WHERE at >= ? AND restock = 1 '
+                                 'ORDER BY at DESC', (since,))
+
+    def history(self, url: str, since: float = 0) -> List[Transition]:
+        """Every transition of one product, oldest first"""
+        return self._transitions('SELECT url, at, status, previous_status, price_cents, previous_price_cents, '
+                                 'out_of_stock_seconds FROM transitions WHERE url = ? AND at >= ? ORDER BY at',
+                                 (url, since))
+
+    def restock_frequency(self, now: float = None) -> List[Tuple[str, int, float]]:
+        """(url, restocks, restocks per day since the product was first journaled), most frequent first"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._db.commit()
+            rows = self._db.execute(
+                'SELECT url, COUNT(*), (SELECT MIN(at) FROM transitions AS first WHERE first.url = restocks.url) '
+                'FROM transitions AS restocks WHERE restock = 1 GROUP BY url').fetchall()
+        frequencies = [(url, count, count / max((now - first_at) / SECONDS_PER_DAY, 1 / 24))
+                       for url, count, first_at in rows]
+        return sorted(frequencies, key=lambda frequency: frequency[2], reverse=True)
+
+    def median_out_of_stock_seconds(self, url: str = None) -> Optional[float]:
+        """Median time between going out of stock and restocking, for one product or all of them"""
+        condition, parameters = ('url = ? AND ', (url,)) if url else ('', ())
+        with self._lock:
+            self._db.commit()
+            count = self._db.execute(f'SELECT COUNT(*) FROM transitions WHERE {condition}restock = 1 '
+                                     'AND out_of_stock_seconds IS NOT NULL', parameters).fetchone()[0]
+            if not count:
+                return None
+            # Read the middle one or two values off the index instead of sorting every duration
+            middle = self._db.execute(f'SELECT out_of_stock_seconds FROM transitions WHERE {condition}restock = 1 '
+                                      'AND out_of_stock_seconds IS NOT NULL ORDER BY out_of_stock_seconds '
+                                      'LIMIT ? OFFSET ?', parameters + (2 - count % 2, (count - 1) // 2)).fetchall()
+        return sum(value for value, in middle) / len(middle)
+
+    def flush(self):
+        """Commit pending transitions to disk"""
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db:
+                self._db.close()
+                self._db = None
+
+    def _load_latest(self, url: str):
+        """Restore a product's last journaled state, so a restarted monitor continues where it left off"""
+        row = self._db.execute('SELECT status, price_cents FROM transitions WHERE url = ? ORDER BY at DESC LIMIT 1',
+                               (url,)).fetchone()
+        if row is None:
+            return None
+        status = StockStatus(row[0])
+        out_since = None
+        if status is StockStatus.OUT_OF_STOCK:
+            out_since = self._db.execute('SELECT MAX(at) FROM transitions WHERE url = ? AND status = ? '
+                                         'AND (previous_status IS NULL OR previous_status != status)',
+                                         (url, status.value)).fetchone()[0]
+        self._latest[url] = (status, row[1], out_since)
+        return self._latest[url]
+
+    def _transitions(self, query: str, parameters: tuple) -> List[Transition]:
+        with self._lock:
+            self._db.commit()
+            rows = self._db.execute(query, parameters).fetchall()
+        return [Transition(url, at, StockStatus(status), StockStatus(previous) if previous else None, price,
+                           previous_price, out_of_stock_seconds)
+                for url, at, status, previous, price, previous_price, out_of_stock_seconds in rows]
+
+
+def _format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "N/A"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}m"
+    if seconds < SECONDS_PER_DAY:
+        return f"{seconds / 3600:.1f}h"
+    return f"{seconds / SECONDS_PER_DAY:.1f}d"
+
+
+def _format_time(at: float) -> str:
+    return datetime.fromtimestamp(at).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _format_price(cents: Optional[int]) -> str:
+    return format_cents(cents) if cents is not None else "N/A"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the product status journal')
+    parser.add_argument('--file', default=DEFAULT_JOURNAL_PATH, help='Journal file written by main.py')
+    commands = parser.add_subparsers(dest='command', required=True)
+    restocked = commands.add_parser('restocked', help='Products that restocked recently')
+    restocked.add_argument('--since', type=float, default=3600, help='Look back this many seconds (default: an hour)')
+    commands.add_parser('frequency', help='How often each product restocks')
+    out_of_stock = commands.add_parser('out-of-stock', help='Median time products stay out of stock')
+    out_of_stock.add_argument('url', nargs='?', help='Only this product')
+    history = commands.add_parser('history', help='Every status and price change of a product')
+    history.add_argument('url')
+    arguments = parser.parse_args()
+
+    printer = CustomPrinter()
+    journal = StatusJournal(arguments.file)
+    try:
+        if arguments.command == 'restocked':
+            transitions = journal.restocked_since(time.time() - arguments.since)
+            printer.section(f"Restocked in the last {_format_duration(arguments.since)}")
+            printer.table(["Restocked At", "Out of Stock For", "Price", "URL"],
+                          [[_format_time(transition.at), _format_duration(transition.out_of_stock_seconds),
+                            _format_price(transition.price_cents), transition.url] for transition in transitions])
+        elif arguments.command == 'frequency':
+            printer.section("Restock Frequency")
+            printer.table(["Restocks", "Per Day", "Median Out of Stock", "URL"],
+                          [[count, f"{per_day:.2f}", _format_duration(journal.median_out_of_stock_seconds(url)), url]
+                           for url, count, per_day in journal.restock_frequency()])
+        elif arguments.command == 'out-of-stock':
+            median = journal.median_out_of_stock_seconds(arguments.url)
+            printer.info(f"Median time out of stock: {_format_duration(median)}")
+        else:
+            printer.section("Status History")
+            printer.table(["Time", "Status", "Price", "Previous Price"],
+                          [[_format_time(transition.at), transition.status, _format_price(transition.price_cents),
+                            _format_price(transition.previous_price_cents)]
+                           for transition in journal.history(arguments.url)])
+    finally:
+        journal.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,57 @@
 import argparse
+import atexit
 import os
+import signal
 from pathlib import Path
 
 from dotenv import load_dotenv
 
-from constants import MACYS_PRODUCT_URL_PREFIX, DEFAULT_CHECK_INTERVAL_IN_SECONDS
+from constants import (DEFAULT_CHECK_INTERVAL_IN_SECONDS, DEFAULT_CONCURRENCY,
+                       DEFAULT_HOST_RATE_PER_SECOND, DEFAULT_CACHE_PATH, DEFAULT_CACHE_TTL_IN_SECONDS,
+                       DEFAULT_CACHE_MAX_ENTRIES, DEFAULT_JOURNAL_PATH, DEFAULT_CONNECT_TIMEOUT_IN_SECONDS,
+                       DEFAULT_READ_TIMEOUT_IN_SECONDS, DEFAULT_MAX_RETRIES, PRODUCT_API_URL,
+                       DEFAULT_NOTIFICATION_COALESCE_WINDOW_IN_SECONDS, DEFAULT_NOTIFICATION_TIMEOUT_IN_SECONDS,
+                       DEFAULT_ALERT_DEBOUNCE_IN_SECONDS, SECONDS_PER_DAY,
+                       DISPLAY_MODES, DEFAULT_CONTROL_PORT, DEFAULT_CONTROL_TOKEN_PATH, DEFAULT_CHECKPOINT_PATH,
+                       DEFAULT_CHECKPOINT_INTERVAL_IN_SECONDS, DEFAULT_PRICE_HISTORY_PATH, DEFAULT_PRICE_WINDOW_IN_DAYS,
+                       DEFAULT_PAGE_ARCHIVE_PATH)
+from alerts import ALERT_EVENTS, AVERAGE_DROP, AlertTracker, PRICE_DROP, RESTOCK
+from dashboard import Dashboard
 from input import CustomInput
-from notifications import EmailConfig, SMSConfig, NotificationService
+from metrics import REGISTRY, start_metrics_server
+from notifications import (EmailConfig, FileBackend, SMSConfig, NotificationService, NotificationDispatcher,
+                           WebhookBackend)
+from parsers import PARSERS, DEFAULT_PARSER, get_parser
 from printer import CustomPrinter
-from stock_checker import StockChecker
-from utils import verify_urls
+from retailers import supported_domains
+from utils import normalize_url
+from watchlist import Watchlist
+
+
+# Urls printed at startup, a large watchlist is summarised
+MAX_LISTED_URLS = 20
 
 
 def test_notifications(notification_service, printer):
-    """Test email and SMS notifications"""
-    if not notification_service:
+    """Test every configured notification channel"""
+    if not notification_service or not notification_service.backends:
         printer.error("No notification methods configured")
         return False
 
     test_subject = "🧪 Test Notification"
     test_message = "This is a test notification from the MStock program."
-    success = True
-
-    if notification_service.email_config:
-        printer.info("Testing email notification...")
-        if notification_service.send_email(test_subject, test_message):
-            printer.success("Email test successful!")
-        else:
-            printer.error("Email test failed")
-            success = False
 
-    if notification_service.sms_config:
-        printer.info("Testing SMS notification...")
-        if notification_service.send_sms(test_message):
-            printer.success("SMS test successful!")
+    # Every channel is tested at once, like notifications are sent
+    printer.info(f"Testing {', '.join(backend.description for backend in notification_service.backends)} "
+                 f"notifications...")
+    results = notification_service.send(test_subject, test_message)
+    for backend, delivered in results.items():
+        if delivered:
+            printer.success(f"{backend.description} test successful!")
         else:
-            printer.error("SMS test failed")
-            success = False
+            printer.error(f"{backend.description} test failed")
 
-    return success
+    return all(results.values())
 
 
 def setup_configuration():
@@ -104,51 +117,192 @@ def main():
 
     # Positional args
     parser.add_argument('urls', nargs='*', help='The urls of products to monitor.')
+    parser.add_argument('-f', '--urls-file', metavar='PATH',
+                        help='Read product urls from this file, one per line ("-" for stdin). '
+                             'Changes to the file are picked up while monitoring')
 
     # Monitoring flags
+    parser.add_argument('--variant', action='append', nargs=2, default=[], metavar=('URL', 'VARIANT'),
+                        help='Watch one size/color of a product, e.g. --variant URL "Navy / M" (can be repeated)')
     parser.add_argument('-i', '--interval', type=int, default=DEFAULT_CHECK_INTERVAL_IN_SECONDS,
                         help='Check interval in seconds')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Adapt each product\'s check interval to how often it changes and fails')
+    parser.add_argument('--high-priority', action='append', default=[], metavar='URL',
+                        help='Check this product twice as often (can be repeated)')
+    parser.add_argument('--low-priority', action='append', default=[], metavar='URL',
+                        help='Check this product half as often (can be repeated)')
     parser.add_argument('-t', '--test', action='store_true', help='Test email and SMS notifications')
+    parser.add_argument('-c', '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Number of products to check in parallel (1 checks items one at a time)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Split the watchlist across this many worker processes')
+    parser.add_argument('--rate', type=float,
+                        help=f'Maximum requests per second to each host (0 for no limit, default: each retailer\'s '
+                             f'own budget, {DEFAULT_HOST_RATE_PER_SECOND:g} for Macy\'s)')
+    parser.add_argument('--parser', choices=list(PARSERS),
+                        help=f'Product page parser backend (default: each retailer\'s own, {DEFAULT_PARSER} for '
+                             'Macy\'s)')
+    parser.add_argument('--display', choices=DISPLAY_MODES, default='log',
+                        help='How check results are shown: a log of every check, a live status table, or nothing')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print full product details for every check')
+
+    # Network arguments
+    network_group = parser.add_argument_group('Network')
+    network_group.add_argument('--connect-timeout', type=float, default=DEFAULT_CONNECT_TIMEOUT_IN_SECONDS,
+                               help='Seconds to wait for a connection to a product page')
+    network_group.add_argument('--read-timeout', type=float, default=DEFAULT_READ_TIMEOUT_IN_SECONDS,
+                               help='Seconds to wait for a product page to respond')
+    network_group.add_argument('--product-api', action='store_true',
+                               help='Look products up in batches from the structured product API, '
+                                    'falling back to the product page')
+    network_group.add_argument('--api-url', default=PRODUCT_API_URL,
+                               help='Product API URL, with {ids} replaced by comma-separated product IDs')
+    network_group.add_argument('--identities', type=int, default=1, metavar='N',
+                               help='Spread requests over N client identities, each with its own headers, cookies '
+                                    'and --rate budget')
+    network_group.add_argument('--proxy', action='append', default=[], metavar='URL',
+                               help='Send an identity\'s requests through this proxy (can be repeated, one identity '
+                                    'per proxy)')
+    network_group.add_argument('--identities-file', metavar='PATH',
+                               help='JSON list of identities with optional "name", "headers" and "proxy" keys')
+    network_group.add_argument('--retries', type=int, default=DEFAULT_MAX_RETRIES,
+                               help='Retries for connection errors, timeouts and 429/5xx responses')
+
+    # Cache arguments
+    cache_group = parser.add_argument_group('Cache')
+    cache_group.add_argument('--cache-file', default=DEFAULT_CACHE_PATH,
+                             help='SQLite file that keeps product information across restarts ("" for memory only)')
+    cache_group.add_argument('--cache-ttl', type=float, default=DEFAULT_CACHE_TTL_IN_SECONDS,
+                             help='Seconds before cached product information expires (0 to never expire)')
+    cache_group.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_MAX_ENTRIES,
+                             help='Maximum number of products kept in memory')
+    cache_group.add_argument('--compact-cache', action='store_true',
+                             help='Keep product information in a compact columnar table in memory only')
+
+    cache_group.add_argument('--journal-file', default=DEFAULT_JOURNAL_PATH,
+                             help='SQLite file that records every status and price change ("" to disable)')
+
+    cache_group.add_argument('--price-history-file', default=DEFAULT_PRICE_HISTORY_PATH,
+                             help='File that keeps the price history of every product ("" to disable)')
+
+    cache_group.add_argument('--checkpoint-file', default=DEFAULT_CHECKPOINT_PATH,
+                             help='File that snapshots the monitor state to resume from on restart ("" to disable)')
+    cache_group.add_argument('--checkpoint-interval', type=float, default=DEFAULT_CHECKPOINT_INTERVAL_IN_SECONDS,
+                             help='Seconds between checkpoints')
+    cache_group.add_argument('--no-resume', action='store_true',
+                             help='Start from scratch instead of resuming from the last checkpoint')
+    cache_group.add_argument('--record-pages', nargs='?', const=DEFAULT_PAGE_ARCHIVE_PATH, metavar='PATH',
+                             help='Archive every fetched product page, to replay with page_archive.py '
+                                  f'(default file: {DEFAULT_PAGE_ARCHIVE_PATH})')
+
+    # Metrics arguments
+    metrics_group = parser.add_argument_group('Metrics')
+    metrics_group.add_argument('--metrics-port', type=int,
+                               help='Serve Prometheus metrics on http://127.0.0.1:PORT/metrics')
+    metrics_group.add_argument('--metrics-file', help='Write a JSON summary of the metrics to this file on exit')
 
     # Notification arguments
     notification_group = parser.add_argument_group('Notifications')
     notification_group.add_argument('--email-to', help='Email address to send notifications to')
     notification_group.add_argument('--phone-to', help='Phone number to send SMS notifications to')
+    notification_group.add_argument('--sms-gateway', metavar='DOMAIN',
+                                    help='Send SMS through this carrier email-to-SMS gateway, e.g. tmomail.net, '
+                                         'instead of iMessage (uses the email account)')
+    notification_group.add_argument('--webhook', action='append', default=[], metavar='URL',
+                                    help='POST notifications as JSON to this URL (can be repeated)')
+    notification_group.add_argument('--notify-file', metavar='PATH',
+                                    help='Append notifications to this file as JSON lines ("-" for stdout)')
+    notification_group.add_argument('--notify-timeout', type=float, default=DEFAULT_NOTIFICATION_TIMEOUT_IN_SECONDS,
+                                    help='Seconds each notification channel gets to deliver a notification')
+    notification_group.add_argument('--notify-window', type=float,
+                                    default=DEFAULT_NOTIFICATION_COALESCE_WINDOW_IN_SECONDS,
+                                    help='Seconds to collect restocks into a single digest notification')
+
+    # Continuous monitoring arguments
+    continuous_group = parser.add_argument_group('Continuous monitoring')
+    continuous_group.add_argument('--continuous', action='store_true',
+                                  help='Keep monitoring products after they restock, until interrupted')
+    continuous_group.add_argument('--notify-on', action='append', choices=ALERT_EVENTS,
+                                  help=f'Transitions to notify about (can be repeated, default: {RESTOCK})')
+    continuous_group.add_argument('--price-below', type=float, metavar='DOLLARS',
+                                  help=f'Price threshold for {PRICE_DROP} notifications (enables them)')
+    continuous_group.add_argument('--drop-percent', type=float, metavar='PERCENT',
+                                  help=f'Percent below its average a price has to fall for {AVERAGE_DROP} '
+                                       'notifications (enables them)')
+    continuous_group.add_argument('--drop-window-days', type=float, default=DEFAULT_PRICE_WINDOW_IN_DAYS,
+                                  help='Days the average price for --drop-percent is taken over')
+    continuous_group.add_argument('--debounce', type=float, default=DEFAULT_ALERT_DEBOUNCE_IN_SECONDS,
+                                  help='Seconds after a notification during which the same product stays quiet')
+
+    # Daemon arguments
+    daemon_group = parser.add_argument_group('Daemon')
+    daemon_group.add_argument('--daemon', action='store_true',
+                              help='Run unattended: never prompt, keep running with an empty watchlist and take '
+                                   'commands from a local control API')
+    daemon_group.add_argument('--control-port', type=int, default=DEFAULT_CONTROL_PORT,
+                              help='Serve the control API on http://127.0.0.1:PORT')
+    daemon_group.add_argument('--control-socket', metavar='PATH',
+                              help='Serve the control API on this Unix socket instead of a port')
+    daemon_group.add_argument('--control-token-file', default=DEFAULT_CONTROL_TOKEN_PATH, metavar='PATH',
+                              help='Write the token that changes through the control port need to this file')
 
     arguments = parser.parse_args()
+    continuous_only = [flag for flag, value in (('--notify-on', arguments.notify_on),
+                                                ('--price-below', arguments.price_below),
+                                                ('--drop-percent', arguments.drop_percent)) if value is not None]
+    if continuous_only and not arguments.continuous:
+        parser.error(f"--continuous is required by {', '.join(continuous_only)}")
 
     # Setup notifications if configured
     notification_service = None
-    if any([arguments.email_to, arguments.phone_to]):
+    if any([arguments.email_to, arguments.phone_to, arguments.webhook, arguments.notify_file]):
         email_config = None
         sms_config = None
+        backends = []
 
         printer.section('Notification Information')
 
-        if arguments.email_to:
+        # An SMS gateway is reached over email, through the same account
+        if arguments.email_to or (arguments.phone_to and arguments.sms_gateway):
             # Check if email configuration exists and run setup if needed
             if not Path('.env').exists() or not os.getenv('EMAIL_FROM') or not os.getenv('EMAIL_PASSWORD'):
                 printer.info("Email configuration not found.")
-                if not setup_configuration():
+                if arguments.daemon:
+                    # Setup is interactive, so a daemon goes without email until it has been configured
+                    printer.error("Run once without --daemon to set up email. Email notifications will not be "
+                                  "available.")
+                elif not setup_configuration():
                     printer.error("Email setup failed. Email notifications will not be available.")
                 else:
                     email_config = EmailConfig(sender_email=os.getenv('EMAIL_FROM'),
                                                sender_password=os.getenv('EMAIL_PASSWORD'),
-                                               recipient_email=arguments.email_to)
-                    printer.info(f"Email notifications will be sent to {arguments.email_to}")
+                                               recipient_email=arguments.email_to or "")
             else:
                 email_config = EmailConfig(sender_email=os.getenv('EMAIL_FROM'),
                                            sender_password=os.getenv('EMAIL_PASSWORD'),
-                                           recipient_email=arguments.email_to)
+                                           recipient_email=arguments.email_to or "")
+            if email_config and arguments.email_to:
                 printer.info(f"Email notifications will be sent to {arguments.email_to}")
 
         if arguments.phone_to:
-            sms_config = SMSConfig(to_number=arguments.phone_to)
-            printer.info(f"SMS notifications will be sent to {arguments.phone_to}")
+            if arguments.sms_gateway and not email_config:
+                printer.error("The SMS gateway needs email to be set up. SMS notifications will not be available.")
+            else:
+                sms_config = SMSConfig(to_number=arguments.phone_to, gateway=arguments.sms_gateway or "")
+                gateway = f" through {arguments.sms_gateway}" if arguments.sms_gateway else ""
+                printer.info(f"SMS notifications will be sent to {arguments.phone_to}{gateway}")
+
+        backends.extend(WebhookBackend(url) for url in arguments.webhook)
+        if arguments.notify_file:
+            backends.append(FileBackend(arguments.notify_file))
+        for backend in backends:
+            printer.info(f"Notifications will be sent to {backend.description}")
 
         print()  # Seperator
 
-        notification_service = NotificationService(email_config, sms_config)
+        notification_service = NotificationService(email_config, sms_config, backends,
+                                                   timeout=arguments.notify_timeout)
 
     # If test flag is set, run notification test and exit
     if arguments.test:
@@ -159,27 +313,169 @@ def main():
             printer.error("Some notification tests failed")
         return
 
-    if arguments.urls:
-        valid_urls, invalid_urls = verify_urls(arguments.urls)
+    if arguments.urls or arguments.urls_file or arguments.variant or arguments.daemon:
+        # The monitoring stack (requests, NumPy, SQLite) is imported only once there is something to monitor, so
+        # --help, -t and argument errors start without it
+        from checkpoint import Checkpointer
+        from control import ControlServer
+        from journal import StatusJournal
+        from page_archive import PageArchive
+        from price_history import PriceHistory
+        from product_cache import ProductCache, ProductTable
+        from session_pool import build_identities
+        from sharding import ShardedMonitor
+        from stock_checker import StockChecker
+
+        # Products with watched variants are monitored like any other url
+        variant_subscriptions = [(normalize_url(url), spec) for url, spec in arguments.variant]
+        try:
+            watchlist = Watchlist(arguments.urls + [url for url, _ in arguments.variant], arguments.urls_file).load()
+        except OSError as e:
+            printer.error(f"Error reading urls: {e}")
+            quit(1)
+        valid_urls = list(watchlist)
 
-        if not valid_urls:
+        if not valid_urls and not arguments.daemon:
             printer.warning('No valid urls were supplied')
-            printer.info(f'Please use urls that start with {MACYS_PRODUCT_URL_PREFIX}')
+            printer.info(f'Please use product urls of a supported retailer: {", ".join(supported_domains())}')
             printer.error('Exiting...')
             quit(1)
 
-        if invalid_urls:
-            printer.error('Invalid urls were found:')
-            print(*invalid_urls, sep='\n')
-            if not cinput.confirm('Would you like to proceed?'):
+        if watchlist.invalid_count:
+            printer.error(f'{watchlist.invalid_count} invalid urls were found:')
+            print(*watchlist.invalid_urls, sep='\n')
+            if watchlist.invalid_count > len(watchlist.invalid_urls):
+                print(f"... and {watchlist.invalid_count - len(watchlist.invalid_urls)} more")
+            # Urls read from a file are skipped without asking, stdin may be the file
+            if arguments.urls_file or arguments.daemon:
+                printer.warning('Skipping invalid urls')
+            elif not cinput.confirm('Would you like to proceed?'):
                 quit(1)
 
-        printer.info('Valid urls:')
-        print(*valid_urls, sep='\n')
+        if valid_urls:
+            printer.info(f'Valid urls ({len(valid_urls)}):')
+            print(*valid_urls[:MAX_LISTED_URLS], sep='\n')
+        if len(valid_urls) > MAX_LISTED_URLS:
+            print(f"... and {len(valid_urls) - MAX_LISTED_URLS} more")
+
+        if arguments.metrics_port:
+            start_metrics_server(arguments.metrics_port)
+            printer.info(f"Serving metrics on http://127.0.0.1:{arguments.metrics_port}/metrics")
+        if arguments.metrics_file:
+            atexit.register(REGISTRY.dump_json, arguments.metrics_file)
 
         # Initialize stock checker and start monitoring
-        checker = StockChecker(printer=printer, notification_service=notification_service)
-        checker.check_stock(valid_urls, interval=arguments.interval)
+        notification_dispatcher = None
+        if notification_service:
+            notification_dispatcher = NotificationDispatcher(notification_service,
+                                                             coalesce_window=arguments.notify_window)
+        if arguments.compact_cache:
+            product_cache = ProductTable()
+        else:
+            product_cache = ProductCache(arguments.cache_file or None, ttl=arguments.cache_ttl,
+                                         max_entries=arguments.cache_size)
+        alert_tracker = None
+        if arguments.continuous:
+            events = list(arguments.notify_on or [RESTOCK])
+            if arguments.price_below is not None and PRICE_DROP not in events:
+                events.append(PRICE_DROP)
+            if arguments.drop_percent is not None and AVERAGE_DROP not in events:
+                events.append(AVERAGE_DROP)
+            alert_tracker = AlertTracker(events, debounce=arguments.debounce,
+                                         price_below_cents=round(arguments.price_below * 100)
+                                         if arguments.price_below is not None else None,
+                                         drop_percent=arguments.drop_percent,
+                                         drop_window=arguments.drop_window_days * SECONDS_PER_DAY)
+        journal = StatusJournal(arguments.journal_file) if arguments.journal_file else None
+        price_history = PriceHistory(arguments.price_history_file) if arguments.price_history_file else None
+        # Sharded workers fetch the pages, so they each open the archive themselves
+        page_archive = None
+        if arguments.record_pages and arguments.workers == 1:
+            page_archive = PageArchive(arguments.record_pages)
+        if arguments.record_pages:
+            printer.info(f"Archiving fetched pages to {arguments.record_pages}")
+        checkpointer = None
+        if arguments.checkpoint_file:
+            checkpointer = Checkpointer(arguments.checkpoint_file, interval=arguments.checkpoint_interval,
+                                        printer=printer, resume=not arguments.no_resume)
+        identities = None
+        if arguments.identities > 1 or arguments.proxy or arguments.identities_file:
+            try:
+                identities = build_identities(arguments.identities, arguments.proxy, arguments.identities_file)
+            except (OSError, ValueError) as e:
+                printer.error(f"Error reading identities: {e}")
+                quit(1)
+            printer.info(f"Routing requests through {len(identities)} identities")
+        dashboard = Dashboard() if arguments.display == 'dashboard' else None
+        checker_printer = CustomPrinter(quiet=arguments.display != 'log', verbose=arguments.verbose)
+        checker = StockChecker(printer=checker_printer, notification_service=notification_service,
+                               concurrency=arguments.concurrency, host_rate=arguments.rate,
+                               parser=get_parser(arguments.parser) if arguments.parser else None,
+                               product_cache=product_cache,
+                               transport_options={'connect_timeout': arguments.connect_timeout,
+                                                  'read_timeout': arguments.read_timeout,
+                                                  'max_retries': arguments.retries},
+                               notification_dispatcher=notification_dispatcher, dashboard=dashboard, journal=journal,
+                               alert_tracker=alert_tracker,
+                               product_api_url=arguments.api_url if arguments.product_api else None,
+                               variant_subscriptions=variant_subscriptions, identities=identities,
+                               checkpointer=checkpointer, price_history=price_history, page_archive=page_archive)
+        control_server = None
+        try:
+            priorities = {normalize_url(url): 'low' for url in arguments.low_priority}
+            priorities.update({normalize_url(url): 'high' for url in arguments.high_priority})
+            monitor = checker
+            if arguments.workers > 1:
+                # Each worker gets its own sessions and an equal share of the per-host (or per-identity) rate budget
+                checker_options = {'concurrency': arguments.concurrency,
+                                   'host_rate': arguments.rate, 'rate_share': 1 / arguments.workers,
+                                   'transport_options': checker.transport_options,
+                                   'product_api_url': arguments.api_url if arguments.product_api else None,
+                                   'variant_subscriptions': variant_subscriptions, 'identities': identities}
+                monitor = ShardedMonitor(valid_urls, arguments.workers, checker, interval=arguments.interval,
+                                         priorities=priorities, adaptive=arguments.adaptive,
+                                         parser_name=arguments.parser, checker_options=checker_options,
+                                         watchlist=watchlist, page_archive_path=arguments.record_pages)
+
+            if arguments.daemon:
+                control_port = None if arguments.control_socket else arguments.control_port
+                control_server = ControlServer(monitor, port=control_port, socket_path=arguments.control_socket,
+                                               token_path=arguments.control_token_file).start()
+                printer.info(f"Control API listening on {control_server.address}")
+                if control_server.token_path:
+                    printer.info(f"Control API token written to {control_server.token_path}")
+
+                def stop(signum, frame):
+                    if monitor.stopping:
+                        raise KeyboardInterrupt  # A second signal stops without waiting
+                    printer.info("Shutting down after the checks in flight...")
+                    monitor.request_stop()
+
+                signal.signal(signal.SIGTERM, stop)
+                signal.signal(signal.SIGINT, stop)
+
+            if arguments.workers > 1:
+                monitor.run(daemon=arguments.daemon)
+            else:
+                checker.check_stock(valid_urls, interval=arguments.interval, priorities=priorities,
+                                    adaptive=arguments.adaptive, watchlist=watchlist, daemon=arguments.daemon)
+        finally:
+            if control_server:
+                control_server.stop()
+            if dashboard:
+                dashboard.close()
+            if notification_dispatcher:
+                printer.info("Sending queued notifications...")
+                notification_dispatcher.stop()
+            if checkpointer:
+                checkpointer.close()
+            product_cache.close()
+            if journal:
+                journal.close()
+            if price_history is not None:
+                price_history.close()
+            if page_archive is not None:
+                page_archive.close()
     else:
         printer.error('No URLs provided')
         printer.info('Example usage:')
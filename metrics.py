@@ -0,0 +1,185 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+DESCRIPTIONS = {
+    'mstock_phase_seconds': 'Time spent in each phase of the check loop',
+    'mstock_fetched_bytes_total': 'Bytes of product pages downloaded',
+    'mstock_page_cache_total': 'Product page fetches by whether the page had to be parsed',
+    'mstock_product_cache_total': 'Product information cache lookups',
+    'mstock_check_errors_total': 'Failed product checks',
+    'mstock_checks_total': 'Product checks by stock status',
+    'mstock_http_retries_total': 'Requests retried after an error or throttling response',
+    'mstock_circuit_opened_total': 'Times a host circuit breaker opened',
+    'mstock_notification_queue_depth': 'Notifications waiting to be sent',
+    'mstock_notifications_total': 'Notification deliveries by result',
+    'mstock_notification_seconds': 'Time each notification channel took to deliver a notification',
+    'mstock_notification_deliveries_total': 'Notifications each channel delivered or failed to deliver',
+    'mstock_notification_timeouts_total': 'Notifications a channel did not deliver within its timeout',
+    'mstock_fast_path_total': 'Structured data lookups by source and whether they answered or fell back',
+    'mstock_identity_requests_total': 'Requests sent through each session pool identity by outcome',
+    'mstock_checkpoint_bytes': 'Size of the last checkpoint written',
+    'mstock_identity_health': 'Smoothed share of recent requests each session pool identity got answered',
+}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style"""
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and histograms for the check loop"""
+
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe how long the body of a with-block takes"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for kind, metrics in (('counter', self._counters), ('gauge', self._gauges)):
+                for name in sorted({name for name, _ in metrics}):
+                    self._header(lines, name, kind)
+                    for (metric_name, key), value in sorted(metrics.items()):
+                        if metric_name == name:
+                            lines.append(f'{name}{_format_labels(key)} {value}')
+
+            for name in sorted({name for name, _ in self._histograms}):
+                self._header(lines, name, 'histogram')
+                for (metric_name, key), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if metric_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_format_labels(key, (("le", bound),))} {cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {histogram.sum}')
+                    lines.append(f'{name}_count{_format_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self) -> dict:
+        """Summarise every metric as plain data"""
+        def label_name(name, key):
+            return name + _format_labels(key)
+
+        with self._lock:
+            return {
+                'uptime_seconds': time.time() - self.started_at,
+                'counters': {label_name(*key): value for key, value in sorted(self._counters.items())},
+                'gauges': {label_name(*key): value for key, value in sorted(self._gauges.items())},
+                'histograms': {label_name(*key): {'count': histogram.count, 'sum': histogram.sum,
+                                                  'p50': histogram.quantile(0.5), 'p99': histogram.quantile(0.99)}
+                               for key, histogram in sorted(self._histograms.items(), key=lambda item: item[0])},
+            }
+
+    def dump_json(self, path: str):
+        """Write the metrics summary to a JSON file"""
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+
+    @staticmethod
+    def _header(lines, name, kind):
+        if name in DESCRIPTIONS:
+            lines.append(f'# HELP {name} {DESCRIPTIONS[name]}')
+        lines.append(f'# TYPE {name} {kind}')
+
+
+# Registry shared by the checker, transport, cache and notification dispatcher
+REGISTRY = MetricsRegistry()
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1', registry: MetricsRegistry = REGISTRY):
+    """Serve /metrics (Prometheus text) and /metrics.json from a background thread"""
+    # Every module records metrics, so the HTTP server modules are only imported when metrics are served
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = registry.render_prometheus(), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, content_type = json.dumps(registry.to_dict(), default=str), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            data = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="mstock-metrics", daemon=True).start()
+    return server
@@ -1,8 +1,21 @@
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from dataclasses import dataclass
-import mac_imessage
+import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from alerts import AVERAGE_DROP, PRICE_DROP, RESTOCK, SOLD_OUT
+from constants import (DEFAULT_NOTIFICATION_COALESCE_WINDOW_IN_SECONDS, DEFAULT_NOTIFICATION_MAX_RETRIES,
+                       DEFAULT_NOTIFICATION_TIMEOUT_IN_SECONDS, NOTIFICATION_RETRY_DELAY_IN_SECONDS)
+from metrics import REGISTRY
+
+# How a digest's subject names each kind of alert it holds
+DIGEST_LABELS = {RESTOCK: "In Stock", SOLD_OUT: "Sold Out", PRICE_DROP: "Price Drop", AVERAGE_DROP: "Price Drop"}
 
 @dataclass
 class EmailConfig:
@@ -15,46 +28,389 @@ class EmailConfig:
 @dataclass
 class SMSConfig:
     to_number: str = ""    # Your phone number
+    gateway: str = ""      # Carrier's email-to-SMS domain, e.g. tmomail.net. Empty sends through iMessage
+
+
+class NotificationBackend:
+    """A channel notifications are delivered through. `send` raises when a notification couldn't be delivered"""
+    name = ""
+    description = ""
+    # Seconds a notification may take on this channel, None for the service's timeout
+    timeout: Optional[float] = None
+
+    def send(self, subject: str, message: str, timeout: float):
+        """Deliver one notification, giving up after `timeout` seconds where the channel allows it"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release anything kept open between notifications"""
+
+
+class EmailBackend(NotificationBackend):
+    """Email over an SMTP connection that stays logged in between notifications"""
+    name = "email"
+    description = "Email"
+
+    def __init__(self, config: EmailConfig):
+        self.config = config
+        self._smtp = None
+        self._smtp_lock = threading.Lock()
+
+    def send(self, subject: str, message: str, timeout: float):
+        # Imported on the first email, so starting without email notifications doesn't load the SMTP and MIME modules
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+
+        with self._smtp_lock:
+            try:
+                msg = MIMEMultipart()
+                msg['From'] = self.config.sender_email
+                msg['To'] = self.config.recipient_email
+                msg['Subject'] = subject
+
+                msg.attach(MIMEText(message, 'plain'))
+
+                self._connect_smtp(timeout).send_message(msg)
+            except Exception:
+                self._disconnect_smtp()
+                raise
+
+    def close(self):
+        """Close the SMTP connection"""
+        with self._smtp_lock:
+            if self._smtp:
+                import smtplib
+                try:
+                    self._smtp.quit()
+                except smtplib.SMTPException:
+                    pass
+            self._disconnect_smtp()
+
+    def _connect_smtp(self, timeout: float):
+        """Reuse the logged-in SMTP connection, reconnecting if the server dropped it"""
+        import smtplib
+        if self._smtp:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._disconnect_smtp()
+
+        server = smtplib.SMTP(self.config.smtp_server, self.config.smtp_port, timeout=timeout)
+        server.starttls()
+        server.login(self.config.sender_email, self.config.sender_password)
+        self._smtp = server
+        return server
+
+    def _disconnect_smtp(self):
+        if self._smtp:
+            try:
+                self._smtp.close()
+            except OSError:
+                pass
+        self._smtp = None
+
+
+class SmsGatewayBackend(EmailBackend):
+    """SMS through a carrier's email-to-SMS gateway (e.g. 5551234567@tmomail.net), which works on any platform"""
+    name = "sms_gateway"
+    description = "SMS gateway"
+
+    def __init__(self, email_config: EmailConfig, sms_config: SMSConfig):
+        number = ''.join(character for character in sms_config.to_number if character.isdigit())
+        super().__init__(replace(email_config, recipient_email=f"{number}@{sms_config.gateway}"))
+
+    def send(self, subject: str, message: str, timeout: float):
+        # Only the message is sent, as over iMessage: gateways would show the subject as part of the text
+        super().send("", message, timeout)
+
+
+class IMessageBackend(NotificationBackend):
+    """SMS through the Messages app, macOS only"""
+    name = "imessage"
+    description = "SMS"
+
+    def __init__(self, config: SMSConfig):
+        self.config = config
+
+    def send(self, subject: str, message: str, timeout: float):
+        # Only available on macOS, so it is imported on the first SMS rather than with this module
+        import mac_imessage
+        mac_imessage.send_imessage(
+            message=message,
+            phone_number=self.config.to_number
+        )
+
+
+class WebhookBackend(NotificationBackend):
+    """POSTs notifications as JSON with `subject`, `message` and `text` keys, e.g. to a Slack or Mattermost webhook"""
+    name = "webhook"
+
+    def __init__(self, url: str, timeout: float = None):
+        self.url = url
+        self.timeout = timeout
+        # The URL itself often carries the webhook's secret, so only its host is shown
+        self.description = f"Webhook ({urlsplit(url).netloc})"
+
+    def send(self, subject: str, message: str, timeout: float):
+        from urllib.request import Request, urlopen
+        body = json.dumps({'subject': subject, 'message': message, 'text': f"{subject}\n\n{message}"})
+        request = Request(self.url, data=body.encode('utf-8'), headers={'Content-Type': 'application/json'},
+                          method='POST')
+        # Error responses raise HTTPError
+        with urlopen(request, timeout=timeout) as response:
+            response.read()
+
+
+class FileBackend(NotificationBackend):
+    """Appends notifications to a file as JSON lines, or writes them to stdout for "-", for scripts to pick up"""
+    name = "file"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.description = "Stdout" if path == '-' else f"File ({path})"
+        self._lock = threading.Lock()
+
+    def send(self, subject: str, message: str, timeout: float):
+        line = json.dumps({'at': datetime.now().isoformat(timespec='seconds'), 'subject': subject,
+                           'message': message}, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self.path == '-':
+                sys.stdout.write(line)
+                sys.stdout.flush()
+            else:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+
+
+class MemoryBackend(NotificationBackend):
+    """Keeps notifications in memory instead of delivering them, for trying out alerts locally.
+
+    `delay` and `fail` make it behave like a slow or broken channel.
+    """
+    name = "memory"
+    description = "Memory"
+
+    def __init__(self, delay: float = 0.0, fail: bool = False, timeout: float = None):
+        self.delay = delay
+        self.fail = fail
+        self.timeout = timeout
+        self.sent: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+
+    def send(self, subject: str, message: str, timeout: float):
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("the memory sink is set to fail")
+        with self._lock:
+            self.sent.append((subject, message))
+
 
 class NotificationService:
-    def __init__(self, email_config: EmailConfig = None, sms_config: SMSConfig = None):
+    """Delivers every notification to all configured channels at once, each within its own timeout"""
+
+    def __init__(self, email_config: EmailConfig = None, sms_config: SMSConfig = None,
+                 backends: List[NotificationBackend] = None,
+                 timeout: float = DEFAULT_NOTIFICATION_TIMEOUT_IN_SECONDS):
         self.email_config = email_config
         self.sms_config = sms_config
+        self.timeout = timeout
+        self.backends: List[NotificationBackend] = []
+        if email_config and email_config.recipient_email:
+            self.backends.append(EmailBackend(email_config))
+        if sms_config and sms_config.gateway:
+            if not email_config:
+                raise ValueError("An SMS gateway is reached over email and needs an email configuration")
+            self.backends.append(SmsGatewayBackend(email_config, sms_config))
+        elif sms_config:
+            self.backends.append(IMessageBackend(sms_config))
+        self.backends.extend(backends or [])
+        # A thread per channel, so a channel that hangs past its timeout only holds up its own later notifications
+        self._executors: Dict[NotificationBackend, ThreadPoolExecutor] = {}
+        self._executors_lock = threading.Lock()
 
-    def send_email(self, subject: str, body: str):
-        """Send email notification"""
-        if not self.email_config:
-            return
+    def send(self, subject: str, message: str,
+             backends: List[NotificationBackend] = None) -> Dict[NotificationBackend, Optional[bool]]:
+        """Send a notification through every channel (or the given ones) concurrently.
 
-        try:
-            msg = MIMEMultipart()
-            msg['From'] = self.email_config.sender_email
-            msg['To'] = self.email_config.recipient_email
-            msg['Subject'] = subject
-
-            msg.attach(MIMEText(body, 'plain'))
-
-            server = smtplib.SMTP(self.email_config.smtp_server, self.email_config.smtp_port)
-            server.starttls()
-            server.login(self.email_config.sender_email, self.email_config.sender_password)
-            server.send_message(msg)
-            server.quit()
-            return True
-        except Exception as e:
-            print(f"Failed to send email: {str(e)}")
-            return False
+        Returns whether each channel delivered it, or None for a channel that didn't finish within its timeout: its send
+        is still running and may yet deliver the notification.
+        """
+        backends = self.backends if backends is None else backends
+        started = time.monotonic()
+        futures = [(started + (backend.timeout or self.timeout), backend,
+                    self._executor(backend).submit(self._send, backend, subject, message)) for backend in backends]
+        results = {}
+        for deadline, backend, future in sorted(futures, key=lambda entry: entry[0]):
+            try:
+                results[backend] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                print(f"Failed to send {backend.description} notification: timed out after "
+                      f"{deadline - started:g} seconds")
+                REGISTRY.increment('mstock_notification_timeouts_total', backend=backend.name)
+                results[backend] = None
+        return results
 
-    def send_sms(self, message: str):
-        """Send SMS notification"""
-        if not self.sms_config:
-            return
+    def close(self):
+        """Close every channel's connections"""
+        with self._executors_lock:
+            for executor in self._executors.values():
+                executor.shutdown(wait=False)
+            self._executors.clear()
+        for backend in self.backends:
+            backend.close()
 
+    def _executor(self, backend: NotificationBackend) -> ThreadPoolExecutor:
+        with self._executors_lock:
+            if backend not in self._executors:
+                self._executors[backend] = ThreadPoolExecutor(max_workers=1,
+                                                              thread_name_prefix=f"mstock-{backend.name}")
+            return self._executors[backend]
+
+    def _send(self, backend: NotificationBackend, subject: str, message: str) -> bool:
+        started = time.monotonic()
         try:
-            mac_imessage.send_imessage(
-                message=message,
-                phone_number=self.sms_config.to_number
-            )
-            return True
+            backend.send(subject, message, backend.timeout or self.timeout)
+            result = 'sent'
         except Exception as e:
-            print(f"Failed to send SMS: {str(e)}")
-            return False
\ No newline at end of file
+            print(f"Failed to send {backend.description} notification: {str(e)}")
+            result = 'failed'
+        REGISTRY.observe('mstock_notification_seconds', time.monotonic() - started, backend=backend.name)
+        REGISTRY.increment('mstock_notification_deliveries_total', backend=backend.name, result=result)
+        return result == 'sent'
+
+
+@dataclass
+class Notification:
+    subject: str
+    message: str
+    kind: str = RESTOCK  # The alert that triggered it, see alerts.ALERT_EVENTS
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+def digest_subject(batch: List[Notification]) -> str:
+    """Subject of a digest, counting its notifications by kind of alert, e.g. "🛍️ 3 Alerts: 2 In Stock, 1 Sold Out" """
+    counts = {}
+    for notification in batch:
+        label = DIGEST_LABELS.get(notification.kind, "Stock")
+        counts[label] = counts.get(label, 0) + 1
+    icon = "💲" if set(counts) == {"Price Drop"} else "🛍️"
+    if len(counts) == 1:
+        return f"{icon} {len(batch)} {next(iter(counts))} Alerts"
+    return f"{icon} {len(batch)} Alerts: {', '.join(f'{count} {label}' for label, count in counts.items())}"
+
+
+class NotificationDispatcher:
+    """Delivers notifications from a background thread, batching bursts into a single digest"""
+
+    def __init__(self, notification_service: NotificationService,
+                 coalesce_window: float = DEFAULT_NOTIFICATION_COALESCE_WINDOW_IN_SECONDS,
+                 max_retries: int = DEFAULT_NOTIFICATION_MAX_RETRIES):
+        self.notification_service = notification_service
+        self.coalesce_window = coalesce_window
+        self.max_retries = max_retries
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {'sent': 0, 'failed': 0, 'digests': 0, 'send_seconds_total': 0.0, 'send_seconds_max': 0.0,
+                       'queue_seconds_max': 0.0}
+
+    def start(self):
+        """Start the delivery thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="mstock-notify", daemon=True)
+            self._thread.start()
+
+    def submit(self, subject: str, message: str, kind: str = RESTOCK):
+        """Queue a notification without waiting for it to be sent"""
+        self.start()
+        self._queue.put(Notification(subject, message, kind))
+        REGISTRY.set_gauge('mstock_notification_queue_depth', self.queue_depth)
+
+    def stop(self, timeout: float = None):
+        """Deliver everything still queued, then stop the thread and close the SMTP connection"""
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+        self.notification_service.close()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        """Queue depth, delivery counts and send latency"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        deliveries = stats['sent'] + stats['failed']
+        stats['queue_depth'] = self.queue_depth
+        stats['send_seconds_avg'] = stats['send_seconds_total'] / deliveries if deliveries else 0.0
+        return stats
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            notification = self._queue.get()
+            if notification is None:
+                break
+
+            # Collect everything that arrives within the window so a restock burst becomes one digest
+            batch = [notification]
+            deadline = time.monotonic() + self.coalesce_window
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    notification = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if notification is None:
+                    stopping = True
+                    break
+                batch.append(notification)
+
+            self._deliver(batch)
+
+    def _deliver(self, batch):
+        if len(batch) == 1:
+            subject, message = batch[0].subject, batch[0].message
+        else:
+            subject = digest_subject(batch)
+            message = "\n\n----------\n\n".join(notification.message for notification in batch)
+
+        started = time.monotonic()
+        delivered = self._send_with_retries(subject, message)
+        finished = time.monotonic()
+        REGISTRY.observe('mstock_phase_seconds', finished - started, phase='notification_send')
+        REGISTRY.increment('mstock_notifications_total', result='sent' if delivered else 'failed')
+        REGISTRY.set_gauge('mstock_notification_queue_depth', self.queue_depth)
+
+        with self._stats_lock:
+            self._stats['sent' if delivered else 'failed'] += 1
+            if len(batch) > 1:
+                self._stats['digests'] += 1
+            self._stats['send_seconds_total'] += finished - started
+            self._stats['send_seconds_max'] = max(self._stats['send_seconds_max'], finished - started)
+            self._stats['queue_seconds_max'] = max(self._stats['queue_seconds_max'],
+                                                   max(started - notification.queued_at for notification in batch))
+
+    def _send_with_retries(self, subject: str, message: str) -> bool:
+        """Send through every channel, resending through the ones that failed until they succeed or the retries run
+        out.
+
+        A channel that timed out isn't resent to: its send may still get through, and resending could deliver the
+        notification twice. It counts as undelivered.
+        """
+        backends = self.notification_service.backends
+        timed_out = False
+        for attempt in range(self.max_retries + 1):
+            results = self.notification_service.send(subject, message, backends)
+            timed_out = timed_out or None in results.values()
+            backends = [backend for backend, delivered in results.items() if delivered is False]
+            if not backends:
+                return not timed_out
+            if attempt < self.max_retries:
+                time.sleep(NOTIFICATION_RETRY_DELAY_IN_SECONDS * 2 ** attempt)
+        return False
@@ -0,0 +1,314 @@
+"""Archive of fetched product pages, for replaying real traffic through the check path offline.
+
+Usage: python page_archive.py [--file .mstock_pages.sqlite3] {stats,replay} ...
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from constants import DEFAULT_PAGE_ARCHIVE_PATH
+from parsers import PARSERS, get_parser
+from printer import CustomPrinter
+from product import CONTENT_DIGEST_SIZE, ProductInfo
+from product_cache import ProductTable
+from retailers import adapter_for, register_domain
+from sqlite_store import BatchedConnection
+
+COMPRESSION_LEVEL = 6
+# Headers the check path reads, the rest are not kept
+RECORDED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+# Decompressed bodies kept while replaying, as unchanged pages come back again and again
+BODY_CACHE_SIZE = 256
+# Fields that depend on when and how a page was fetched rather than on what the parser read from it. Variants are
+# only read by the jsonld backend unless the product has variant subscriptions
+UNCOMPARED_FIELDS = ('last_checked', 'etag', 'last_modified', 'content_digest', 'variants')
+COMPARED_FIELDS = tuple(name for name in ProductInfo.FIELDS if name not in UNCOMPARED_FIELDS)
+
+SCHEMA = (
+    # Content-addressed: every distinct body is stored once, compressed, under its digest
+    'CREATE TABLE IF NOT EXISTS bodies (digest BLOB PRIMARY KEY, size INTEGER NOT NULL, body BLOB NOT NULL) '
+    'WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS responses (id INTEGER PRIMARY KEY, url TEXT NOT NULL, at REAL NOT NULL, '
+    'status INTEGER NOT NULL, headers TEXT NOT NULL, encoding TEXT, digest BLOB NOT NULL, retailer TEXT)',
+    'CREATE INDEX IF NOT EXISTS responses_url ON responses (url, id)',
+)
+
+
+def worker_archive_path(path: str, worker_id: int) -> str:
+    """File a sharded worker records its pages to, so workers never wait on each other's writes to one file"""
+    root, extension = os.path.splitext(path)
+    return f"{root}.worker-{worker_id}{extension}"
+
+
+class ArchivedResponse:
+    """The parts of a requests.Response the check path reads, rebuilt from the archive"""
+
+    def __init__(self, url: str, status_code: int, headers: dict, encoding: Optional[str], content: bytes):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.encoding = encoding
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} recorded for {self.url}", response=self)
+
+
+class PageArchive:
+    """Fetched product pages in a SQLite file, each distinct body stored once and compressed"""
+
+    def __init__(self, path: str = DEFAULT_PAGE_ARCHIVE_PATH):
+        self.path = path
+        # Responses are committed in batches
+        self._db = BatchedConnection(path, SCHEMA)
+        self._lock = threading.Lock()
+        self._digests = {digest for digest, in self._db.execute('SELECT digest FROM bodies')}
+        self._body = lru_cache(maxsize=BODY_CACHE_SIZE)(self._read_body)
+
+    def record(self, url: str, response, digest: bytes = None, retailer: str = None, at: float = None):
+        """Archive a fetched response, with the name of the retailer adapter that read it. Its body is only stored if
+        no response had the same one before"""
+        content = response.content
+        digest = digest or hashlib.blake2b(content, digest_size=CONTENT_DIGEST_SIZE).digest()
+        # Compressed outside the lock, so checks recording new pages at once don't wait for each other
+        body = zlib.compress(content, COMPRESSION_LEVEL) if digest not in self._digests else None
+        headers = {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers}
+        # Recorded as the check path decoded it, requests guesses from the content when the headers don't say
+        encoding = response.encoding or response.apparent_encoding
+        at = time.time() if at is None else at
+
+        with self._lock:
+            if body is not None and digest not in self._digests:
+                # Another process recording to the same file may have stored it already
+                self._db.execute('INSERT OR IGNORE INTO bodies (digest, size, body) VALUES (?, ?, ?)',
+                                 (digest, len(content), body))
+                self._digests.add(digest)
+            self._db.write('INSERT INTO responses (url, at, status, headers, encoding, digest, retailer) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (url, at, response.status_code, json.dumps(headers), encoding, digest, retailer))
+
+    def index(self, limit: int = None) -> List[Tuple[int, str]]:
+        """(response id, url) of every archived response, in the order they were fetched"""
+        with self._lock:
+            self._db.commit()
+            return self._db.execute('SELECT id, url FROM responses ORDER BY id LIMIT ?',
+                                    (-1 if limit is None else limit,)).fetchall()
+
+    def retailers(self) -> Dict[str, str]:
+        """Retailer adapter of every archived host"""
+        with self._lock:
+            self._db.commit()
+            rows = self._db.execute('SELECT DISTINCT url, retailer FROM responses WHERE retailer IS NOT NULL')
+            return {urlsplit(url).netloc: retailer for url, retailer in rows}
+
+    def response(self, response_id: int) -> ArchivedResponse:
+        with self._lock:
+            url, status, headers, encoding, digest = self._db.execute(
+                'SELECT url, status, headers, encoding, digest FROM responses WHERE id = ?',
+                (response_id,)).fetchone()
+        return ArchivedResponse(url, status, json.loads(headers), encoding, self._body(digest))
+
+    def stats(self) -> dict:
+        """Response and body counts, and their sizes before and after deduplication and compression"""
+        with self._lock:
+            self._db.commit()
+            responses, urls, fetched_bytes = self._db.execute(
+                'SELECT COUNT(*), COUNT(DISTINCT url), COALESCE(SUM(bodies.size), 0) FROM responses '
+                'JOIN bodies USING (digest)').fetchone()
+            bodies, body_bytes, stored_bytes = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(body)), 0) FROM bodies').fetchone()
+        return {'responses': responses, 'urls': urls, 'bodies': bodies, 'fetched_bytes': fetched_bytes,
+                'body_bytes': body_bytes, 'stored_bytes': stored_bytes}
+
+    def merge(self, path: str) -> int:
+        """Copy every response of another archive file into this one, after its own. Returns how many were copied"""
+        with self._lock:
+            self._db.commit()
+            self._db.execute('ATTACH DATABASE ? AS other', (path,))
+            try:
+                self._db.write('INSERT OR IGNORE INTO bodies (digest, size, body) '
+                               'SELECT digest, size, body FROM other.bodies')
+                copied = self._db.write('INSERT INTO responses (url, at, status, headers, encoding, digest, retailer) '
+                                        'SELECT url, at, status, headers, encoding, digest, retailer '
+                                        'FROM other.responses ORDER BY id').rowcount
+                self._db.commit()
+                self._digests.update(digest for digest, in self._db.execute('SELECT digest FROM other.bodies'))
+            finally:
+                self._db.execute('DETACH DATABASE other')
+        return copied
+
+    def flush(self):
+        """Commit pending responses to disk"""
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db:
+                self._db.close()
+                self._db = None
+
+    def _read_body(self, digest: bytes) -> bytes:
+        with self._lock:
+            body, = self._db.execute('SELECT body FROM bodies WHERE digest = ?', (digest,)).fetchone()
+        return zlib.decompress(body)
+
+
+class ReplayTransport:
+    """Stands in for the checker's transport, answering each URL with its archived responses in the order they
+    were fetched"""
+
+    def __init__(self, archive: PageArchive, index: List[Tuple[int, str]] = None):
+        self.archive = archive
+        self.bytes_served = 0
+        self._queued: Dict[str, deque] = {}
+        for response_id, url in archive.index() if index is None else index:
+            self._queued.setdefault(url, deque()).append(response_id)
+
+    def get(self, url: str, **kwargs) -> ArchivedResponse:
+        """The next archived response of a URL. Conditional request headers are ignored, so every page has a body"""
+        queued = self._queued.get(url)
+        if not queued:
+            raise requests.ConnectionError(f"No more archived responses for {url}")
+        response = self.archive.response(queued.popleft())
+        self.bytes_served += len(response.content)
+        return response
+
+
+@dataclass
+class ReplayRun:
+    """Outcome of replaying an archive through one parser"""
+    parser_name: Optional[str]
+    results: List[Tuple[Optional[bool], Optional[ProductInfo]]] = field(default_factory=list)
+    seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    bytes: int = 0
+
+
+def replay(archive: PageArchive, parser_name: str = None, limit: int = None) -> ReplayRun:
+    """Check every archived response, in the order it was fetched, as fast as the check path goes.
+
+    Every page is parsed: with nothing cached, validators and unchanged-page shortcuts never apply.
+    """
+    # Imported here, the checker imports this module to record pages
+    from stock_checker import StockChecker
+
+    # Hosts that were routed to an adapter by hand when recording, like a local stand-in server, are routed again
+    for host, retailer in archive.retailers().items():
+        if adapter_for(f"https://{host}/") is None:
+            register_domain(host, retailer)
+
+    index = archive.index(limit)
+    transport = ReplayTransport(archive, index)
+    checker = StockChecker(printer=CustomPrinter(quiet=True), concurrency=1, product_cache=ProductTable(),
+                           parser=get_parser(parser_name) if parser_name else None, transport=transport)
+    run = ReplayRun(parser_name)
+    start, cpu_start = time.perf_counter(), time.process_time()
+    for _, url in index:
+        status, product_info = checker.check_product_stock(url)
+        run.results.append((status, product_info))
+    run.seconds = time.perf_counter() - start
+    run.cpu_seconds = time.process_time() - cpu_start
+    run.bytes = transport.bytes_served
+    return run
+
+
+def compare(expected: ReplayRun, actual: ReplayRun) -> Dict[str, List[int]]:
+    """Positions of the responses whose stock status or product fields differ between two replays, by field"""
+    differences = {name: [] for name in ('in_stock', 'product_info') + COMPARED_FIELDS}
+    for position, ((expected_status, expected_info), (status, info)) in enumerate(zip(expected.results,
+                                                                                        actual.results)):
+        if status != expected_status:
+            differences['in_stock'].append(position)
+        if expected_info is None or info is None:
+            if (expected_info is None) != (info is None):
+                differences['product_info'].append(position)
+            continue
+        for name in COMPARED_FIELDS:
+            if getattr(info, name) != getattr(expected_info, name):
+                differences[name].append(position)
+    return {name: positions for name, positions in differences.items() if positions}
+
+
+def _format_bytes(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f} MiB" if size >= 1024 * 1024 else f"{size / 1024:.0f} KiB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect and replay archived product pages')
+    parser.add_argument('--file', default=DEFAULT_PAGE_ARCHIVE_PATH, help='Archive written by main.py --record-pages')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help='What the archive holds and how much deduplication and compression save')
+    replay_command = commands.add_parser('replay', help='Check every archived page again, offline and at full speed')
+    replay_command.add_argument('--parser', action='append', choices=list(PARSERS), dest='parsers',
+                                help='Parser backend to replay through (can be repeated to compare them with the '
+                                     'first, default: each retailer\'s own)')
+    replay_command.add_argument('--limit', type=int, help='Only the first N archived responses')
+    replay_command.add_argument('--examples', type=int, default=5, help='Differing pages to list per field')
+    arguments = parser.parse_args()
+
+    printer = CustomPrinter()
+    archive = PageArchive(arguments.file)
+    try:
+        if arguments.command == 'stats':
+            stats = archive.stats()
+            printer.section("Page Archive")
+            printer.table(["Responses", "URLs", "Distinct Pages", "Fetched", "Distinct", "Stored", "Saved"],
+                          [[stats['responses'], stats['urls'], stats['bodies'], _format_bytes(stats['fetched_bytes']),
+                            _format_bytes(stats['body_bytes']), _format_bytes(stats['stored_bytes']),
+                            f"{1 - stats['stored_bytes'] / stats['fetched_bytes']:.0%}"
+                            if stats['fetched_bytes'] else "N/A"]])
+            return
+
+        runs = [replay(archive, parser_name, arguments.limit) for parser_name in arguments.parsers or [None]]
+        printer.section("Replay")
+        printer.table(["Parser", "Pages", "In Stock", "Out of Stock", "Unknown", "Pages/s", "MiB/s", "CPU ms/page"],
+                      [[run.parser_name or "default", len(run.results),
+                        sum(status is True for status, _ in run.results),
+                        sum(status is False for status, _ in run.results),
+                        sum(status is None for status, _ in run.results),
+                        f"{len(run.results) / run.seconds:,.0f}" if run.seconds else "N/A",
+                        f"{run.bytes / run.seconds / 1024 / 1024:.1f}" if run.seconds else "N/A",
+                        f"{run.cpu_seconds * 1000 / len(run.results):.2f}" if run.results else "N/A"]
+                       for run in runs])
+        print()
+
+        index = archive.index(arguments.limit)
+        mismatched = False
+        for run in runs[1:]:
+            differences = compare(runs[0], run)
+            if not differences:
+                printer.success(f"{run.parser_name} agrees with {runs[0].parser_name} on every page")
+                continue
+            mismatched = True
+            printer.error(f"{run.parser_name} disagrees with {runs[0].parser_name}:")
+            printer.table(["Field", "Pages", "Examples"],
+                          [[field, len(positions), ', '.join(f"#{index[position][0]} {index[position][1]}"
+                                                             for position in positions[:arguments.examples])]
+                           for field, positions in differences.items()])
+            print()
+        if mismatched:
+            raise SystemExit(1)
+    finally:
+        archive.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import importlib.util
+import json
+import re
+from datetime import datetime
+from html.parser import HTMLParser
+
+from metrics import REGISTRY
+from product import ProductInfo, format_cents
+from variants import IN_STOCK_AVAILABILITY, variants_from_json_ld
+
+OUT_OF_STOCK_MESSAGE = "sorry, this item is currently unavailable"
+
+# BeautifulSoup (and lxml) are only imported once a page is parsed, so the CLI starts without them
+FAST_TREE_BUILDER = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+
+
+class PageParser:
+    """Base class for parser backends that read a Macy's product page"""
+    name = ""
+
+    def load(self, html: str):
+        """Parse page markup into whatever document the backend works with"""
+        raise NotImplementedError
+
+    def extract_product_info(self, document) -> ProductInfo:
+        """Build the product information from a loaded document"""
+        raise NotImplementedError
+
+    def is_out_of_stock(self, document) -> bool:
+        """Check a loaded document for the 'currently unavailable' message"""
+        raise NotImplementedError
+
+
+class SoupParser(PageParser):
+    """Builds a full BeautifulSoup tree of the page"""
+    name = "soup"
+
+    def __init__(self, features: str = 'html.parser'):
+        self.features = features
+
+    def load(self, html: str):
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(html, self.features)
+
+    def extract_product_info(self, soup) -> ProductInfo:
+        # Extract product ID
+        product_id = ""
+        web_id_span = soup.find('span', class_='product-id')
+        if web_id_span:
+            product_id = web_id_span.text.replace('Web ID:', '').strip()
+
+        # Extract price
+        price = None
+        price_elem = soup.find('div', class_='price')
+        if price_elem:
+            price = price_elem.text.strip()
+
+        # Extract brand and name
+        brand = ""
+        name = ""
+        title_elem = soup.find('h1', class_='product-title')
+        if title_elem:
+            brand_elem = title_elem.find('label', class_='subtitle-2')
+            if brand_elem:
+                brand = brand_elem.text.strip()
+            name_elem = title_elem.find('span', class_='subtitle-1')
+            if name_elem:
+                name = name_elem.text.strip()
+
+        # Extract rating information
+        rating = None
+        reviews_count = None
+        rating_elem = soup.find('span', class_='rating-average')
+        if rating_elem:
+            rating = rating_elem.text.strip()
+        reviews_elem = soup.find('span', class_='rating-description')
+        if reviews_elem:
+            reviews_count = reviews_elem.text.strip()
+
+        return ProductInfo(id=product_id, brand=brand, name=name, price=price, rating=rating,
+                           reviews_count=reviews_count, last_checked=datetime.now())
+
+    def is_out_of_stock(self, soup) -> bool:
+        out_of_stock_div = soup.find('div', {'class': ['error-color', 'large']})
+        return bool(out_of_stock_div and OUT_OF_STOCK_MESSAGE in out_of_stock_div.text.lower())
+
+
+# Tags and classes of the elements the extractors read. A node is kept when both its tag and one of its classes
+# appear here, which may keep a few extra nodes (e.g. a span with class 'price') but never drops a needed one
+PRODUCT_NODE_TAGS = ['h1', 'span', 'div']
+PRODUCT_NODE_CLASSES = ['product-title', 'product-id', 'rating-average', 'rating-description', 'price', 'error-color',
+                        'large']
+# The strainer sees the raw class attribute (e.g. "error-color large"), so classes are matched as whole words
+PRODUCT_NODE_CLASS_PATTERN = re.compile(r'(?:^|\s)(?:%s)(?:\s|$)' % '|'.join(map(re.escape, PRODUCT_NODE_CLASSES)))
+
+
+class StrainedSoupParser(SoupParser):
+    """Builds only the product nodes (and their children) with SoupStrainer, using lxml when installed"""
+    name = "strained"
+
+    def __init__(self, features: str = FAST_TREE_BUILDER):
+        from bs4 import SoupStrainer
+        super().__init__(features)
+        self.strainer = SoupStrainer(PRODUCT_NODE_TAGS, class_=PRODUCT_NODE_CLASS_PATTERN)
+
+    def load(self, html: str):
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(html, self.features, parse_only=self.strainer)
+
+
+class _ProductFieldCollector(HTMLParser):
+    """Single-pass HTML scanner that records the text of the first element matching each field"""
+
+    # field -> (tag, class, only inside the product title)
+    FIELDS = {'product_id': ('span', 'product-id', False), 'price': ('div', 'price', False),
+              'title': ('h1', 'product-title', False), 'brand': ('label', 'subtitle-2', True),
+              'name': ('span', 'subtitle-1', True), 'rating': ('span', 'rating-average', False),
+              'reviews_count': ('span', 'rating-description', False)}
+    SKIPPED_TEXT_TAGS = {'script', 'style'}
+
+    def __init__(self):
+        super().__init__()
+        self.fields = {}
+        self.finished = set()
+        self._open = []  # [field, tag, depth, text parts] for every element still being captured
+        self._skip_depth = 0
+
+    @property
+    def complete(self) -> bool:
+        """Whether every field has been read, including the stock message"""
+        pending = set(self.FIELDS) | {'stock_message'}
+        if 'title' in self.finished:
+            # Brand and name can only appear inside the title, which is already closed
+            pending -= {'brand', 'name'}
+        return pending <= self.finished
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TEXT_TAGS:
+            self._skip_depth += 1
+            return
+
+        for capture in self._open:
+            if capture[1] == tag:
+                capture[2] += 1
+
+        classes = set()
+        for key, value in attrs:
+            if key == 'class' and value:
+                classes.update(value.split())
+        if not classes:
+            return
+
+        in_title = any(capture[0] == 'title' for capture in self._open)
+        for field, (field_tag, field_class, needs_title) in self.FIELDS.items():
+            if (tag == field_tag and field_class in classes and field not in self.fields
+                    and (in_title or not needs_title)):
+                self._start_capture(field, tag)
+        if tag == 'div' and 'stock_message' not in self.fields and classes & {'error-color', 'large'}:
+            self._start_capture('stock_message', tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TEXT_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+
+        for capture in list(self._open):
+            if capture[1] != tag:
+                continue
+            capture[2] -= 1
+            if capture[2] == 0:
+                self._open.remove(capture)
+                self.fields[capture[0]] = ''.join(capture[3])
+                self.finished.add(capture[0])
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        for capture in self._open:
+            capture[3].append(data)
+
+    def close(self):
+        super().close()
+        # Elements left open at the end of the page keep the text read so far
+        for field, _, _, parts in self._open:
+            self.fields[field] = ''.join(parts)
+        self._open = []
+
+    def _start_capture(self, field, tag):
+        self.fields[field] = ''
+        self._open.append([field, tag, 1, []])
+
+
+class StreamingParser(PageParser):
+    """Reads the page in chunks with the standard library HTML scanner and stops once every field is found"""
+    name = "stream"
+
+    def __init__(self, chunk_size: int = 16 * 1024):
+        self.chunk_size = chunk_size
+
+    def load(self, html: str):
+        collector = _ProductFieldCollector()
+        for start in range(0, len(html), self.chunk_size):
+            collector.feed(html[start:start + self.chunk_size])
+            if collector.complete:
+                break
+        collector.close()
+        return collector.fields
+
+    def extract_product_info(self, fields) -> ProductInfo:
+        def text(field):
+            value = fields.get(field)
+            return value.strip() if value is not None else None
+
+        product_id = text('product_id')
+        return ProductInfo(id=product_id.replace('Web ID:', '').strip() if product_id is not None else "",
+                           brand=text('brand') or "", name=text('name') or "", price=text('price'),
+                           rating=text('rating'), reviews_count=text('reviews_count'), last_checked=datetime.now())
+
+    def is_out_of_stock(self, fields) -> bool:
+        return OUT_OF_STOCK_MESSAGE in fields.get('stock_message', '').lower()
+
+
+JSON_LD_PATTERN = re.compile(r'<script[^>]*type\s*=\s*["\']application/ld\+json["\'][^>]*>(.*?)</script>',
+                             re.IGNORECASE | re.DOTALL)
+# schema.org price types of the price a sale is reduced from
+LIST_PRICE_TYPES = ('StrikethroughPrice', 'ListPrice')
+
+
+def find_json_ld_product(html: str):
+    """The first schema.org Product object embedded in the page as JSON-LD, found without building a tree"""
+    for match in JSON_LD_PATTERN.finditer(html):
+        try:
+            data = json.loads(match.group(1))
+        except ValueError:
+            continue
+        candidates = data if isinstance(data, list) else data.get('@graph', [data]) if isinstance(data, dict) else []
+        for candidate in candidates:
+            if isinstance(candidate, dict) and candidate.get('@type') in ('Product', ['Product']):
+                return candidate
+    return None
+
+
+def format_price_range(prices, regular_price=None) -> str:
+    """Display text for a list of dollar amounts: one price or the "$39.99 - $59.99" range they span, in the page's
+    "$59.99 Sale $39.99" form when they are all the sale price of a higher regular price"""
+    cents = sorted({round(float(price) * 100) for price in prices})
+    regular_cents = round(float(regular_price) * 100) if regular_price is not None else None
+    if len(cents) == 1:
+        if regular_cents is not None and regular_cents > cents[0]:
+            return f"{format_cents(regular_cents)} Sale {format_cents(cents[0])}"
+        return format_cents(cents[0])
+    return f"{format_cents(cents[0])} - {format_cents(cents[-1])}"
+
+
+class StructuredDocument:
+    """A page's JSON-LD product, or the fallback parser's document when the page has none"""
+    __slots__ = ('product', 'fallback')
+
+    def __init__(self, product, fallback=None):
+        self.product = product
+        self.fallback = fallback
+
+
+class StructuredDataParser(PageParser):
+    """Reads the JSON-LD product block embedded in the page and skips the HTML tree entirely.
+
+    Pages without a usable product block are handed to the fallback parser (the strained parser by default).
+    """
+    name = "jsonld"
+
+    def __init__(self, fallback: PageParser = None):
+        self.fallback = fallback or StrainedSoupParser()
+
+    def load(self, html: str):
+        product = find_json_ld_product(html)
+        if product is not None and self._availability(product) is not None:
+            REGISTRY.increment('mstock_fast_path_total', source='jsonld', result='hit')
+            return StructuredDocument(product)
+        REGISTRY.increment('mstock_fast_path_total', source='jsonld', result='fallback')
+        return StructuredDocument(None, self.fallback.load(html))
+
+    def extract_product_info(self, document: StructuredDocument) -> ProductInfo:
+        if document.product is None:
+            return self.fallback.extract_product_info(document.fallback)
+
+        product = document.product
+        brand = product.get('brand') or ""
+        if isinstance(brand, dict):
+            brand = brand.get('name') or ""
+        offers = product.get('offers') or []
+        offers = [offer for offer in (offers if isinstance(offers, list) else [offers]) if isinstance(offer, dict)]
+        prices = []
+        regular_prices = []
+        for offer in offers:
+            prices.extend(offer[key] for key in ('highPrice', 'lowPrice', 'price') if offer.get(key) not in (None, ''))
+            # A sale states the price it is reduced from as a strikethrough or list price
+            specifications = offer.get('priceSpecification') or []
+            for specification in specifications if isinstance(specifications, list) else [specifications]:
+                if (isinstance(specification, dict) and specification.get('price') not in (None, '')
+                        and str(specification.get('priceType', '')).rsplit('/', 1)[-1] in LIST_PRICE_TYPES):
+                    regular_prices.append(float(specification['price']))
+        rating = product.get('aggregateRating') or {}
+        reviews = rating.get('reviewCount', rating.get('ratingCount'))
+
+        price = format_price_range(prices, max(regular_prices, default=None)) if prices else None
+
+        return ProductInfo(id=str(product.get('productID') or product.get('sku') or ""), brand=str(brand),
+                           name=product.get('name') or "", price=price,
+                           rating=str(rating['ratingValue']) if rating.get('ratingValue') is not None else None,
+                           reviews_count=f"({reviews} reviews)" if reviews is not None else None,
+                           last_checked=datetime.now(), variants=variants_from_json_ld(product))
+
+    def is_out_of_stock(self, document: StructuredDocument) -> bool:
+        if document.product is None:
+            return self.fallback.is_out_of_stock(document.fallback)
+        return not self._availability(document.product)
+
+    @staticmethod
+    def _availability(product):
+        """True if any offer is available, False if none is, None if the offers don't say"""
+        offers = product.get('offers') or []
+        availabilities = [str(offer.get('availability', '')).rsplit('/', 1)[-1]
+                          for offer in (offers if isinstance(offers, list) else [offers]) if isinstance(offer, dict)]
+        availabilities = [availability for availability in availabilities if availability]
+        if not availabilities:
+            return None
+        return any(availability in IN_STOCK_AVAILABILITY for availability in availabilities)
+
+
+PARSERS = {parser.name: parser
+           for parser in (SoupParser, StrainedSoupParser, StreamingParser, StructuredDataParser)}
+DEFAULT_PARSER = StrainedSoupParser.name
+
+
+def get_parser(name: str = DEFAULT_PARSER) -> PageParser:
+    """Create a parser backend by name"""
+    try:
+        return PARSERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown parser '{name}', expected one of: {', '.join(PARSERS)}")
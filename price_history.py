@@ -0,0 +1,283 @@
+"""Price history of every monitored product, with analytics vectorized across the whole watchlist.
+
+Usage: python price_history.py [--file .mstock_prices.npz] [--window-days 30] [--below PERCENT]
+"""
+import argparse
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from constants import DEFAULT_PRICE_HISTORY_PATH, DEFAULT_PRICE_WINDOW_IN_DAYS, SECONDS_PER_DAY
+from printer import CustomPrinter
+from product import ProductInfo, format_cents
+
+INITIAL_CAPACITY = 1024
+# Sale column value of prices without a sale price
+NO_SALE = -1
+# New prices are written to the history file at most this often, so a crash loses at most this much of it
+SAVE_EVERY_SECONDS = 60
+
+# One row per price change, in the order they were observed
+ROW_COLUMNS = {'product': np.int32, 'at': np.float64, 'until': np.float64, 'regular': np.int64, 'sale': np.int64,
+               'price': np.int64}
+# One row per product
+PRODUCT_COLUMNS = {'last_row': np.int64, 'low': np.int64, 'active': np.bool_, 'dropped': np.bool_}
+
+
+class PriceHistory:
+    """Columnar time series of the regular and sale prices of every product.
+
+    A row is appended only when a product's price changes, to NumPy columns shared by every product, and keeps the
+    time the next price replaced it. Averages are weighted by how long each price held, so analytics across the whole
+    watchlist are a few array operations over the rows rather than a loop over products.
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_PRICE_HISTORY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # One writer of the file at a time, without holding up recording
+        self._unsaved = False
+        self._last_saved = time.monotonic()
+        self._index: Dict[str, int] = {}
+        self._urls: List[str] = []
+        self._rows = 0
+        self._row_columns = {name: np.empty(INITIAL_CAPACITY, dtype) for name, dtype in ROW_COLUMNS.items()}
+        self._product_columns = {name: np.empty(INITIAL_CAPACITY, dtype) for name, dtype in PRODUCT_COLUMNS.items()}
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def record(self, url: str, product_info: Optional[ProductInfo], at: float = None) -> bool:
+        """Append a product's price if it changed since it was last recorded. Returns True if a row was added.
+
+        New prices are saved to the history file every SAVE_EVERY_SECONDS.
+        """
+        if product_info is None or product_info.regular_price_cents is None:
+            return False
+        regular = product_info.regular_price_cents
+        sale = product_info.sale_price_cents if product_info.sale_price_cents is not None else NO_SALE
+        added = self._append(url, regular, sale, time.time() if at is None else at)
+        if added and self.path and time.monotonic() - self._last_saved >= SAVE_EVERY_SECONDS:
+            self.save()
+        return added
+
+    def _append(self, url: str, regular: int, sale: int, at: float) -> bool:
+        with self._lock:
+            product = self._index.get(url)
+            if product is None:
+                product = self._add_product(url)
+            products, rows = self._product_columns, self._row_columns
+            products['active'][product] = True
+            last = products['last_row'][product]
+            if last >= 0:
+                if rows['regular'][last] == regular and rows['sale'][last] == sale:
+                    return False
+                rows['until'][last] = at
+
+            if self._rows == len(rows['at']):
+                self._grow(rows, self._rows * 2)
+            row = self._rows
+            price = sale if sale != NO_SALE else regular
+            for name, value in (('product', product), ('at', at), ('until', np.inf), ('regular', regular),
+                                ('sale', sale), ('price', price)):
+                rows[name][row] = value
+            self._rows += 1
+            products['last_row'][product] = row
+            products['low'][product] = min(products['low'][product], price)
+            self._unsaved = True
+            return True
+
+    def forget(self, url: str):
+        """Leave a product that is no longer monitored out of drop checks, keeping its history"""
+        with self._lock:
+            product = self._index.get(url)
+            if product is not None:
+                self._product_columns['active'][product] = False
+                self._product_columns['dropped'][product] = False
+
+    def averages(self, window: float, now: float = None) -> np.ndarray:
+        """Mean price in cents of every product over the last `window` seconds, weighted by how long each price held.
+
+        NaN for products without any time in the window yet. Aligned with `urls`.
+        """
+        with self._lock:
+            return self._averages(window, now)
+
+    def drops(self, window: float, now: float = None) -> np.ndarray:
+        """How far below its average over the window every product's current price is, as a fraction"""
+        with self._lock:
+            return self._drops(self._averages(window, now))
+
+    def new_drops(self, percent: float, window: float, now: float = None) -> List[str]:
+        """Monitored products whose price just fell at least `percent` below their average over the window.
+
+        A product is reported once per drop: its price has to climb back above the threshold to be reported again.
+        """
+        with self._lock:
+            count = len(self._urls)
+            below = self._drops(self._averages(window, now)) >= percent / 100  # NaN compares False
+            below &= self._product_columns['active'][:count]
+            dropped = self._product_columns['dropped'][:count]
+            new = below & ~dropped
+            dropped[:] = below
+            return [self._urls[product] for product in np.flatnonzero(new)]
+
+    def lows(self) -> np.ndarray:
+        """All-time low price in cents of every product, aligned with `urls`"""
+        with self._lock:
+            return self._product_columns['low'][:len(self._urls)].copy()
+
+    def summary(self, url: str, window: float, now: float = None) -> Optional[Tuple[int, int, Optional[float]]]:
+        """(current price, all-time low, average over the window or None) of one product, in cents"""
+        with self._lock:
+            product = self._index.get(url)
+            if product is None:
+                return None
+            last = self._product_columns['last_row'][product]
+            average = float(self._averages(window, now)[product])
+            return (int(self._row_columns['price'][last]), int(self._product_columns['low'][product]),
+                    average if np.isfinite(average) else None)
+
+    def table(self, window: float, now: float = None) -> List[tuple]:
+        """(url, price, regular price, percent off, all-time low, average, drop) of every product, biggest drop first"""
+        with self._lock:
+            count = len(self._urls)
+            averages = self._averages(window, now)
+            drops = self._drops(averages)
+            last = self._product_columns['last_row'][:count]
+            prices, regular = self._row_columns['price'][last], self._row_columns['regular'][last]
+            lows = self._product_columns['low'][:count]
+            order = np.argsort(-np.nan_to_num(drops, nan=-np.inf), kind='stable')
+            return [(self._urls[product], int(prices[product]), int(regular[product]),
+                     round((regular[product] - prices[product]) * 100 / regular[product]) if regular[product] else 0,
+                     int(lows[product]), float(averages[product]), float(drops[product])) for product in order]
+
+    @property
+    def urls(self) -> List[str]:
+        with self._lock:
+            return list(self._urls)
+
+    def __len__(self) -> int:
+        return len(self._urls)
+
+    def save(self, path: str = None):
+        """Write the history to a .npz file, replacing the previous one in one rename.
+
+        The columns are copied under the lock and written outside it, so recording carries on during the write.
+        """
+        path = path or self.path
+        with self._save_lock:
+            with self._lock:
+                count = len(self._urls)
+                arrays = {f'row_{name}': column[:self._rows].copy() for name, column in self._row_columns.items()}
+                arrays.update({f'product_{name}': column[:count].copy()
+                               for name, column in self._product_columns.items()})
+                # URLs never contain newlines, and one byte array is far smaller than a fixed-width string array
+                arrays['urls'] = np.frombuffer('\n'.join(self._urls).encode('utf-8'), dtype=np.uint8)
+                self._unsaved = False
+                self._last_saved = time.monotonic()
+            temporary_path = f"{path}.tmp"
+            with open(temporary_path, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(temporary_path, path)
+
+    def flush(self):
+        """Save prices recorded since the last save"""
+        if self.path and self._unsaved:
+            self.save()
+
+    def close(self):
+        if self.path:
+            self.save()
+
+    def _load(self, path: str):
+        with np.load(path, allow_pickle=False) as data:
+            urls = data['urls'].tobytes().decode('utf-8')
+            self._urls = urls.split('\n') if urls else []
+            self._index = {url: product for product, url in enumerate(self._urls)}
+            self._rows = len(data['row_at'])
+            for name in self._row_columns:
+                self._row_columns[name] = np.resize(data[f'row_{name}'], max(INITIAL_CAPACITY, self._rows * 2))
+            for name in self._product_columns:
+                self._product_columns[name] = np.resize(data[f'product_{name}'],
+                                                        max(INITIAL_CAPACITY, len(self._urls) * 2))
+
+    def _add_product(self, url: str) -> int:
+        product = len(self._urls)
+        if product == len(self._product_columns['low']):
+            self._grow(self._product_columns, product * 2)
+        self._urls.append(url)
+        self._index[url] = product
+        columns = self._product_columns
+        columns['last_row'][product] = -1
+        columns['low'][product] = np.iinfo(np.int64).max
+        columns['active'][product] = True
+        columns['dropped'][product] = False
+        return product
+
+    @staticmethod
+    def _grow(columns: Dict[str, np.ndarray], capacity: int):
+        for name, column in columns.items():
+            grown = np.empty(capacity, column.dtype)
+            grown[:len(column)] = column
+            columns[name] = grown
+
+    def _averages(self, window: float, now: Optional[float]) -> np.ndarray:
+        now = time.time() if now is None else now
+        rows = self._rows
+        columns = self._row_columns
+        # Seconds each price held within the window: clipped to the window, zero for prices outside it
+        held = np.minimum(columns['until'][:rows], now) - np.maximum(columns['at'][:rows], now - window)
+        np.maximum(held, 0, out=held)
+        products = columns['product'][:rows]
+        count = len(self._urls)
+        totals = np.bincount(products, weights=held * columns['price'][:rows], minlength=count)
+        durations = np.bincount(products, weights=held, minlength=count)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return totals / durations
+
+    def _drops(self, averages: np.ndarray) -> np.ndarray:
+        current = self._row_columns['price'][self._product_columns['last_row'][:len(self._urls)]]
+        return 1 - current / averages
+
+
+def _format_price(cents: float) -> str:
+    return format_cents(round(cents)) if np.isfinite(cents) else "N/A"
+
+
+def _format_drop(drop: float) -> str:
+    if not np.isfinite(drop):
+        return "N/A"
+    percent = round(drop * 100)
+    return f"{-percent:+d}%" if percent else "0%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the price history')
+    parser.add_argument('--file', default=DEFAULT_PRICE_HISTORY_PATH, help='Price history file written by main.py')
+    parser.add_argument('--window-days', type=float, default=DEFAULT_PRICE_WINDOW_IN_DAYS,
+                        help='Days the average price is taken over')
+    parser.add_argument('--below', type=float, metavar='PERCENT',
+                        help='Only products at least this many percent below their average')
+    arguments = parser.parse_args()
+
+    printer = CustomPrinter()
+    if not os.path.exists(arguments.file):
+        printer.error(f"No price history at {arguments.file}")
+        return
+    history = PriceHistory(arguments.file)
+    rows = history.table(arguments.window_days * SECONDS_PER_DAY)
+    if arguments.below is not None:
+        rows = [row for row in rows if row[6] >= arguments.below / 100]
+    printer.section("Price History")
+    printer.table(["Price", "Regular", "% Off", "All-Time Low", f"{arguments.window_days:g}-Day Average",
+                   "vs Average", "URL"],
+                  [[format_cents(price), format_cents(regular), f"{percent_off}%" if percent_off else "",
+                    format_cents(low), _format_price(average), _format_drop(drop), url]
+                   for url, price, regular, percent_off, low, average, drop in rows])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,27 @@
+import sys
+
 from constants import COLORS
 
 class CustomPrinter:
     # Extended ANSI color codes and styles
 
-    def __init__(self, use_colors=True):
+    def __init__(self, use_colors=True, quiet=False, verbose=False):
         self._use_colors = use_colors
+        self._quiet = quiet
+        self._verbose = verbose
         self._indent_level = 0
         self._indent_size = 2
 
+    @property
+    def verbose(self):
+        """Whether detailed output (debug messages, per-item product details) is shown"""
+        return self._verbose and not self._quiet
+
     def table(self, headers, rows, min_width=12):
         """Print data in a formatted table"""
+        if self._quiet:
+            return
+
         # Calculate column widths
         widths = [max(min_width, len(str(h))) for h in headers]
         for row in rows:
@@ -31,12 +43,16 @@ class CustomPrinter:
 
     def section(self, title, char='='):
         """Print a section header"""
+        if self._quiet:
+            return
         width = 80
         padding = max(0, (width - len(title) - 2) // 2)
         print(f"\n{char * padding} {self._style(title, 'bold')} {char * padding}\n")
 
     def progress(self, current, total, prefix='Progress:', suffix='Complete', length=50):
         """Print a progress bar"""
+        if self._quiet:
+            return
         percent = float(current) * 100 / total
         filled_length = int(length * current // total)
         bar = '█' * filled_length + '-' * (length - filled_length)
@@ -44,13 +60,19 @@ class CustomPrinter:
         if current == total:
             print()
 
+    def blank(self):
+        """Print an empty line between blocks of output"""
+        if self._quiet:
+            return
+        print()
+
     def success(self, message):
         """Print success messages with enhanced formatting"""
         self._print_formatted("✓", message, 'green', 'bold')
 
     def error(self, message):
-        """Print error messages with enhanced formatting"""
-        self._print_formatted("✗", message, 'red', 'bold')
+        """Print error messages with enhanced formatting to stderr, even in quiet mode"""
+        self._print_formatted("✗", message, 'red', 'bold', stream=sys.stderr)
 
     def info(self, message):
         """Print info messages with enhanced formatting"""
@@ -61,7 +83,9 @@ class CustomPrinter:
         self._print_formatted("⚠", message, 'yellow', 'bold')
 
     def debug(self, message):
-        """Print debug messages with enhanced formatting"""
+        """Print debug messages with enhanced formatting, only in verbose mode"""
+        if not self._verbose:
+            return
         self._print_formatted("⚙", message, 'magenta', 'dim')
 
     def indent(self):
@@ -72,10 +96,12 @@ class CustomPrinter:
         """Decrease indentation level"""
         self._indent_level = max(0, self._indent_level - 1)
 
-    def _print_formatted(self, symbol, message, color, *styles):
+    def _print_formatted(self, symbol, message, color, *styles, stream=None):
+        if self._quiet and stream is None:
+            return
         indent = " " * (self._indent_level * self._indent_size)
         styled_text = self._style(f"{symbol} {message}", color, *styles)
-        print(f"{indent}{styled_text}")
+        print(f"{indent}{styled_text}", file=stream)
 
     def _style(self, text, *styles):
         if not self._use_colors:
@@ -88,7 +114,7 @@ class CustomPrinter:
 
 # Example usage
 if __name__ == "__main__":
-    printer = CustomPrinter()
+    printer = CustomPrinter(verbose=True)
 
     # Section headers
     printer.section("Product Information")
@@ -0,0 +1,250 @@
+import re
+import sys
+from datetime import datetime
+from enum import Enum
+from typing import List, Optional, Tuple
+
+from variants import Variant
+
+PRICE_PATTERN = re.compile(r'\$\s*(\d[\d,]*)(?:\.(\d{1,2}))?')
+PERCENT_OFF_PATTERN = re.compile(r'(\d{1,2}(?:\.\d+)?)\s*%\s*off', re.IGNORECASE)
+# Words that say whether the amounts after them are a sale price or the regular price it is reduced from
+PRICE_MARKER_PATTERN = re.compile(r'\b(?:(sale|now|clearance)|was|orig(?:inal)?|reg(?:ular)?)\b', re.IGNORECASE)
+CONTENT_DIGEST_SIZE = 16
+
+
+class StockStatus(str, Enum):
+    """Stock status of a product. Members compare equal to their display text"""
+    UNKNOWN = "Unknown"
+    IN_STOCK = "In Stock"
+    OUT_OF_STOCK = "Out of Stock"
+
+    def __str__(self):
+        return self.value
+
+
+def parse_price(text: str) -> Optional[Tuple[int, Optional[int]]]:
+    """Parse price text like "$59.99 Sale $39.99", "Was $59.99 Now $39.99" or "$59.99 (30% off)" into (regular, sale)
+    cents, None if no price.
+
+    Only amounts after a sale marker are sale prices, so a range like "$39.99 - $59.99" has no sale and its lowest
+    price is the regular one.
+    """
+    regular, sale = [], []
+    amounts = regular
+    position = 0
+    for marker in PRICE_MARKER_PATTERN.finditer(text):
+        amounts.extend(_amounts(text[position:marker.start()]))
+        amounts = sale if marker.group(1) else regular
+        position = marker.end()
+    amounts.extend(_amounts(text[position:]))
+    if not regular and not sale:
+        return None
+    if not regular:
+        return min(sale), None  # A sale price without the price it is reduced from
+    if not sale:
+        # A percent off without a sale price applies to the regular price
+        percent_off = PERCENT_OFF_PATTERN.search(text)
+        if percent_off and len(regular) == 1:
+            return regular[0], round(regular[0] * (100 - float(percent_off.group(1))) / 100)
+        return min(regular), None
+    return min(regular), min(sale)
+
+
+def _amounts(text: str) -> List[int]:
+    return [int(dollars.replace(',', '')) * 100 + int((cents or '0').ljust(2, '0'))
+            for dollars, cents in PRICE_PATTERN.findall(text)]
+
+
+def format_cents(cents: int) -> str:
+    return f"${cents // 100:,}.{cents % 100:02d}"
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value else value
+
+
+class ProductInfo:
+    """Class to store product information.
+
+    Uses __slots__ and compact field storage because thousands of these are kept in memory: statuses are enum
+    members, repeated text (brand, rating, reviews, price) is interned, prices are also parsed into integer cents and
+    timestamps are kept as epoch seconds.
+    """
+    __slots__ = ('id', 'name', '_brand', '_regular_cents', '_sale_cents', '_price_text', '_status', 'description',
+                 '_reviews_count', '_rating', '_last_checked', 'etag', '_last_modified', 'content_digest', 'variants')
+    FIELDS = ('id', 'name', 'brand', 'price', 'status', 'description', 'reviews_count', 'rating', 'last_checked',
+              'etag', 'last_modified', 'content_digest', 'variants')
+
+    def __init__(self, id: str, name: str, brand: str, price: Optional[str] = None,
+                 status: str = StockStatus.UNKNOWN, description: Optional[str] = None,
+                 reviews_count: Optional[str] = None, rating: Optional[str] = None,
+                 last_checked: Optional[datetime] = None, etag: Optional[str] = None,
+                 last_modified: Optional[str] = None, content_digest: Optional[bytes] = None,
+                 variants: Optional[Tuple[Variant, ...]] = None):
+        self.id = id
+        self.name = name
+        self.brand = brand
+        self.price = price
+        self.status = status
+        self.description = description
+        self.reviews_count = reviews_count
+        self.rating = rating
+        self.last_checked = last_checked
+        # Validators of the page the info was read from, used to skip re-parsing unchanged pages
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_digest = content_digest
+        # Per-SKU availability, when the page lists its sizes and colors
+        self.variants = variants
+
+    @property
+    def brand(self) -> str:
+        return self._brand
+
+    @brand.setter
+    def brand(self, value: str):
+        self._brand = _intern(value)
+
+    @property
+    def price(self) -> Optional[str]:
+        """Display price as scraped, e.g. "$59.99 Sale $39.99" or "$39.99 - $59.99" """
+        return self._price_text
+
+    @price.setter
+    def price(self, value: Optional[str]):
+        self._price_text = _intern(value)
+        # Text without a dollar amount (e.g. "Price unavailable") has no cents
+        parsed = parse_price(value) if value else None
+        self._regular_cents, self._sale_cents = parsed or (None, None)
+
+    @property
+    def regular_price_cents(self) -> Optional[int]:
+        return self._regular_cents
+
+    @property
+    def sale_price_cents(self) -> Optional[int]:
+        return self._sale_cents
+
+    @property
+    def price_cents(self) -> Optional[int]:
+        """Current price in cents: the sale price when there is one, the lowest price of a range"""
+        return self._sale_cents if self._sale_cents is not None else self._regular_cents
+
+    @property
+    def percent_off(self) -> Optional[int]:
+        """Discount of the sale price off the regular price, in whole percent"""
+        if self._sale_cents is None or not self._regular_cents or self._sale_cents >= self._regular_cents:
+            return None
+        return round((self._regular_cents - self._sale_cents) * 100 / self._regular_cents)
+
+    @property
+    def status(self) -> StockStatus:
+        return self._status
+
+    @status.setter
+    def status(self, value: str):
+        self._status = StockStatus(value)
+
+    @property
+    def rating(self) -> Optional[str]:
+        return self._rating
+
+    @rating.setter
+    def rating(self, value: Optional[str]):
+        self._rating = _intern(value)
+
+    @property
+    def reviews_count(self) -> Optional[str]:
+        return self._reviews_count
+
+    @reviews_count.setter
+    def reviews_count(self, value: Optional[str]):
+        self._reviews_count = _intern(value)
+
+    @property
+    def last_checked(self) -> Optional[datetime]:
+        return datetime.fromtimestamp(self._last_checked) if self._last_checked else None
+
+    @last_checked.setter
+    def last_checked(self, value: Optional[datetime]):
+        self._last_checked = int(value.timestamp()) if value else 0
+
+    @property
+    def last_checked_epoch(self) -> int:
+        """Epoch seconds of the last check, 0 if never checked"""
+        return self._last_checked
+
+    @property
+    def last_modified(self) -> Optional[str]:
+        return self._last_modified
+
+    @last_modified.setter
+    def last_modified(self, value: Optional[str]):
+        self._last_modified = _intern(value)
+
+    def raw_fields(self) -> tuple:
+        """The stored (compact) value of every slot, in __slots__ order"""
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    @classmethod
+    def from_raw_fields(cls, values) -> 'ProductInfo':
+        """Rebuild product information from the output of raw_fields without re-parsing anything"""
+        product_info = cls.__new__(cls)
+        for slot, value in zip(cls.__slots__, values):
+            setattr(product_info, slot, value)
+        return product_info
+
+    @classmethod
+    def encode_raw_fields(cls, values) -> list:
+        """Output of raw_fields as JSON-serialisable values: the digest as hex and variants as dicts"""
+        raw = dict(zip(cls.__slots__, values))
+        if raw['content_digest']:
+            raw['content_digest'] = raw['content_digest'].hex()
+        if raw['variants']:
+            raw['variants'] = [variant.to_dict() for variant in raw['variants']]
+        return [raw[slot] for slot in cls.__slots__]
+
+    @classmethod
+    def decode_raw_fields(cls, values) -> tuple:
+        """Reverse encode_raw_fields"""
+        raw = dict(zip(cls.__slots__, values))
+        raw['_status'] = StockStatus(raw['_status'])
+        if raw['content_digest']:
+            raw['content_digest'] = bytes.fromhex(raw['content_digest'])
+        if raw['variants']:
+            raw['variants'] = tuple(Variant.from_dict(variant) for variant in raw['variants'])
+        return tuple(raw[slot] for slot in cls.__slots__)
+
+    def to_dict(self) -> dict:
+        """Convert to a JSON-serialisable dict"""
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        data['status'] = self.status.value
+        if self.last_checked:
+            data['last_checked'] = self.last_checked.isoformat()
+        if self.content_digest:
+            data['content_digest'] = self.content_digest.hex()
+        if self.variants:
+            data['variants'] = [variant.to_dict() for variant in self.variants]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ProductInfo':
+        """Rebuild product information from the output of to_dict"""
+        data = dict(data)
+        if data.get('last_checked'):
+            data['last_checked'] = datetime.fromisoformat(data['last_checked'])
+        if data.get('content_digest'):
+            data['content_digest'] = bytes.fromhex(data['content_digest'])
+        if data.get('variants'):
+            data['variants'] = tuple(Variant.from_dict(variant) for variant in data['variants'])
+        return cls(**data)
+
+    def __eq__(self, other):
+        if not isinstance(other, ProductInfo):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __repr__(self):
+        fields = ', '.join(f"{field}={getattr(self, field)!r}" for field in self.FIELDS)
+        return f"ProductInfo({fields})"
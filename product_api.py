@@ -0,0 +1,103 @@
+from typing import Dict, List, Optional, Tuple
+
+from constants import PRODUCT_API_URL, PRODUCT_API_BATCH_SIZE
+from metrics import REGISTRY
+from parsers import format_price_range
+from product import ProductInfo, StockStatus
+from retailers import adapter_for
+from transport import ResilientTransport
+
+
+def _dig(data, *path):
+    """Follow a path of keys and list indexes through nested JSON, returning None if any step is missing"""
+    for step in path:
+        try:
+            data = data[step]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return data
+
+
+def product_from_api(entry: dict) -> Tuple[Optional[bool], ProductInfo]:
+    """Stock status and product information from one entry of a product API response"""
+    brand = _dig(entry, 'detail', 'brand')
+    # Tiers are labelled, e.g. "Reg." and "Sale": sale tiers are the price, the others what it is reduced from
+    tiers = {}
+    for tier in _dig(entry, 'pricing', 'price', 'tieredPrice') or []:
+        is_sale = 'sale' in str(tier.get('label') or '').lower()
+        tiers.setdefault(is_sale, []).extend(value['value'] for value in tier.get('values') or []
+                                             if value.get('value') is not None)
+    prices = tiers.get(True) or tiers.get(False)
+    regular_price = max(tiers[False]) if tiers.get(True) and tiers.get(False) else None
+    rating = _dig(entry, 'reviewStatistics', 'aggregate', 'rating')
+    reviews = _dig(entry, 'reviewStatistics', 'aggregate', 'count')
+    available = _dig(entry, 'availability', 'available')
+    status = StockStatus.UNKNOWN
+    if available is not None:
+        status = StockStatus.IN_STOCK if available else StockStatus.OUT_OF_STOCK
+
+    info = ProductInfo(id=str(entry.get('id', "")), name=_dig(entry, 'detail', 'name') or "",
+                       brand=(brand.get('name') if isinstance(brand, dict) else brand) or "",
+                       price=format_price_range(prices, regular_price) if prices else None,
+                       rating=str(rating) if rating is not None else None,
+                       reviews_count=f"({reviews} reviews)" if reviews is not None else None, status=status)
+    return (bool(available) if available is not None else None), info
+
+
+class ProductApiClient:
+    """Looks up many products per request from the structured product endpoint instead of their HTML pages.
+
+    `url_template` takes the comma-separated product IDs as `{ids}`. Products missing from a response, whose
+    availability it doesn't state or whose entry can't be read are left out of the results so the caller falls back
+    to the product page.
+    """
+
+    def __init__(self, transport: ResilientTransport, url_template: str = PRODUCT_API_URL,
+                 batch_size: int = PRODUCT_API_BATCH_SIZE, retailer: str = 'macys'):
+        self.transport = transport
+        self.url_template = url_template
+        self.batch_size = max(1, batch_size)
+        self.retailer = retailer  # Adapter name of the retailer whose products the endpoint answers for
+
+    def batches(self, urls: List[str]) -> List[Dict[str, str]]:
+        """Group the retailer's URLs that carry a product ID into batches of product ID -> URL"""
+        batches = [{}]
+        for url in urls:
+            adapter = adapter_for(url)
+            product_id = adapter.product_id(url) if adapter is not None and adapter.name == self.retailer else None
+            if product_id is None:
+                continue  # Another retailer's product, or no product ID: only the page can answer
+            if len(batches[-1]) >= self.batch_size:
+                batches.append({})
+            batches[-1][product_id] = url
+        return [batch for batch in batches if batch]
+
+    def fetch(self, batch: Dict[str, str]) -> Dict[str, Tuple[Optional[bool], ProductInfo]]:
+        """Look up a batch of product IDs, returning URL -> (in stock, product info) for those answered"""
+        try:
+            with REGISTRY.timer('mstock_phase_seconds', phase='api'):
+                response = self.transport.get(self.url_template.format(ids=','.join(batch)),
+                                              headers={'Accept': 'application/json'})
+            response.raise_for_status()
+            REGISTRY.increment('mstock_fetched_bytes_total', len(response.content))
+            entries = response.json().get('product') or []
+        except Exception:
+            REGISTRY.increment('mstock_fast_path_total', len(batch), source='api', result='error')
+            return {}
+
+        results = {}
+        for entry in entries if isinstance(entries, list) else []:
+            if not isinstance(entry, dict) or entry.get('id') is None:
+                continue
+            url = batch.get(str(entry['id']))
+            if url is None:
+                continue
+            try:
+                status, info = product_from_api(entry)
+            except Exception:
+                continue  # A malformed entry is left to the product page, like a missing one
+            if status is not None:
+                results[url] = (status, info)
+        REGISTRY.increment('mstock_fast_path_total', len(results), source='api', result='hit')
+        REGISTRY.increment('mstock_fast_path_total', len(batch) - len(results), source='api', result='fallback')
+        return results
@@ -0,0 +1,281 @@
+import json
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+
+from constants import DEFAULT_CACHE_MAX_ENTRIES, DEFAULT_CACHE_TTL_IN_SECONDS
+from product import CONTENT_DIGEST_SIZE, ProductInfo, StockStatus
+from sqlite_store import BatchedConnection
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS products (url TEXT PRIMARY KEY, data TEXT NOT NULL, stored_at REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS products_stored_at ON products (stored_at)',
+)
+
+
+class ProductCache:
+    """Product information cache with an in-memory LRU tier backed by an optional SQLite file"""
+
+    def __init__(self, path: Optional[str] = None, ttl: float = DEFAULT_CACHE_TTL_IN_SECONDS,
+                 max_entries: int = DEFAULT_CACHE_MAX_ENTRIES, warm_start: bool = True):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._memory = OrderedDict()  # url -> (stored_at, ProductInfo), least recently used first
+        self._lock = threading.RLock()
+        self._db = None
+
+        if path:
+            self._db = BatchedConnection(path, SCHEMA)
+            self.purge_expired()
+            if warm_start:
+                self._warm_start()
+
+    def get(self, url: str) -> Optional[ProductInfo]:
+        """Get product information that hasn't expired, loading it from disk if it isn't in memory"""
+        with self._lock:
+            entry = self._memory.get(url)
+            if entry is None and self._db:
+                row = self._db.execute('SELECT stored_at, data FROM products WHERE url = ?', (url,)).fetchone()
+                if row:
+                    entry = (row[0], ProductInfo.from_dict(json.loads(row[1])))
+                    self._remember(url, entry)
+            if entry is None:
+                return None
+
+            stored_at, product_info = entry
+            if self._expired(stored_at):
+                self.discard(url)
+                return None
+            self._memory.move_to_end(url)
+            return product_info
+
+    def put(self, url: str, product_info: ProductInfo):
+        """Store product information in memory and write it through to disk"""
+        stored_at = time.time()
+        with self._lock:
+            self._remember(url, (stored_at, product_info))
+            if self._db:
+                self._db.write('INSERT OR REPLACE INTO products (url, data, stored_at) VALUES (?, ?, ?)',
+                               (url, json.dumps(product_info.to_dict()), stored_at))
+
+    def discard(self, url: str):
+        """Remove a product from both tiers"""
+        with self._lock:
+            self._memory.pop(url, None)
+            if self._db:
+                self._db.write('DELETE FROM products WHERE url = ?', (url,))
+
+    def purge_expired(self):
+        """Delete every entry older than the TTL"""
+        if not self.ttl:
+            return
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for url in [url for url, (stored_at, _) in self._memory.items() if stored_at < cutoff]:
+                del self._memory[url]
+            if self._db:
+                self._db.write('DELETE FROM products WHERE stored_at < ?', (cutoff,))
+                self.flush()
+
+    def flush(self):
+        """Commit pending writes to disk"""
+        with self._lock:
+            if self._db:
+                self._db.commit()
+
+    def close(self):
+        """Flush and close the backing file"""
+        with self._lock:
+            self.flush()
+            if self._db:
+                self._db.close()
+                self._db = None
+
+    @property
+    def persistent(self) -> bool:
+        """Whether products outlive the process without being checkpointed"""
+        return self._db is not None
+
+    def raw_items(self) -> List[Tuple[str, tuple]]:
+        """(url, compact fields) of every product held in memory"""
+        with self._lock:
+            return [(url, product_info.raw_fields()) for url, (_, product_info) in self._memory.items()]
+
+    def __contains__(self, url: str) -> bool:
+        return self.get(url) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            if self._db:
+                return self._db.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+            return len(self._memory)
+
+    def _warm_start(self):
+        """Load the most recently stored products into memory"""
+        rows = self._db.execute('SELECT url, stored_at, data FROM products ORDER BY stored_at DESC LIMIT ?',
+                                (self.max_entries,)).fetchall()
+        for url, stored_at, data in reversed(rows):
+            self._memory[url] = (stored_at, ProductInfo.from_dict(json.loads(data)))
+
+    def _remember(self, url, entry):
+        self._memory[url] = entry
+        self._memory.move_to_end(url)
+        while len(self._memory) > self.max_entries:
+            # Evicted entries stay on disk and are reloaded on the next miss
+            self._memory.popitem(last=False)
+
+    def _expired(self, stored_at: float) -> bool:
+        return bool(self.ttl) and time.time() - stored_at > self.ttl
+
+
+class StringPool:
+    """Stores each distinct string once and hands out small integer references to it"""
+
+    def __init__(self):
+        self._strings = [None]  # reference 0 is None
+        self._references = {}
+
+    def add(self, value: Optional[str]) -> int:
+        if value is None:
+            return 0
+        reference = self._references.get(value)
+        if reference is None:
+            reference = self._references[value] = len(self._strings)
+            self._strings.append(value)
+        return reference
+
+    def get(self, reference: int) -> Optional[str]:
+        return self._strings[reference]
+
+
+class ProductTable:
+    """Columnar in-memory product store with the same interface as ProductCache.
+
+    Each field is a column: numbers live in typed arrays, repeated text (brand, rating, reviews, Last-Modified) in
+    string pools and page digests in one shared byte buffer, so a tracked product costs a few dozen bytes plus its ID
+    and name. Product information is rebuilt on every get, so changes must be stored again with put.
+    """
+    STATUSES = list(StockStatus)
+    NO_VALUE = -1
+
+    def __init__(self):
+        self._rows = {}  # url -> row
+        self._free_rows = []
+        self._ids = []
+        self._names = []
+        self._descriptions = []
+        self._etags = []
+        self._price_texts = []
+        self._variants = []
+        self._regular_cents = array('q')
+        self._sale_cents = array('q')
+        self._last_checked = array('q')
+        self._statuses = array('b')
+        self._brands = array('l')
+        self._ratings = array('l')
+        self._reviews_counts = array('l')
+        self._last_modified = array('l')
+        self._digests = bytearray()  # a presence byte followed by the digest, per row
+        self._pool = StringPool()
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> Optional[ProductInfo]:
+        with self._lock:
+            row = self._rows.get(url)
+            if row is None:
+                return None
+
+            digest_start = row * (CONTENT_DIGEST_SIZE + 1)
+            digest = None
+            if self._digests[digest_start]:
+                digest = bytes(self._digests[digest_start + 1:digest_start + 1 + CONTENT_DIGEST_SIZE])
+            raw = {'id': self._ids[row], 'name': self._names[row], '_brand': self._pool.get(self._brands[row]),
+                   '_regular_cents': self._optional_number(self._regular_cents[row]),
+                   '_sale_cents': self._optional_number(self._sale_cents[row]),
+                   '_price_text': self._price_texts[row], '_status': self.STATUSES[self._statuses[row]],
+                   'description': self._descriptions[row],
+                   '_reviews_count': self._pool.get(self._reviews_counts[row]),
+                   '_rating': self._pool.get(self._ratings[row]), '_last_checked': self._last_checked[row],
+                   'etag': self._etags[row], '_last_modified': self._pool.get(self._last_modified[row]),
+                   'content_digest': digest, 'variants': self._variants[row]}
+            return ProductInfo.from_raw_fields(raw[slot] for slot in ProductInfo.__slots__)
+
+    def put(self, url: str, product_info: ProductInfo):
+        raw = dict(zip(ProductInfo.__slots__, product_info.raw_fields()))
+        with self._lock:
+            row = self._rows.get(url)
+            if row is None:
+                row = self._free_rows.pop() if self._free_rows else self._append_row()
+                self._rows[url] = row
+
+            self._ids[row] = raw['id']
+            self._names[row] = raw['name']
+            self._descriptions[row] = raw['description']
+            self._etags[row] = raw['etag']
+            self._price_texts[row] = raw['_price_text']
+            self._variants[row] = raw['variants']
+            self._regular_cents[row] = self._number(raw['_regular_cents'])
+            self._sale_cents[row] = self._number(raw['_sale_cents'])
+            self._last_checked[row] = raw['_last_checked']
+            self._statuses[row] = self.STATUSES.index(raw['_status'])
+            self._brands[row] = self._pool.add(raw['_brand'])
+            self._ratings[row] = self._pool.add(raw['_rating'])
+            self._reviews_counts[row] = self._pool.add(raw['_reviews_count'])
+            self._last_modified[row] = self._pool.add(raw['_last_modified'])
+
+            digest = raw['content_digest']
+            digest_start = row * (CONTENT_DIGEST_SIZE + 1)
+            if digest and len(digest) == CONTENT_DIGEST_SIZE:
+                self._digests[digest_start:digest_start + 1 + CONTENT_DIGEST_SIZE] = b'\x01' + digest
+            else:
+                self._digests[digest_start] = 0
+
+    def discard(self, url: str):
+        with self._lock:
+            row = self._rows.pop(url, None)
+            if row is None:
+                return
+            for column in (self._ids, self._names, self._descriptions, self._etags, self._price_texts, self._variants):
+                column[row] = None
+            self._free_rows.append(row)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    @property
+    def persistent(self) -> bool:
+        return False
+
+    def raw_items(self) -> Iterator[Tuple[str, tuple]]:
+        """(url, compact fields) of every product, taking the lock one product at a time so checks aren't held up"""
+        for url in list(self._rows):
+            product_info = self.get(url)
+            if product_info:
+                yield url, product_info.raw_fields()
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _append_row(self) -> int:
+        for column in (self._ids, self._names, self._descriptions, self._etags, self._price_texts, self._variants):
+            column.append(None)
+        for column in (self._regular_cents, self._sale_cents, self._last_checked, self._statuses, self._brands,
+                       self._ratings, self._reviews_counts, self._last_modified):
+            column.append(0)
+        self._digests.extend(bytes(CONTENT_DIGEST_SIZE + 1))
+        return len(self._ids) - 1
+
+    def _number(self, value: Optional[int]) -> int:
+        return self.NO_VALUE if value is None else value
+
+    def _optional_number(self, value: int) -> Optional[int]:
+        return None if value == self.NO_VALUE else value
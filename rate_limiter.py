@@ -0,0 +1,68 @@
+import threading
+import time
+from typing import Callable, Union
+from urllib.parse import urlsplit
+
+
+class TokenBucket:
+    """Thread-safe token bucket that hands out request slots at a fixed rate"""
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.capacity = max(1.0, float(burst))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take one token and return how many seconds the caller must wait before using it"""
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def wait_time(self) -> float:
+        """Seconds a token reserved now would have to wait, without taking it"""
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            tokens = min(self.capacity, self._tokens + (time.monotonic() - self._updated) * self.rate)
+            return max(0.0, (1 - tokens) / self.rate)
+
+    def acquire(self):
+        """Block the calling thread until a token is available"""
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+
+class HostRateLimiter:
+    """Keeps one token bucket per host so every retailer gets its own request budget.
+
+    `rate` is either the same budget for every host, or a function of the first URL seen for a host returning its
+    budget.
+    """
+
+    def __init__(self, rate: Union[float, Callable[[str], float]], burst: float = 1):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket_for(self, url: str) -> TokenBucket:
+        """Get (or create) the bucket for the host of a URL"""
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                rate = self.rate(url) if callable(self.rate) else self.rate
+                bucket = self._buckets[host] = TokenBucket(rate, self.burst)
+            return bucket
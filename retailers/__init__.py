@@ -0,0 +1,54 @@
+"""Retailer adapters, routed to by domain.
+
+A URL is routed with one dictionary lookup of its host, and an adapter's module is only imported the first time one
+of its URLs is seen, so supporting more retailers costs nothing at startup.
+"""
+import importlib
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from retailers.base import RetailerAdapter
+
+# Adapter name -> (module, class), imported on first use
+ADAPTERS = {'macys': ('retailers.macys', 'MacysAdapter')}
+# Host -> adapter name
+DOMAINS = {'www.macys.com': 'macys'}
+DEFAULT_RETAILER = 'macys'
+
+_domains: Dict[str, str] = dict(DOMAINS)
+_adapters: Dict[str, RetailerAdapter] = {}
+_lock = threading.Lock()
+
+
+def get_adapter(name: str) -> RetailerAdapter:
+    """The adapter of a retailer by name, importing its module the first time"""
+    adapter = _adapters.get(name)
+    if adapter is not None:
+        return adapter
+    if name not in ADAPTERS:
+        raise ValueError(f"Unknown retailer '{name}', expected one of: {', '.join(ADAPTERS)}")
+    with _lock:
+        if name not in _adapters:
+            module_name, class_name = ADAPTERS[name]
+            _adapters[name] = getattr(importlib.import_module(module_name), class_name)()
+        return _adapters[name]
+
+
+def adapter_for(url: str) -> Optional[RetailerAdapter]:
+    """The adapter of the retailer a URL belongs to, or None if no adapter handles its host"""
+    parts = urlsplit(url)
+    # An exact host:port entry wins over the bare host
+    name = _domains.get(parts.netloc.lower()) or _domains.get(parts.hostname or '')
+    return get_adapter(name) if name else None
+
+
+def register_domain(domain: str, name: str):
+    """Route URLs of another host (or host:port) to an adapter, e.g. a local stand-in for a retailer's site"""
+    if name not in ADAPTERS:
+        raise ValueError(f"Unknown retailer '{name}', expected one of: {', '.join(ADAPTERS)}")
+    _domains[domain.lower()] = name
+
+
+def supported_domains() -> List[str]:
+    return list(DOMAINS)
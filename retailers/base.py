@@ -0,0 +1,50 @@
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from constants import DEFAULT_HOST_RATE_PER_SECOND
+
+
+class RetailerAdapter:
+    """What the monitor needs to know about one retailer: which URLs are its products, how to read its pages and how
+    hard its site may be queried"""
+    name = ""
+    # Path every product page starts with
+    product_path_prefix = "/"
+    # Query parameter that identifies a product, the others are tracking or navigation. None keeps the whole query
+    id_parameter: Optional[str] = None
+    # Page parser backend, by name (see parsers.PARSERS)
+    parser_name = "strained"
+    # Requests per second to each of the retailer's hosts, unless the monitor is given a rate of its own
+    rate = DEFAULT_HOST_RATE_PER_SECOND
+    # Checks of the retailer's products in flight at once, within the monitor's concurrency. None for no own limit
+    concurrency: Optional[int] = None
+
+    def is_product_url(self, url: str) -> bool:
+        parts = urlsplit(url)
+        return parts.scheme in ('http', 'https') and parts.path.startswith(self.product_path_prefix)
+
+    def normalize_url(self, url: str) -> str:
+        """Drop fragments and every query parameter but the product's ID"""
+        parts = urlsplit(url.strip())
+        query = parts.query
+        if self.id_parameter is not None:
+            query = urlencode([(name, value) for name, value in parse_qsl(query) if name == self.id_parameter])
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+    def product_id(self, url: str) -> Optional[str]:
+        """The retailer's ID of the product behind a URL, None if the URL doesn't carry one"""
+        if self.id_parameter is None:
+            return None
+        for name, value in parse_qsl(urlsplit(url).query):
+            if name == self.id_parameter and value:
+                return value
+        return None
+
+    def create_parser(self, name: str = None):
+        """A page parser for this retailer's product pages"""
+        # Imported here so routing URLs never loads the HTML parsing libraries
+        from parsers import get_parser
+        return get_parser(name or self.parser_name)
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
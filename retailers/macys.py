@@ -0,0 +1,11 @@
+from constants import DEFAULT_HOST_RATE_PER_SECOND
+from retailers.base import RetailerAdapter
+
+
+class MacysAdapter(RetailerAdapter):
+    """Macy's product pages, https://www.macys.com/shop/product/...?ID=..."""
+    name = 'macys'
+    product_path_prefix = '/shop/product/'
+    id_parameter = 'ID'
+    parser_name = 'strained'
+    rate = DEFAULT_HOST_RATE_PER_SECOND
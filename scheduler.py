@@ -0,0 +1,174 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Iterable, List, Optional
+
+from constants import (MAX_ERROR_BACKOFF_STEPS, MAX_STABLE_INTERVAL_MULTIPLIER, PRIORITY_INTERVAL_MULTIPLIERS,
+                       STABLE_CHECKS_FOR_MAX_INTERVAL)
+from product import ProductInfo
+
+# Products due within this many seconds of each other are checked in the same batch
+COALESCE_WINDOW_IN_SECONDS = 1.0
+# Weight of the latest observation in the volatility average
+VOLATILITY_WEIGHT = 0.3
+# Random spread applied to adaptive intervals so products don't all fall due at the same moment
+INTERVAL_JITTER = 0.1
+
+
+class PollState:
+    """Scheduling state of one monitored URL"""
+    __slots__ = ('url', 'priority', 'due', 'version', 'volatility', 'unchanged_checks', 'errors', 'last_status',
+                 'last_price')
+
+    def __init__(self, url: str, priority: str, due: float, volatility: float = 0.0, unchanged_checks: int = 0,
+                 errors: int = 0, last_status: Optional[bool] = None, last_price: Optional[str] = None):
+        self.url = url
+        self.priority = priority
+        self.due = due
+        self.version = 0
+        self.volatility = volatility
+        self.unchanged_checks = unchanged_checks
+        self.errors = errors
+        self.last_status = last_status
+        self.last_price = last_price
+
+
+class PollScheduler:
+    """Priority-queue scheduler that gives every URL its own next-check time"""
+
+    def __init__(self, interval: float, adaptive: bool = False, min_interval: float = None,
+                 max_interval: float = None):
+        self.interval = interval
+        self.adaptive = adaptive
+        self.min_interval = min_interval if min_interval is not None else interval / 4
+        self.max_interval = max_interval if max_interval is not None else interval * MAX_STABLE_INTERVAL_MULTIPLIER
+        self._states = {}
+        self._heap = []  # (due, sequence, url, version); entries with an old version are skipped
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, url: str, priority: str = 'normal', delay: float = 0):
+        """Start scheduling a URL, first checking it after `delay` seconds. A URL that is already scheduled keeps its
+        schedule"""
+        if priority not in PRIORITY_INTERVAL_MULTIPLIERS:
+            raise ValueError(f"Unknown priority '{priority}', expected one of: "
+                             f"{', '.join(PRIORITY_INTERVAL_MULTIPLIERS)}")
+        with self._lock:
+            if url in self._states:
+                return
+            state = self._states[url] = PollState(url, priority, 0)
+            self._push(state, time.monotonic() + delay)
+
+    def remove(self, url: str):
+        """Stop scheduling a URL"""
+        with self._lock:
+            self._states.pop(url, None)
+
+    def set_interval(self, interval: float, now: float = None):
+        """Change the base interval, bringing forward checks that are now further away than a new interval"""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            self.min_interval *= interval / self.interval
+            self.max_interval *= interval / self.interval
+            self.interval = interval
+            for state in self._states.values():
+                if state.due > now + interval:
+                    self._push(state, now + interval)
+
+    def pop_due(self, now: float = None) -> List[str]:
+        """Take every URL that is due now (or within the coalescing window)"""
+        horizon = (now if now is not None else time.monotonic()) + COALESCE_WINDOW_IN_SECONDS
+        due_urls = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= horizon:
+                _, _, url, version = heapq.heappop(self._heap)
+                state = self._states.get(url)
+                if state and state.version == version:
+                    # Bump the version so the URL isn't handed out again until it is rescheduled
+                    state.version += 1
+                    due_urls.append(url)
+        return due_urls
+
+    def next_due_in(self, now: float = None) -> Optional[float]:
+        """Seconds until the next URL is due, or None if nothing is scheduled"""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            while self._heap:
+                due, _, url, version = self._heap[0]
+                state = self._states.get(url)
+                if state and state.version == version:
+                    return max(0.0, due - now)
+                heapq.heappop(self._heap)
+        return None
+
+    def record(self, url: str, status: Optional[bool], product_info: Optional[ProductInfo], now: float = None):
+        """Update a URL's history with the outcome of a check and schedule its next one"""
+        with self._lock:
+            state = self._states.get(url)
+            if state is None:
+                return
+
+            if status is None:
+                state.errors += 1
+            else:
+                state.errors = 0
+                price = product_info.price if product_info else None
+                changed = state.last_status is not None and (status != state.last_status or price != state.last_price)
+                state.volatility += VOLATILITY_WEIGHT * ((1.0 if changed else 0.0) - state.volatility)
+                state.unchanged_checks = 0 if changed else state.unchanged_checks + 1
+                state.last_status = status
+                state.last_price = price
+
+            self._push(state, (now if now is not None else time.monotonic()) + self.next_interval(state))
+
+    def next_interval(self, state: PollState) -> float:
+        """Seconds to wait before checking a URL again"""
+        if not self.adaptive:
+            return self.interval
+
+        if state.errors:
+            interval = self.interval * 2 ** min(state.errors, MAX_ERROR_BACKOFF_STEPS)
+        else:
+            # Products that keep changing are polled at the base interval, stable ones back off gradually
+            stability = (1 - state.volatility) * min(1.0, state.unchanged_checks / STABLE_CHECKS_FOR_MAX_INTERVAL)
+            interval = self.interval * (1 + (MAX_STABLE_INTERVAL_MULTIPLIER - 1) * stability)
+
+        interval *= PRIORITY_INTERVAL_MULTIPLIERS[state.priority]
+        interval *= random.uniform(1 - INTERVAL_JITTER, 1 + INTERVAL_JITTER)
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def export_states(self, now: float = None) -> List[tuple]:
+        """Every URL's scheduling state as plain tuples, with due times as epoch seconds so they survive a restart"""
+        offset = time.time() - (now if now is not None else time.monotonic())
+        with self._lock:
+            return [(state.url, state.priority, state.due + offset, state.volatility, state.unchanged_checks,
+                     state.errors, state.last_status, state.last_price) for state in self._states.values()]
+
+    def import_states(self, rows: Iterable[tuple], now: float = None):
+        """Schedule URLs from exported states in one pass, keeping their history and due times"""
+        offset = (now if now is not None else time.monotonic()) - time.time()
+        states = [PollState(url, priority, due + offset, volatility, unchanged_checks, errors, last_status, last_price)
+                  for url, priority, due, volatility, unchanged_checks, errors, last_status, last_price in rows]
+        with self._lock:
+            self._states.update((state.url, state) for state in states)
+            self._heap.extend((state.due, next(self._sequence), state.url, state.version) for state in states)
+            heapq.heapify(self._heap)
+
+    @property
+    def urls(self) -> List[str]:
+        """Every scheduled URL"""
+        with self._lock:
+            return list(self._states)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._states
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def _push(self, state: PollState, due: float):
+        state.version += 1
+        state.due = due
+        heapq.heappush(self._heap, (due, next(self._sequence), state.url, state.version))
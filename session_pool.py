@@ -0,0 +1,160 @@
+import itertools
+import json
+import threading
+import time
+from typing import List, Optional, Sequence
+
+import requests
+
+from constants import IDENTITY_REST_IN_SECONDS, IDENTITY_MAX_REST_IN_SECONDS
+from metrics import REGISTRY
+from rate_limiter import TokenBucket
+
+# Browser header profiles handed out to identities that don't bring their own headers
+HEADER_PROFILES = (
+    {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                   'Chrome/120.0.0.0 Safari/537.36',
+     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+     'Accept-Language': 'en-US,en;q=0.9'},
+    {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_2) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+                   'Version/17.2 Safari/605.1.15',
+     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+     'Accept-Language': 'en-US,en;q=0.9'},
+    {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0',
+     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+     'Accept-Language': 'en-US,en;q=0.5'},
+    {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                   'Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0',
+     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
+     'Accept-Language': 'en-US,en;q=0.9'},
+    {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) '
+                   'Chrome/120.0.0.0 Safari/537.36',
+     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+     'Accept-Language': 'en-GB,en;q=0.9'},
+)
+DEFAULT_HEADERS = HEADER_PROFILES[0]
+
+# Weight of the latest outcome in an identity's health score
+HEALTH_SMOOTHING = 0.2
+# Health never drops to zero, so a recovered identity can win traffic back
+MIN_HEALTH = 0.05
+
+
+def build_identities(count: int = 1, proxies: Sequence[str] = (), path: str = None) -> List[dict]:
+    """Identity specs from a JSON file, or `count` identities rotating through the header profiles and proxies.
+
+    A file holds a list of objects with optional "name", "headers" and "proxy" keys. Specs are plain dicts so they can
+    be handed to worker processes.
+    """
+    if path:
+        with open(path, encoding='utf-8') as f:
+            specs = json.load(f)
+        if not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+            raise ValueError(f"{path} must contain a list of identity objects")
+        return [{'name': spec.get('name') or f"identity-{idx}", 'headers': spec.get('headers') or
+                 HEADER_PROFILES[idx % len(HEADER_PROFILES)], 'proxy': spec.get('proxy')}
+                for idx, spec in enumerate(specs)]
+
+    count = max(count, len(proxies), 1)
+    proxy_cycle = itertools.cycle(proxies) if proxies else itertools.repeat(None)
+    return [{'name': f"identity-{idx}", 'headers': HEADER_PROFILES[idx % len(HEADER_PROFILES)],
+             'proxy': next(proxy_cycle)}
+            for idx in range(count)]
+
+
+class Identity:
+    """One client identity: a session with its own headers, proxy and cookie jar, request budget and health"""
+
+    def __init__(self, name: str, headers: dict, proxy: Optional[str] = None, rate: float = 0, burst: float = 1):
+        self.name = name
+        self.proxy = proxy
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        if proxy:
+            self.session.proxies = {'http': proxy, 'https': proxy}
+        self.bucket = TokenBucket(rate, burst)
+        self.health = 1.0  # Smoothed share of recent requests that succeeded
+        self.in_flight = 0
+        self.failures = 0  # Consecutive throttles or connection errors
+        self.resting_until = 0.0
+
+    def is_resting(self, now: float) -> bool:
+        return now < self.resting_until
+
+    def load(self) -> float:
+        """Requests in flight or queued on the rate budget, scaled up as health drops"""
+        queued = self.bucket.wait_time() * self.bucket.rate if self.bucket.rate > 0 else 0
+        return (self.in_flight + queued) / self.health
+
+    def __repr__(self):
+        return f"Identity({self.name!r}, health={self.health:.2f}, in_flight={self.in_flight})"
+
+
+class SessionPool:
+    """Routes every request to the least-loaded healthy identity so throughput scales with the number of identities.
+
+    Each identity spends its own token bucket, so `rate` applies per identity rather than per host. An identity that
+    is throttled or whose connection fails rests for a while (longer each time in a row, or as long as Retry-After
+    asks) and its health drops, which keeps traffic on the others. When every identity is resting, requests wait for
+    the first one to come back.
+    """
+
+    def __init__(self, identities: Sequence[dict], rate: float = 0, burst: float = 1,
+                 rest: float = IDENTITY_REST_IN_SECONDS, max_rest: float = IDENTITY_MAX_REST_IN_SECONDS):
+        if not identities:
+            raise ValueError("A session pool needs at least one identity")
+        self.identities = [Identity(spec['name'], spec['headers'], spec.get('proxy'), rate, burst)
+                           for spec in identities]
+        self.rest = rest
+        self.max_rest = max_rest
+        self._lock = threading.Lock()
+
+    @property
+    def sessions(self) -> List[requests.Session]:
+        return [identity.session for identity in self.identities]
+
+    def acquire(self) -> Identity:
+        """Pick the least-loaded healthy identity, blocking until it has budget for the request"""
+        with self._lock:
+            now = time.monotonic()
+            healthy = [identity for identity in self.identities if not identity.is_resting(now)]
+            if healthy:
+                identity = min(healthy, key=lambda candidate: candidate.load())
+                pause = 0.0
+            else:
+                identity = min(self.identities, key=lambda candidate: candidate.resting_until)
+                pause = identity.resting_until - now
+            identity.in_flight += 1
+            # Reserving under the lock makes the next pick see this request queued on the bucket
+            pause += identity.bucket.reserve()
+        if pause > 0:
+            time.sleep(pause)
+        return identity
+
+    def release(self, identity: Identity, throttled: bool = False, failed: bool = False,
+                retry_after: Optional[float] = None):
+        """Return an identity after a request and update its health from the outcome"""
+        ok = not (throttled or failed)
+        with self._lock:
+            identity.in_flight -= 1
+            identity.health = max(MIN_HEALTH, identity.health + HEALTH_SMOOTHING * (ok - identity.health))
+            if ok:
+                identity.failures = 0
+            else:
+                identity.failures += 1
+                rest = min(self.max_rest, self.rest * 2 ** (identity.failures - 1))
+                identity.resting_until = time.monotonic() + max(rest, retry_after or 0)
+        result = 'throttled' if throttled else 'error' if failed else 'ok'
+        REGISTRY.increment('mstock_identity_requests_total', identity=identity.name, result=result)
+        REGISTRY.set_gauge('mstock_identity_health', identity.health, identity=identity.name)
+
+    def all_resting(self) -> bool:
+        now = time.monotonic()
+        return all(identity.is_resting(now) for identity in self.identities)
+
+    def close(self):
+        for identity in self.identities:
+            identity.session.close()
+
+    def __len__(self) -> int:
+        return len(self.identities)
@@ -0,0 +1,386 @@
+import glob
+import multiprocessing
+import os
+import queue
+import time
+from typing import Dict, List, Optional, Set
+
+from checkpoint import Checkpointer
+from control import ADD_URLS, REMOVE_URLS, SET_INTERVAL, STOP
+from page_archive import PageArchive, worker_archive_path
+from parsers import get_parser
+from printer import CustomPrinter
+from product import ProductInfo
+from scheduler import PollScheduler
+from stock_checker import StockChecker
+from watchlist import Watchlist
+
+# How often the coordinator checks that its workers are still alive
+WORKER_HEALTH_CHECK_INTERVAL_IN_SECONDS = 1.0
+WORKER_STOP_TIMEOUT_IN_SECONDS = 10
+
+
+def _worker_main(worker_id, commands, results, interval, adaptive, parser_name, checker_options, continuous,
+                 page_archive_path):
+    """Check an assigned shard of URLs on their own schedule and stream every result back to the coordinator"""
+    # Pages are fetched here, so each worker records them itself, into its own file that the coordinator merges
+    page_archive = PageArchive(worker_archive_path(page_archive_path, worker_id)) if page_archive_path else None
+    checker = StockChecker(printer=CustomPrinter(quiet=True), parser=get_parser(parser_name) if parser_name else None,
+                           page_archive=page_archive, **checker_options)
+    scheduler = PollScheduler(interval, adaptive=adaptive)
+
+    try:
+        while True:
+            # Wait for commands until the next product is due, or indefinitely while the shard is empty
+            timeout = scheduler.next_due_in()
+            try:
+                command = commands.get(timeout=timeout) if timeout is None or timeout > 0 else commands.get_nowait()
+            except queue.Empty:
+                command = None
+            while command:
+                if command[0] == 'stop':
+                    return
+                if command[0] == 'assign':
+                    for url, product_info, priority in command[1]:
+                        if product_info:
+                            checker.cache_product_info(url, product_info)
+                        scheduler.add(url, priority)
+                elif command[0] == 'remove':
+                    for url in command[1]:
+                        scheduler.remove(url)
+                elif command[0] == 'interval':
+                    scheduler.set_interval(command[1])
+                try:
+                    command = commands.get_nowait()
+                except queue.Empty:
+                    command = None
+
+            due_urls = scheduler.pop_due()
+            if not due_urls:
+                continue
+
+            batch = checker.check_batch(due_urls)
+
+            finished_at = time.monotonic()
+            for url, status, product_info in batch:
+                if status is True and not continuous:
+                    scheduler.remove(url)
+                else:
+                    scheduler.record(url, status, product_info, now=finished_at)
+                results.put(('result', worker_id, url, status, product_info))
+            results.put(('batch', worker_id, len(batch)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        checker.close()
+        if page_archive is not None:
+            page_archive.close()
+
+
+class ShardedMonitor:
+    """Splits a watchlist across worker processes and owns notifications and the summary table"""
+
+    def __init__(self, urls: List[str], workers: int, checker: StockChecker, interval: float = 60,
+                 priorities: Dict[str, str] = None, adaptive: bool = False, parser_name: str = None,
+                 checker_options: dict = None, watchlist: Watchlist = None, page_archive_path: str = None):
+        self.urls = list(dict.fromkeys(urls))
+        self.worker_count = max(1, workers)
+        self.checker = checker  # Used for notifications, the persistent cache and printing, never for fetching
+        self.printer = checker.printer
+        self.dashboard = checker.dashboard
+        self.interval = interval
+        self.priorities = priorities or {}
+        self.adaptive = adaptive
+        self.parser_name = parser_name
+        self.checker_options = checker_options or {}
+        self.page_archive_path = page_archive_path
+        self.watchlist = watchlist  # Reloaded while monitoring when it is backed by a file
+        self._results = multiprocessing.Queue()
+        self._workers = {}  # worker id -> (process, command queue)
+        self._assignments: Dict[int, Set[str]] = {}
+        self._next_worker_id = 0
+        self._pending = set()
+        self._products = {}
+        self._notified = set()
+        self.continuous = checker.continuous
+        self.commands = checker.commands  # Control API commands, shared with the checker's stop request
+
+    @property
+    def stopping(self) -> bool:
+        return self.checker.stopping
+
+    def request_stop(self):
+        self.checker.request_stop()
+
+    def monitored_urls(self) -> List[str]:
+        return list(self._pending)
+
+    def product_info(self, url: str) -> Optional[ProductInfo]:
+        return self._products.get(url) or self.checker.product_info(url)
+
+    def run(self, daemon: bool = False):
+        """Monitor until every product is in stock, or until asked to stop when running as a daemon"""
+        self.printer.section("Sharded Stock Checker Started")
+        self.printer.info(f"Monitoring {len(self.urls)} products across {self.worker_count} worker processes")
+        self.printer.info(f"Check interval: {self.interval} seconds{' (adaptive)' if self.adaptive else ''}")
+        self.printer.blank()
+
+        checkpoint = self.checker.checkpointer.load() if self.checker.checkpointer else None
+        if checkpoint:
+            self._restore_checkpoint(checkpoint, daemon)
+        self._pending = set(self.urls) - self._notified
+        for _ in range(min(self.worker_count, len(self._pending))):
+            self._start_worker()
+        self._assign([url for url in self.urls if url in self._pending])
+
+        reported = set()
+        last_health_check = time.monotonic()
+        finished = False  # Every product was found in stock, so there is nothing to resume
+        try:
+            while not self.stopping and (self._pending or daemon):
+                self._apply_commands()
+                try:
+                    message = self._results.get(timeout=WORKER_HEALTH_CHECK_INTERVAL_IN_SECONDS)
+                except queue.Empty:
+                    message = None
+
+                if message and message[0] == 'result':
+                    self._handle_result(*message[1:])
+                elif message and message[0] == 'batch':
+                    reported.add(message[1])
+
+                if time.monotonic() - last_health_check >= WORKER_HEALTH_CHECK_INTERVAL_IN_SECONDS:
+                    self._replace_dead_workers()
+                    if self.watchlist and self.watchlist.changed():
+                        self._reload_watchlist()
+                    last_health_check = time.monotonic()
+
+                # Print a summary once every worker with products left has finished a batch since the last one.
+                # Workers whose shard emptied wait for commands and never report again, so they aren't waited on
+                busy = {worker_id for worker_id in self._workers if self._assignments[worker_id]}
+                if busy and busy <= reported:
+                    self._print_summary(self.checker.check_count)
+                    self.checker.check_price_drops()
+                    self.checker.check_count += 1
+                    reported.clear()
+                    if self.checker.checkpointer and self.checker.checkpointer.due():
+                        self._save_checkpoint()
+
+            if not self.stopping:
+                self.printer.section("Monitoring Complete")
+                self.printer.success("All items are now in stock!")
+                finished = True
+        finally:
+            self._stop_workers()
+            if self.page_archive_path:
+                self._merge_page_archives()
+            if self.checker.checkpointer and finished:
+                self.checker.checkpointer.clear()
+            elif self.checker.checkpointer:
+                self._save_checkpoint(wait=True)
+
+    def _save_checkpoint(self, wait: bool = False):
+        """Checkpoint the coordinator's state in the single-process layout"""
+        # Workers keep their schedules to themselves, so products are saved as due now
+        now = time.time()
+        schedule = [(url, self.priorities.get(url, 'normal'), now, 0.0, 0, 0, None, None) for url in self._pending]
+        alert_tracker = self.checker.alert_tracker
+        self.checker.checkpointer.save({'check_count': self.checker.check_count, 'schedule': schedule,
+                                        'completed': list(self._notified),
+                                        'alerts': alert_tracker.export_states() if alert_tracker else []},
+                                       self.checker.checkpoint_products(), wait=wait)
+        if self.checker.price_history is not None:
+            self.checker.price_history.flush()
+
+    def _restore_checkpoint(self, checkpoint: dict, daemon: bool):
+        """Skip products that were already notified and restore alert state, so restarts never alert twice"""
+        listed = set(self.urls)
+        # Products given again on the command line are monitored even if they finished before
+        relisted = set(self.watchlist.command_line_urls if self.watchlist is not None else self.urls)
+        if not self.continuous:
+            self._notified = {url for url in checkpoint['completed'] if url in listed and url not in relisted}
+        if daemon:
+            # Products added through the control API are kept
+            self.urls.extend(row[0] for row in checkpoint['schedule']
+                             if row[0] not in listed and row[0] not in self._notified)
+        self.checker.check_count = checkpoint['check_count']
+        if self.checker.alert_tracker:
+            self.checker.alert_tracker.import_states(checkpoint['alerts'])
+        for url, fields in Checkpointer.products(checkpoint):
+            if url not in self.checker.product_history:
+                self.checker.cache_product_info(url, ProductInfo.from_raw_fields(fields))
+        self.printer.info(f"Resumed from a checkpoint saved {time.time() - checkpoint['saved_at']:.0f} seconds ago: "
+                          f"{len(self._notified)} products already in stock")
+
+    def _merge_page_archives(self):
+        """Move the pages the workers recorded into the archive file. Files left by an earlier run that was killed
+        are merged too"""
+        root, extension = os.path.splitext(self.page_archive_path)
+        paths = sorted(glob.glob(f"{glob.escape(root)}.worker-*{extension}"))
+        if not paths:
+            return
+        archive = PageArchive(self.page_archive_path)
+        try:
+            for path in paths:
+                archive.merge(path)
+                for leftover in (path, f"{path}-wal", f"{path}-shm"):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+        except Exception as e:
+            self.printer.error(f"Error merging archived pages: {e}")
+        finally:
+            archive.close()
+
+    def _handle_result(self, worker_id, url, status, product_info):
+        if url not in self._pending:
+            return
+
+        if product_info:
+            self.checker.cache_product_info(url, product_info)
+        else:
+            product_info = self.checker.get_cached_product_info(url)
+        if product_info:
+            self._products[url] = product_info
+        self.checker.journal_result(url, status, product_info)
+        if self.dashboard:
+            self.dashboard.update(url, status, product_info)
+            self.dashboard.refresh()
+
+        if self.continuous:
+            # The alert tracker ignores a repeated result around a rebalance, since the state hasn't changed
+            for alert in self.checker.alerts_for(url, status, product_info):
+                self.checker.notify_alert(url, alert, product_info)
+        elif status is True:
+            self._pending.discard(url)
+            self._assignments.get(worker_id, set()).discard(url)
+            name = product_info.name if product_info and product_info.name else url
+            self.printer.success(f"IN STOCK: {name}")
+            # A URL can be reported twice around a rebalance, but only ever notifies once
+            if url not in self._notified:
+                self._notified.add(url)
+                self.checker.notify_in_stock(url, product_info)
+        if status is None:
+            self.printer.warning(f"Status unknown: {url}")
+
+    def _print_summary(self, check_count):
+        if self.dashboard:
+            self.dashboard.set_status(f"Check #{check_count}: {len(self._pending)} items still out of stock across "
+                                      f"{len(self._workers)} workers")
+            self.dashboard.refresh(force=True)
+            return
+        self.printer.section(f"Check #{check_count}", "-")
+        self.printer.info(f"{len(self._pending)} items still out of stock across {len(self._workers)} workers")
+        products = [(url, product_info) for url, product_info in self._products.items() if url in self._pending]
+        if products:
+            self.printer.info("Current Status Summary:")
+            self.checker.print_status_summary(products)
+        self.printer.blank()
+
+    def _start_worker(self) -> int:
+        worker_id = self._next_worker_id
+        self._next_worker_id += 1
+        commands = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_worker_main, name=f"mstock-worker-{worker_id}", daemon=True,
+                                          args=(worker_id, commands, self._results, self.interval, self.adaptive,
+                                                self.parser_name, self.checker_options, self.continuous,
+                                                self.page_archive_path))
+        process.start()
+        self._workers[worker_id] = (process, commands)
+        self._assignments[worker_id] = set()
+        return worker_id
+
+    def _assign(self, urls):
+        """Hand URLs to the least loaded workers, along with any cached product information"""
+        shards = {worker_id: [] for worker_id in self._workers}
+        for url in urls:
+            worker_id = min(shards, key=lambda candidate: len(self._assignments[candidate]))
+            self._assignments[worker_id].add(url)
+            shards[worker_id].append((url, self.checker.get_cached_product_info(url),
+                                      self.priorities.get(url, 'normal')))
+        for worker_id, shard in shards.items():
+            if shard:
+                self._workers[worker_id][1].put(('assign', shard))
+
+    def _replace_dead_workers(self):
+        """Rebalance the shards of workers that exited onto the survivors"""
+        orphaned = []
+        for worker_id, (process, _) in list(self._workers.items()):
+            if process.is_alive():
+                continue
+            self.printer.warning(f"Worker {worker_id} exited with code {process.exitcode}, rebalancing its products")
+            del self._workers[worker_id]
+            orphaned.extend(self._assignments.pop(worker_id) & self._pending)
+
+        if orphaned:
+            if not self._workers:
+                self._start_worker()
+            self._assign(orphaned)
+
+    def _reload_watchlist(self):
+        """Assign products added to the watchlist file and take removed ones away from their workers"""
+        try:
+            added, removed = self.watchlist.reload()
+        except OSError as e:
+            self.printer.error(f"Error reloading watchlist: {e}")
+            return
+
+        added = self._add_urls(added)
+        self._remove_urls(removed)
+        if added or removed:
+            self.printer.info(f"Watchlist reloaded: {len(added)} added, {len(removed)} removed")
+
+    def _apply_commands(self):
+        """Apply queued control API commands"""
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            if command[0] == STOP:
+                self.checker.stopping = True
+            elif command[0] == ADD_URLS:
+                priority = command[2]
+                for url in command[1]:
+                    self.priorities.setdefault(url, priority)
+                self._notified.difference_update(command[1])
+                self.printer.info(f"Added {len(self._add_urls(command[1]))} products")
+            elif command[0] == REMOVE_URLS:
+                self.printer.info(f"Removed {len(self._remove_urls(command[1]))} products")
+            elif command[0] == SET_INTERVAL:
+                self.interval = command[1]
+                for _, commands in self._workers.values():
+                    commands.put(('interval', self.interval))
+                self.printer.info(f"Check interval: {self.interval} seconds")
+
+    def _add_urls(self, urls) -> List[str]:
+        """Start monitoring new URLs, starting workers as needed. Returns the URLs that weren't monitored yet"""
+        added = [url for url in urls if url not in self._pending]
+        self._pending.update(added)
+        if added:
+            while len(self._workers) < min(self.worker_count, len(self._pending)):
+                self._start_worker()
+            self._assign(added)
+        return added
+
+    def _remove_urls(self, urls) -> List[str]:
+        """Take URLs away from their workers. Returns the URLs that were monitored"""
+        removed = [url for url in urls if url in self._pending]
+        for worker_id, assigned in self._assignments.items():
+            dropped = [url for url in removed if url in assigned]
+            if dropped:
+                assigned.difference_update(dropped)
+                self._workers[worker_id][1].put(('remove', dropped))
+        for url in urls:
+            self._pending.discard(url)
+            self._products.pop(url, None)
+            self.checker.forget(url)
+        return removed
+
+    def _stop_workers(self):
+        for process, commands in self._workers.values():
+            commands.put(('stop',))
+        for process, _ in self._workers.values():
+            process.join(WORKER_STOP_TIMEOUT_IN_SECONDS)
+            if process.is_alive():
+                process.terminate()
+        self._workers.clear()
@@ -0,0 +1,50 @@
+import sqlite3
+import time
+from typing import Iterable
+
+# Pending writes are committed in batches so a large sweep doesn't pay one disk sync per write
+COMMIT_EVERY_WRITES = 200
+COMMIT_EVERY_SECONDS = 1.0
+
+
+class BatchedConnection:
+    """A SQLite file in WAL mode whose writes are committed every COMMIT_EVERY_WRITES writes or COMMIT_EVERY_SECONDS.
+
+    Shared by the product cache, status journal and page archive. Not locked itself: every caller already serializes
+    its access to the connection with a lock of its own.
+    """
+
+    def __init__(self, path: str, schema: Iterable[str] = ()):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        for statement in schema:
+            self._db.execute(statement)
+        self._db.commit()
+        self.pending_writes = 0
+        self._last_commit = time.monotonic()
+
+    def execute(self, sql: str, parameters: tuple = ()) -> sqlite3.Cursor:
+        """Run a statement without counting it as a write, e.g. a query"""
+        return self._db.execute(sql, parameters)
+
+    def write(self, sql: str, parameters: tuple = ()) -> sqlite3.Cursor:
+        """Run a statement that changes the file, committing once the batch is full or old enough"""
+        cursor = self._db.execute(sql, parameters)
+        self.pending_writes += 1
+        if (self.pending_writes >= COMMIT_EVERY_WRITES
+                or time.monotonic() - self._last_commit >= COMMIT_EVERY_SECONDS):
+            self.commit()
+        return cursor
+
+    def commit(self):
+        """Commit pending writes to disk"""
+        if self.pending_writes:
+            self._db.commit()
+        self.pending_writes = 0
+        self._last_commit = time.monotonic()
+
+    def close(self):
+        self.commit()
+        self._db.close()
@@ -1,54 +1,199 @@
+import asyncio
+import hashlib
+import queue
+import threading
 import time
-from dataclasses import dataclass
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional, Tuple, List
+from typing import Dict, Iterable, Optional, Tuple, List
 
 import requests
-from bs4 import BeautifulSoup
 
-from notifications import NotificationService
+from alerts import AVERAGE_DROP, AlertTracker, PRICE_DROP, RESTOCK, SOLD_OUT
+from checkpoint import Checkpointer, gc_paused
+from constants import (DEFAULT_CONCURRENCY, DEFAULT_HOST_RATE_PER_SECOND, SERIAL_ITEM_DELAY_IN_SECONDS,
+                       SECONDS_PER_DAY, WATCHLIST_RELOAD_CHECK_IN_SECONDS)
+from control import ADD_URLS, REMOVE_URLS, SET_INTERVAL, STOP
+from dashboard import Dashboard, SUMMARY_HEADERS, summary_row
+from journal import StatusJournal
+from metrics import REGISTRY
+from notifications import NotificationService, NotificationDispatcher
+from page_archive import PageArchive
+from parsers import PageParser, find_json_ld_product
+from price_history import PriceHistory
 from printer import CustomPrinter
-
-
-@dataclass
-class ProductInfo:
-    """Class to store product information"""
-    id: str
-    name: str
-    brand: str
-    price: Optional[str] = None
-    status: str = "Unknown"
-    description: Optional[str] = None
-    reviews_count: Optional[str] = None
-    rating: Optional[str] = None
-    last_checked: Optional[datetime] = None
+from product import CONTENT_DIGEST_SIZE, ProductInfo, StockStatus, format_cents
+from product_api import ProductApiClient
+from product_cache import ProductCache
+from rate_limiter import HostRateLimiter
+from retailers import RetailerAdapter, adapter_for
+from scheduler import PollScheduler
+from session_pool import DEFAULT_HEADERS, SessionPool
+from transport import ResilientTransport
+from variants import Variant, VariantWatcher, variants_from_json_ld
+from watchlist import Watchlist
+
+# Product statuses that can be reused when a page has not changed, and the check result they stand for
+STOCK_STATUSES = {StockStatus.IN_STOCK: True, StockStatus.OUT_OF_STOCK: False}
+CHECK_STATUS_LABELS = {True: 'in_stock', False: 'out_of_stock'}
 
 
 class StockChecker:
-    def __init__(self, printer: CustomPrinter = None, notification_service: NotificationService = None):
+    def __init__(self, printer: CustomPrinter = None, notification_service: NotificationService = None,
+                 concurrency: int = DEFAULT_CONCURRENCY, host_rate: float = None, rate_share: float = 1.0,
+                 parser: PageParser = None, product_cache: ProductCache = None,
+                 transport_options: dict = None, notification_dispatcher: NotificationDispatcher = None,
+                 dashboard: Dashboard = None, journal: StatusJournal = None, alert_tracker: AlertTracker = None,
+                 product_api_url: str = None, variant_subscriptions: List[Tuple[str, str]] = None,
+                 identities: List[dict] = None, checkpointer: Checkpointer = None,
+                 price_history: PriceHistory = None, page_archive: PageArchive = None,
+                 transport: ResilientTransport = None):
         self.printer = printer
+        self.dashboard = dashboard  # Live status table that replaces per-item output when set
+        self.journal = journal  # Records every status and price change
+        self.price_history = price_history  # Time series of every product's prices, for trends and drop alerts
+        self.page_archive = page_archive  # Keeps every fetched page, to replay them offline
+        # In continuous mode products stay monitored after restocking and the tracker decides what to notify
+        self.alert_tracker = alert_tracker
         self.notification_service = notification_service
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9', }
+        self.notification_dispatcher = notification_dispatcher
+        # Each retailer's pages are read by its own parser, unless one parser is given for all of them
+        self.parser = parser
+        self._parsers: Dict[str, PageParser] = {}
+        self.concurrency = max(1, concurrency)
+        # Requests per second to each host, None for each retailer's own budget. Checkers that split one budget
+        # between processes each spend their `rate_share` of it
+        self.host_rate = host_rate
+        self.rate_share = rate_share
+        # With several identities each one spends its own rate budget instead of sharing the host's
+        self.identities = identities
+        identity_rate = (host_rate if host_rate is not None else DEFAULT_HOST_RATE_PER_SECOND) * rate_share
+        self.session_pool = SessionPool(identities, rate=identity_rate) if identities else None
+        self.rate_limiter = HostRateLimiter(0 if self.session_pool else self.host_rate_for)
+        self._fetch_executor = None
+        self._notify_executor = None
+        self.headers = dict(DEFAULT_HEADERS)
         self.session = requests.Session()
         self.session.headers.update(self.headers)
-        self.product_history = {}  # Cache for product information
+        # Every concurrent check gets its own keep-alive connection from the pool
+        self.transport_options = transport_options or {}
+        # A transport can be handed in instead, e.g. one replaying archived pages, which isn't rate limited
+        self.transport = transport or ResilientTransport(self.session, printer=printer,
+                                                         pool_size=max(self.concurrency, 10),
+                                                         session_pool=self.session_pool,
+                                                         rate_limiter=self.rate_limiter, **self.transport_options)
+        self.product_history = product_cache or ProductCache()  # Cache for product information
+        # Batched structured lookups tried before product pages, whose answers wait here until their URL is checked
+        self.product_api = ProductApiClient(self.transport, product_api_url) if product_api_url else None
+        self._api_results = {}
+        # Sizes and colors to watch, per URL; subscribed URLs report the status of their variants
+        self.variant_watcher = VariantWatcher(variant_subscriptions or ())
+        self.scheduler = None
+        # Control API commands, applied by the monitoring loop between batches. A SimpleQueue can be fed from a
+        # signal handler
+        self.commands = queue.SimpleQueue()
+        self.stopping = False
+        # Snapshots of the schedule, alert state and finished products, resumed from on the next start
+        self.checkpointer = checkpointer
+        self.check_count = 1
+        self.completed_urls = set()  # In stock and notified, so no longer monitored
+        self.finished = False  # Every product was found in stock, so there is nothing to resume
 
     def get_cached_product_info(self, url: str) -> Optional[ProductInfo]:
         """Get cached product information if available"""
-        return self.product_history.get(url)
+        product_info = self.product_history.get(url)
+        REGISTRY.increment('mstock_product_cache_total', result='hit' if product_info else 'miss')
+        return product_info
 
     def cache_product_info(self, url: str, product_info: ProductInfo):
         """Cache product information for future use"""
-        self.product_history[url] = product_info
+        self.product_history.put(url, product_info)
+
+    def journal_result(self, url: str, status: Optional[bool], product_info: Optional[ProductInfo]):
+        """Record a check result in the status journal and price history, if there are any"""
+        if status is None:
+            return
+        if self.journal:
+            self.journal.record(url, StockStatus.IN_STOCK if status else StockStatus.OUT_OF_STOCK,
+                                product_info.price_cents if product_info else None)
+        if self.price_history is not None:
+            self.price_history.record(url, product_info)
+
+    def check_price_drops(self):
+        """Notify about products whose price fell far enough below its average, checked across the whole history"""
+        tracker = self.alert_tracker
+        if not (self.price_history is not None and tracker and tracker.drop_percent is not None
+                and AVERAGE_DROP in tracker.events):
+            return
+        for url in self.price_history.new_drops(tracker.drop_percent, tracker.drop_window):
+            self._notify_in_background(url, AVERAGE_DROP, self.get_cached_product_info(url))
+
+    def forget(self, url: str):
+        """Drop the alert state of a product that is no longer monitored"""
+        if self.alert_tracker:
+            self.alert_tracker.forget(url)
+        if self.price_history is not None:
+            self.price_history.forget(url)
+
+    @property
+    def continuous(self) -> bool:
+        return self.alert_tracker is not None
+
+    def alerts_for(self, url: str, status: Optional[bool], product_info: Optional[ProductInfo]) -> List[str]:
+        """Alerts triggered by a check result: only restocks, unless an alert tracker is set"""
+        if self.alert_tracker is None:
+            return [RESTOCK] if status is True else []
+        if status is None:
+            return []
+        return self.alert_tracker.observe(url, StockStatus.IN_STOCK if status else StockStatus.OUT_OF_STOCK,
+                                          product_info.price_cents if product_info else None, time.time())
 
     def notify_in_stock(self, url, current_product_info=None):
         """Send notifications when item comes in stock"""
-        if not self.notification_service:
-            return
+        self.notify_alert(url, RESTOCK, current_product_info)
+
+    def notify_alert(self, url, alert: str, current_product_info=None):
+        """Send notifications for a restock, sell-out or price drop"""
+        with REGISTRY.timer('mstock_phase_seconds', phase='notify'):
+            if self.notification_dispatcher:
+                self.notification_dispatcher.submit(*self.build_alert_message(url, alert, current_product_info), alert)
+            elif self.notification_service:
+                self.notification_service.send(*self.build_alert_message(url, alert, current_product_info))
+
+    def build_alert_message(self, url, alert: str, current_product_info=None) -> Tuple[str, str]:
+        """Build the subject and body of a notification"""
+        if alert == RESTOCK:
+            return self.build_in_stock_message(url, current_product_info)
+
+        product_info = current_product_info or self.get_cached_product_info(url)
+        name = product_info.name if product_info and product_info.name else "Item"
+        if alert == SOLD_OUT:
+            subject = f"🛍️ Sold Out: {name}"
+            message_parts = ["Item is out of stock again.\n", f"Product: {name}"]
+        elif alert == AVERAGE_DROP:
+            subject = f"💲 Price Drop: {name}"
+            message_parts = [f"📉 Price dropped below its {self.alert_tracker.drop_window / SECONDS_PER_DAY:g}-day "
+                             f"average! 📉\n", f"Product: {name}"]
+        else:
+            subject = f"💲 Price Drop: {name}"
+            message_parts = ["📉 Price dropped below your threshold! 📉\n", f"Product: {name}"]
+        if product_info and product_info.price:
+            message_parts.append(f"Price: {product_info.price}")
+        if alert == PRICE_DROP and self.alert_tracker and self.alert_tracker.price_below_cents is not None:
+            message_parts.append(f"Threshold: {format_cents(self.alert_tracker.price_below_cents)}")
+        summary = self.price_history.summary(url, self.alert_tracker.drop_window) \
+            if alert == AVERAGE_DROP and self.price_history is not None else None
+        if summary and summary[2] is not None:
+            price, low, average = summary
+            message_parts.append(f"Average: {format_cents(round(average))} ({1 - price / average:.0%} below)")
+            message_parts.append(f"All-time low: {format_cents(low)}")
 
+        message_parts.append(f"\nShop now: {url}")
+        return subject, "\n".join(message_parts)
+
+    def build_in_stock_message(self, url, current_product_info=None) -> Tuple[str, str]:
+        """Build the subject and body of an in stock notification"""
         # Try to get product info from cache if current info is not available
         product_info = current_product_info or self.get_cached_product_info(url)
 
@@ -63,6 +208,9 @@ class StockChecker:
                 message_parts.append(f"Rating: {product_info.rating}")
             if product_info.reviews_count:
                 message_parts.append(f"Reviews: {product_info.reviews_count}")
+            available_variants = self.variant_watcher.available_specs(url, product_info.variants)
+            if available_variants:
+                message_parts.append(f"Variants in stock: {', '.join(available_variants)}")
 
             if current_product_info is None:
                 message_parts.append("\n⚠️ Note: Using cached product information")
@@ -71,91 +219,384 @@ class StockChecker:
             message_parts = ["🎉 Item is now in stock! 🎉\n", "⚠️ Unable to retrieve product information"]
 
         message_parts.append(f"\nShop now: {url}")
-        message = "\n".join(message_parts)
-
-        self.notification_service.send_email(subject, message)
-        self.notification_service.send_sms(message)
+        return subject, "\n".join(message_parts)
 
     def print_status_summary(self, products: List[Tuple[str, ProductInfo]]):
         """Print a summary table of current product status"""
-        headers = ["ID", "Brand", "Product", "Status", "Price", "Last Checked"]
-        rows = []
-
-        for url, info in products:
-            last_checked = info.last_checked.strftime("%H:%M:%S") if info.last_checked else "Never"
-            rows.append([info.id[:8] + "..." if len(info.id) > 8 else info.id,
-                info.brand[:15] + "..." if len(info.brand) > 15 else info.brand,
-                info.name[:20] + "..." if len(info.name) > 20 else info.name, info.status, info.price or "N/A",
-                last_checked])
+        self.printer.table(SUMMARY_HEADERS, [summary_row(url, info) for url, info in products])
 
-        self.printer.table(headers, rows)
+    def check_stock(self, urls, interval=60, priorities: Dict[str, str] = None, adaptive: bool = False,
+                    max_checks: int = None, watchlist: Watchlist = None, daemon: bool = False):
+        """Continuously check stock for multiple URLs, optionally stopping after `max_checks` batches.
 
-    def check_stock(self, urls, interval=60):
-        """Continuously check stock for multiple URLs"""
+        When a reloadable watchlist is given, edits to its file are applied while monitoring. A daemon keeps running
+        with nothing to monitor, waiting for products to be added through its commands, until it is asked to stop.
+        """
         self.printer.section("Stock Checker Started")
         self.printer.info(f"Monitoring {len(urls)} products")
-        self.printer.info(f"Check interval: {interval} seconds")
-        print()
-
-        out_of_stock_urls = set(urls)
-        check_count = 1
-
-        while out_of_stock_urls:
-            self.printer.section(f"Check #{check_count}", "-")
-            self.printer.info(f"Checking {len(out_of_stock_urls)} items...")
-            print()
-
-            current_products = []
-            newly_in_stock = set()
-
-            for idx, url in enumerate(out_of_stock_urls, 1):
-                self.printer.info(f"Checking item {idx}/{len(out_of_stock_urls)}...")
-                status, product_info = self.check_macys_stock(url)
+        self.printer.info(f"Check interval: {interval} seconds{' (adaptive)' if adaptive else ''}")
+        self.printer.info(f"Concurrency: {self.concurrency}")
+        if self.session_pool:
+            self.printer.info(f"Identities: {len(self.session_pool)}")
+        if self.continuous:
+            self.printer.info(f"Continuous mode: notifying on {', '.join(sorted(self.alert_tracker.events))}")
+        self.printer.blank()
+
+        priorities = priorities or {}
+        self.scheduler = PollScheduler(interval, adaptive=adaptive)
+        checkpoint = self.checkpointer.load() if self.checkpointer else None
+        if checkpoint:
+            self.restore_checkpoint(checkpoint, urls, priorities, keep_unlisted=daemon,
+                                    relisted=watchlist.command_line_urls if watchlist is not None else urls)
+        else:
+            for url in urls:
+                self.scheduler.add(url, priorities.get(url, 'normal'))
+        first_check = self.check_count
 
-                # Get cached info if current info is not available
-                if not product_info:
-                    product_info = self.get_cached_product_info(url)
-                    if product_info:
-                        self.printer.info("Using cached product information")
+        try:
+            while (not self.stopping and (self.scheduler or daemon)
+                   and (max_checks is None or self.check_count - first_check < max_checks)):
+                if self.dashboard:
+                    self.dashboard.refresh(force=True)
+                if self.checkpointer and self.checkpointer.due():
+                    self.save_checkpoint()
+                with REGISTRY.timer('mstock_phase_seconds', phase='sleep'):
+                    self.wait_for_due(watchlist, priorities)
+                if self.stopping:
+                    break
+                due_urls = self.scheduler.pop_due()
+                if not due_urls:
+                    continue
+
+                if self.dashboard:
+                    self.dashboard.set_status(f"Check #{self.check_count}: checking {len(due_urls)} items...")
                 else:
-                    # Cache new product info
-                    self.cache_product_info(url, product_info)
-
-                if product_info:
-                    product_info.last_checked = datetime.now()
-                    current_products.append((url, product_info))
-
-                self.printer.indent()
-                if status is True:
-                    self.printer.success(f"Item {idx}/{len(out_of_stock_urls)} - IN STOCK")
-                    self.notify_in_stock(url, product_info)
-                    newly_in_stock.add(url)
-                elif status is False:
-                    self.printer.error(f"Item {idx}/{len(out_of_stock_urls)} - Out of stock")
+                    self.printer.section(f"Check #{self.check_count}", "-")
+                    self.printer.info(f"Checking {len(due_urls)} items...")
+                    self.printer.blank()
+
+                with REGISTRY.timer('mstock_phase_seconds', phase='batch'):
+                    results = self.check_batch(due_urls)
+
+                # Reschedule from the end of the batch, like the pause after a full sweep
+                finished_at = time.monotonic()
+                for url, status, product_info in results:
+                    if status is True and not self.continuous:
+                        self.scheduler.remove(url)
+                        self.completed_urls.add(url)
+                    else:
+                        self.scheduler.record(url, status, product_info, now=finished_at)
+                self.check_price_drops()
+
+                if self.dashboard:
+                    self.dashboard.set_status(self.progress_text(self.check_count, results))
+                    self.check_count += 1
+                    continue
+
+                current_products = [(url, product_info) for url, _, product_info in results if product_info]
+                self.printer.blank()
+                if current_products:
+                    self.printer.info("Current Status Summary:")
+                    self.print_status_summary(current_products)
+                    self.printer.blank()
+
+                if self.scheduler:
+                    self.printer.info(f"Next check in {self.scheduler.next_due_in():.0f} seconds...")
+                elif daemon:
+                    self.printer.info("Nothing left to monitor, waiting for products to be added...")
                 else:
-                    self.printer.warning(f"Item {idx}/{len(out_of_stock_urls)} - Status unknown")
-                self.printer.dedent()
+                    self.printer.section("Monitoring Complete")
+                    self.printer.success("All items are now in stock!")
+                    self.finished = True
+
+                self.check_count += 1
+        finally:
+            self.close()
+
+    def wait_for_due(self, watchlist: Watchlist = None, priorities: Dict[str, str] = None):
+        """Sleep until a product is due or a command arrives, applying commands and watchlist edits"""
+        timeout = self.scheduler.next_due_in()
+        if watchlist and watchlist.reloadable:
+            # Wake up regularly to notice watchlist edits
+            timeout = min(timeout, WATCHLIST_RELOAD_CHECK_IN_SECONDS) if timeout is not None \
+                else WATCHLIST_RELOAD_CHECK_IN_SECONDS
+        try:
+            command = self.commands.get(timeout=timeout)
+        except queue.Empty:
+            command = None
+        while command:
+            self.handle_command(command)
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                command = None
+        if watchlist and watchlist.reloadable:
+            self.reload_watchlist(watchlist, priorities)
+
+    def handle_command(self, command: tuple):
+        """Apply a control API command to the schedule"""
+        if command[0] == STOP:
+            self.stopping = True
+        elif command[0] == ADD_URLS:
+            added = [url for url in command[1] if url not in self.scheduler]
+            for url in added:
+                self.scheduler.add(url, command[2])
+                self.completed_urls.discard(url)
+            self.printer.info(f"Added {len(added)} products")
+        elif command[0] == REMOVE_URLS:
+            removed = [url for url in command[1] if url in self.scheduler]
+            for url in removed:
+                self.scheduler.remove(url)
+                self.forget(url)
+            self.completed_urls.difference_update(command[1])
+            self.printer.info(f"Removed {len(removed)} products")
+        elif command[0] == SET_INTERVAL:
+            self.scheduler.set_interval(command[1])
+            self.printer.info(f"Check interval: {command[1]} seconds")
+
+    def checkpoint_products(self):
+        """Collector of product information for checkpoints, or None when the product cache persists it already"""
+        return None if self.product_history.persistent else self.product_history.raw_items
+
+    def save_checkpoint(self, wait: bool = False):
+        """Snapshot the schedule, alert state and finished products, writing them in the background"""
+        self.checkpointer.save({'check_count': self.check_count, 'schedule': self.scheduler.export_states(),
+                                'completed': list(self.completed_urls),
+                                'alerts': self.alert_tracker.export_states() if self.alert_tracker else []},
+                               self.checkpoint_products(), wait=wait)
+        if self.price_history is not None:
+            self.price_history.flush()
+
+    def restore_checkpoint(self, checkpoint: dict, urls: List[str], priorities: Dict[str, str] = None,
+                           keep_unlisted: bool = False, relisted: Iterable[str] = ()):
+        """Resume from a checkpoint: listed products keep their schedule and history, finished ones stay finished.
+
+        Products in the checkpoint that are no longer listed are dropped, unless `keep_unlisted` (a daemon keeps the
+        products that were added through its control API). `relisted` products, given again on the command line, are
+        monitored even if they finished before.
+        """
+        priorities = priorities or {}
+        listed = set(urls)
+        relisted = set(relisted)
+        completed = set() if self.continuous else {url for url in checkpoint['completed']
+                                                   if url in listed and url not in relisted}
+        saved = [row for row in checkpoint['schedule']
+                 if (keep_unlisted or row[0] in listed) and row[0] not in completed]
+        # Priorities given on the command line win over the saved ones
+        with gc_paused():
+            self.scheduler.import_states(row if row[0] not in priorities else (row[0], priorities[row[0]]) + row[2:]
+                                         for row in saved)
+        scheduled = {row[0] for row in saved}
+        for url in urls:
+            if url not in scheduled and url not in completed:
+                self.scheduler.add(url, priorities.get(url, 'normal'))
+        self.completed_urls = completed
+        self.check_count = checkpoint['check_count']
+        if self.alert_tracker:
+            self.alert_tracker.import_states(checkpoint['alerts'])
+        if checkpoint.get('products'):
+            # Checking starts straight away, products the first checks need are simply fetched again
+            threading.Thread(target=self._restore_products, args=(checkpoint,), daemon=True,
+                             name="mstock-restore").start()
+
+        self.printer.info(f"Resumed from a checkpoint saved {time.time() - checkpoint['saved_at']:.0f} seconds ago: "
+                          f"{len(saved)} products keep their schedule, {len(completed)} already in stock")
+
+    def _restore_products(self, checkpoint: dict):
+        for url, fields in Checkpointer.products(checkpoint):
+            if url not in self.product_history:
+                self.product_history.put(url, ProductInfo.from_raw_fields(fields))
+
+    def request_stop(self):
+        """Stop monitoring once the checks in flight finish. Safe to call from a signal handler"""
+        self.stopping = True
+        self.commands.put((STOP,))
+
+    @property
+    def interval(self) -> Optional[float]:
+        return self.scheduler.interval if self.scheduler is not None else None
+
+    def monitored_urls(self) -> List[str]:
+        return self.scheduler.urls if self.scheduler is not None else []
+
+    def product_info(self, url: str) -> Optional[ProductInfo]:
+        """Last known product information of a URL, without counting as a cache lookup"""
+        return self.product_history.get(url)
 
-                if product_info:
-                    self.print_product_info(product_info)
-                time.sleep(2)
+    def reload_watchlist(self, watchlist: Watchlist, priorities: Dict[str, str] = None):
+        """Schedule products added to the watchlist file and drop removed ones, leaving the rest untouched"""
+        if not watchlist.changed():
+            return
+        try:
+            added, removed = watchlist.reload()
+        except OSError as e:
+            self.printer.error(f"Error reloading watchlist: {e}")
+            return
+        priorities = priorities or {}
+        for url in added:
+            self.scheduler.add(url, priorities.get(url, 'normal'))
+        for url in removed:
+            self.scheduler.remove(url)
+            self.forget(url)
+        if added or removed:
+            self.printer.info(f"Watchlist reloaded: {len(added)} added, {len(removed)} removed")
+
+    def progress_text(self, check_count, results) -> str:
+        """One-line summary of a finished batch for the dashboard status line"""
+        counts = {status: 0 for status in (True, False, None)}
+        for _, status, _ in results:
+            counts[status] += 1
+        if not self.scheduler:
+            return f"Check #{check_count}: all items are now in stock!"
+        return (f"Check #{check_count}: {counts[True]} in stock, {counts[False]} out of stock, {counts[None]} unknown"
+                f" - {len(self.scheduler)} monitored, next check in {self.scheduler.next_due_in():.0f} seconds")
+
+    def close(self):
+        """Shut down worker threads, waiting for queued notifications to go out, and flush the cache"""
+        if self._fetch_executor:
+            self._fetch_executor.shutdown(wait=True)
+            self._fetch_executor = None
+        if self._notify_executor:
+            self._notify_executor.shutdown(wait=True)
+            self._notify_executor = None
+        if self.checkpointer and self.finished:
+            self.checkpointer.clear()
+        elif self.checkpointer and self.scheduler is not None:
+            self.save_checkpoint(wait=True)
+        self.product_history.flush()
+        if self.journal:
+            self.journal.flush()
+        if self.price_history is not None:
+            self.price_history.flush()
+        if self.page_archive is not None:
+            self.page_archive.flush()
+
+    def check_batch(self, urls: List[str]) -> List[Tuple[str, Optional[bool], Optional[ProductInfo]]]:
+        """Check every URL once, serially or concurrently depending on the concurrency, returning
+        (url, status, product info) of each. Results are cached, journaled and notified like any other check"""
+        if self.concurrency == 1:
+            return self._check_serial(urls)
+        return asyncio.run(self._check_concurrent(urls))
+
+    def _check_serial(self, urls) -> List[Tuple[str, Optional[bool], Optional[ProductInfo]]]:
+        """Check URLs one at a time with a fixed pause between items (the original engine)"""
+        results = []
+        if self.product_api:
+            for batch in self.product_api.batches([url for url in urls if url not in self.variant_watcher]):
+                self._api_results.update(self.product_api.fetch(batch))
+
+        for idx, url in enumerate(urls, 1):
+            if self.stopping:
+                break
+            self.printer.debug(f"Checking item {idx}/{len(urls)}...")
+            status, product_info = self.check_product_stock(url)
+            product_info = self._handle_result(idx, len(urls), url, status, product_info)
+            for alert in self.alerts_for(url, status, product_info):
+                self.notify_alert(url, alert, product_info)
+            results.append((url, status, product_info))
+            time.sleep(SERIAL_ITEM_DELAY_IN_SECONDS)
+
+        return results
+
+    async def _check_concurrent(self, urls) -> List[Tuple[str, Optional[bool], Optional[ProductInfo]]]:
+        """Check URLs in parallel, bounded by the concurrency limit and by the per-host rate budget the transport
+        spends on every attempt"""
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # Retailers with a concurrency of their own also get a semaphore each, taken before the shared one so a
+        # retailer at its limit never holds slots the others could use
+        retailer_semaphores = {}
+        for url in urls:
+            adapter = adapter_for(url)
+            if adapter is not None and adapter.concurrency and adapter.name not in retailer_semaphores:
+                retailer_semaphores[adapter.name] = asyncio.Semaphore(adapter.concurrency)
+        if self._fetch_executor is None:
+            self._fetch_executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="mstock-fetch")
+
+        async def check(url):
+            adapter = adapter_for(url)
+            retailer_semaphore = retailer_semaphores.get(adapter.name) if adapter else None
+            if retailer_semaphore is None:
+                return await check_within_limit(url)
+            async with retailer_semaphore:
+                return await check_within_limit(url)
+
+        async def check_within_limit(url):
+            async with semaphore:
+                if self.stopping:
+                    return url, None  # Not started before shutdown was requested
+                return url, await loop.run_in_executor(self._fetch_executor, self.check_product_stock, url)
+
+        async def prefetch(batch):
+            async with semaphore:
+                self._api_results.update(await loop.run_in_executor(self._fetch_executor, self.product_api.fetch,
+                                                                    batch))
+
+        if self.product_api:
+            # The product API has no per-variant availability, so pages answer variant subscriptions
+            batches = self.product_api.batches([url for url in urls if url not in self.variant_watcher])
+            await asyncio.gather(*(prefetch(batch) for batch in batches))
+
+        results = []
+
+        # Results are handled on the event loop thread, so printing and caching never interleave
+        for idx, future in enumerate(asyncio.as_completed([check(url) for url in urls]), 1):
+            url, outcome = await future
+            if outcome is None:
+                continue
+            status, product_info = outcome
+            product_info = self._handle_result(idx, len(urls), url, status, product_info)
+            for alert in self.alerts_for(url, status, product_info):
+                self._notify_in_background(url, alert, product_info)
+            results.append((url, status, product_info))
+
+        return results
+
+    def _notify_in_background(self, url, alert, product_info):
+        """Hand a notification to a worker thread so slow SMTP never stalls checking"""
+        if self.notification_dispatcher:
+            # The dispatcher already delivers from its own thread
+            self.notify_alert(url, alert, product_info)
+            return
+        if not self.notification_service:
+            return
+        if self._notify_executor is None:
+            self._notify_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mstock-notify")
+        self._notify_executor.submit(self.notify_alert, url, alert, product_info)
+
+    def _handle_result(self, idx, total, url, status, product_info) -> Optional[ProductInfo]:
+        """Cache, record and print the outcome of one check, returning the product info to report"""
+        # Get cached info if current info is not available
+        if not product_info:
+            product_info = self.get_cached_product_info(url)
+            if product_info:
+                self.printer.debug("Using cached product information")
+                product_info.last_checked = datetime.now()
+        else:
+            # Cache new product info
+            product_info.last_checked = datetime.now()
+            self.cache_product_info(url, product_info)
+        self.journal_result(url, status, product_info)
 
-            print()
-            if current_products:
-                self.printer.info("Current Status Summary:")
-                self.print_status_summary(current_products)
-                print()
+        if self.dashboard:
+            self.dashboard.update(url, status, product_info)
+            self.dashboard.refresh()
+            return product_info
 
-            out_of_stock_urls -= newly_in_stock
+        self.printer.indent()
+        if status is True:
+            self.printer.success(f"Item {idx}/{total} - IN STOCK")
+        elif status is False:
+            self.printer.error(f"Item {idx}/{total} - Out of stock")
+        else:
+            self.printer.warning(f"Item {idx}/{total} - Status unknown")
+        self.printer.dedent()
 
-            if out_of_stock_urls:
-                self.printer.info(f"Next check in {interval:.0f} seconds...")
-                time.sleep(interval)
-            else:
-                self.printer.section("Monitoring Complete")
-                self.printer.success("All items are now in stock!")
+        # Full product details are only printed in verbose mode
+        if product_info and self.printer.verbose:
+            self.print_product_info(product_info)
 
-            check_count += 1
+        return product_info
 
     def print_product_info(self, product: ProductInfo):
         """Print detailed product information"""
@@ -172,6 +613,10 @@ class StockChecker:
             self.printer.info(f"Rating: {product.rating}")
         if product.reviews_count:
             self.printer.info(f"Reviews: {product.reviews_count}")
+        if product.variants:
+            available = [variant.label for variant in product.variants if variant.available]
+            self.printer.info(f"Variants in stock ({len(available)}/{len(product.variants)}): "
+                              f"{', '.join(available) or 'none'}")
         if product.description:
             self.printer.info("Description:")
             self.printer.indent()
@@ -180,70 +625,145 @@ class StockChecker:
         self.printer.dedent()
         self.printer.dedent()
 
+    def parser_for(self, adapter: RetailerAdapter) -> PageParser:
+        """The parser for a retailer's pages, created the first time one of them is read"""
+        if self.parser is not None:
+            return self.parser
+        parser = self._parsers.get(adapter.name)
+        if parser is None:
+            parser = self._parsers[adapter.name] = adapter.create_parser()
+        return parser
+
+    def host_rate_for(self, url: str) -> float:
+        """Requests per second to the host of a URL: the checker's rate, or the budget of the URL's retailer"""
+        if self.host_rate is not None:
+            rate = self.host_rate
+        else:
+            adapter = adapter_for(url)
+            rate = adapter.rate if adapter is not None else DEFAULT_HOST_RATE_PER_SECOND
+        return rate * self.rate_share
+
+    def check_product_stock(self, url):
+        """Check stock status for a single product URL of any supported retailer"""
+        with REGISTRY.timer('mstock_phase_seconds', phase='check'):
+            status, product_info = self._check_product_stock(url)
+            if url in self.variant_watcher:
+                status = self.variant_status(url, status, product_info)
+        REGISTRY.increment('mstock_checks_total', status=CHECK_STATUS_LABELS.get(status, 'unknown'))
+        return status, product_info
+
     def check_macys_stock(self, url):
-        """Check stock status for a single Macy's URL"""
+        """Deprecated alias of check_product_stock, from before other retailers were supported"""
+        warnings.warn("check_macys_stock is deprecated, use check_product_stock", DeprecationWarning, stacklevel=2)
+        return self.check_product_stock(url)
+
+    def _check_product_stock(self, url):
+        # Products answered by the product API skip the page entirely
+        answered = self._api_results.pop(url, None)
+        if answered:
+            return answered
+
+        adapter = adapter_for(url)
+        if adapter is None:
+            REGISTRY.increment('mstock_check_errors_total', kind='unsupported')
+            self.printer.error(f"No retailer adapter for {url}")
+            return None, None
+        parser = self.parser_for(adapter)
+
         try:
-            response = self.session.get(url)
+            cached_info = self.get_cached_product_info(url)
+            if cached_info and cached_info.status not in STOCK_STATUSES:
+                cached_info = None
+
+            with REGISTRY.timer('mstock_phase_seconds', phase='fetch'):
+                response = self.transport.get(url, headers=self.conditional_headers(cached_info))
+            if response.status_code == 304 and cached_info:
+                REGISTRY.increment('mstock_page_cache_total', result='not_modified')
+                return STOCK_STATUSES[cached_info.status], cached_info
             response.raise_for_status()
-
-            soup = BeautifulSoup(response.text, 'html.parser')
-            product_info = self.extract_product_info(soup)
+            REGISTRY.increment('mstock_fetched_bytes_total', len(response.content))
+
+            # Pages that are byte-for-byte unchanged keep their previous result without being parsed again
+            content_digest = hashlib.blake2b(response.content, digest_size=CONTENT_DIGEST_SIZE).digest()
+            if self.page_archive is not None:
+                self.archive_page(url, response, content_digest, adapter.name)
+            if cached_info and cached_info.content_digest == content_digest:
+                REGISTRY.increment('mstock_page_cache_total', result='unchanged')
+                # The server may have re-issued its validators for the same bytes, and only the new ones will match
+                cached_info.etag = response.headers.get('ETag')
+                cached_info.last_modified = response.headers.get('Last-Modified')
+                return STOCK_STATUSES[cached_info.status], cached_info
+            REGISTRY.increment('mstock_page_cache_total', result='parsed')
+
+            with REGISTRY.timer('mstock_phase_seconds', phase='parse'):
+                document = parser.load(response.text)
+            product_info = self.extract_product_info(document, parser)
+            if product_info and product_info.variants is None and url in self.variant_watcher:
+                product_info.variants = self.extract_variants(response.text)
+            if product_info:
+                product_info.etag = response.headers.get('ETag')
+                product_info.last_modified = response.headers.get('Last-Modified')
+                product_info.content_digest = content_digest
 
             # Check for out of stock message
-            out_of_stock_div = soup.find('div', {'class': ['error-color', 'large']})
-            if out_of_stock_div and "sorry, this item is currently unavailable" in out_of_stock_div.text.lower():
+            if parser.is_out_of_stock(document):
                 if product_info:
-                    product_info.status = "Out of Stock"
+                    product_info.status = StockStatus.OUT_OF_STOCK
                 return False, product_info
             else:
                 if product_info:
-                    product_info.status = "In Stock"
+                    product_info.status = StockStatus.IN_STOCK
                 return True, product_info
 
         except requests.RequestException as e:
+            REGISTRY.increment('mstock_check_errors_total', kind=type(e).__name__)
             self.printer.error(f"Error checking stock: {e}")
             return None, None
 
-    def extract_product_info(self, soup) -> Optional[ProductInfo]:
+    def archive_page(self, url: str, response, content_digest: bytes, retailer: str):
+        """Archive a fetched page. A failure, such as a locked archive file, is counted without failing the check"""
+        try:
+            self.page_archive.record(url, response, content_digest, retailer)
+        except Exception as e:
+            REGISTRY.increment('mstock_check_errors_total', kind='archive')
+            self.printer.error(f"Error archiving page: {e}")
+
+    def variant_status(self, url: str, page_status: Optional[bool], product_info: Optional[ProductInfo]):
+        """Stock status of a page's subscribed variants, all answered from the same fetch"""
+        variants = product_info.variants if product_info else None
+        if variants is None:
+            return page_status  # The page lists no variants it can be read for, so it answers for all of them
+        status = self.variant_watcher.status_for(url, variants)
+        if status is None and page_status is False:
+            return False  # Nothing on the page can be bought, whatever its variants
+        return status
+
+    @staticmethod
+    def conditional_headers(cached_info: Optional[ProductInfo]) -> dict:
+        """Build If-None-Match/If-Modified-Since headers from the validators of a cached page"""
+        headers = {}
+        if cached_info:
+            if cached_info.etag:
+                headers['If-None-Match'] = cached_info.etag
+            if cached_info.last_modified:
+                headers['If-Modified-Since'] = cached_info.last_modified
+        return headers
+
+    def extract_product_info(self, document, parser: PageParser) -> Optional[ProductInfo]:
         """Extract product information from the page"""
         try:
-            # Extract product ID
-            product_id = ""
-            web_id_span = soup.find('span', class_='product-id')
-            if web_id_span:
-                product_id = web_id_span.text.replace('Web ID:', '').strip()
-
-            # Extract price
-            price = None
-            price_elem = soup.find('div', class_='price')
-            if price_elem:
-                price = price_elem.text.strip()
-
-            # Extract brand and name
-            brand = ""
-            name = ""
-            title_elem = soup.find('h1', class_='product-title')
-            if title_elem:
-                brand_elem = title_elem.find('label', class_='subtitle-2')
-                if brand_elem:
-                    brand = brand_elem.text.strip()
-                name_elem = title_elem.find('span', class_='subtitle-1')
-                if name_elem:
-                    name = name_elem.text.strip()
-
-            # Extract rating information
-            rating = None
-            reviews_count = None
-            rating_elem = soup.find('span', class_='rating-average')
-            if rating_elem:
-                rating = rating_elem.text.strip()
-            reviews_elem = soup.find('span', class_='rating-description')
-            if reviews_elem:
-                reviews_count = reviews_elem.text.strip()
-
-            return ProductInfo(id=product_id, brand=brand, name=name, price=price, rating=rating,
-                reviews_count=reviews_count, last_checked=datetime.now())
-
+            with REGISTRY.timer('mstock_phase_seconds', phase='extract'):
+                return parser.extract_product_info(document)
         except Exception as e:
+            REGISTRY.increment('mstock_check_errors_total', kind='extract')
             self.printer.error(f"Error extracting product info: {e}")
             return None
+
+    def extract_variants(self, html: str) -> Optional[Tuple[Variant, ...]]:
+        """Variants from the page's JSON-LD product, None when the payload has none or can't be read"""
+        try:
+            return variants_from_json_ld(find_json_ld_product(html))
+        except Exception as e:
+            REGISTRY.increment('mstock_check_errors_total', kind='variants')
+            self.printer.error(f"Error extracting variants: {e}")
+            return None
@@ -0,0 +1,27 @@
+import json
+
+import pytest
+import requests
+
+
+class FakeTransport:
+    """Stands in for the checker's transport, answering every request with the same response"""
+
+    def __init__(self, body, status_code: int = 200, headers: dict = None):
+        self.response = requests.Response()
+        self.response.status_code = status_code
+        self.response.headers.update(headers or {})
+        # Text is sent as is, anything else as JSON
+        self.response._content = (body if isinstance(body, str) else json.dumps(body)).encode()
+        self.response.encoding = 'utf-8'
+        self.urls = []
+
+    def get(self, url, **kwargs):
+        self.urls.append(url)
+        return self.response
+
+
+@pytest.fixture
+def fake_transport():
+    """FakeTransport, for tests to build with the page or JSON body they need"""
+    return FakeTransport
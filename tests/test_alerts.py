@@ -0,0 +1,47 @@
+from alerts import PRICE_DROP, RESTOCK, SOLD_OUT, AlertTracker
+from product import StockStatus
+
+URL = 'https://www.macys.com/shop/product/item?ID=1'
+IN, OUT = StockStatus.IN_STOCK, StockStatus.OUT_OF_STOCK
+
+
+def observe_all(tracker, observations):
+    """Alerts of each (status, price, time) observation of one product"""
+    return [tracker.observe(URL, status, price, now) for status, price, now in observations]
+
+
+def test_flapping_inside_the_debounce_window_does_not_alert():
+    tracker = AlertTracker(events=(RESTOCK, SOLD_OUT), debounce=60)
+    alerts = observe_all(tracker, [(OUT, None, 0), (IN, None, 10), (OUT, None, 20), (IN, None, 30), (OUT, None, 40),
+                                   (IN, None, 50)])
+    assert alerts == [[], [RESTOCK], [], [], [], []]
+    # Back where it was last reported once the window is over, so there is nothing to say
+    assert observe_all(tracker, [(IN, None, 75)]) == [[]]
+
+
+def test_sustained_change_alerts_once():
+    tracker = AlertTracker(events=(RESTOCK, SOLD_OUT), debounce=60)
+    alerts = observe_all(tracker, [(IN, None, 0), (OUT, None, 30), (OUT, None, 61), (OUT, None, 200),
+                                   (OUT, None, 400)])
+    assert alerts == [[RESTOCK], [], [SOLD_OUT], [], []]
+
+
+def test_disabled_transitions_move_the_baseline():
+    tracker = AlertTracker(events=(RESTOCK,), debounce=0)
+    assert observe_all(tracker, [(IN, None, 0), (OUT, None, 1), (OUT, None, 2), (IN, None, 3)]) == \
+        [[RESTOCK], [], [], [RESTOCK]]
+
+
+def test_price_drop_is_edge_triggered():
+    tracker = AlertTracker(events=(PRICE_DROP,), price_below_cents=5000, debounce=0)
+    alerts = observe_all(tracker, [(IN, 5999, 0), (IN, 3999, 1), (IN, 3499, 2), (IN, 5999, 3), (IN, 4500, 4)])
+    assert alerts == [[], [PRICE_DROP], [], [], [PRICE_DROP]]
+
+
+def test_state_survives_export_and_import():
+    tracker = AlertTracker(events=(RESTOCK, SOLD_OUT), debounce=60)
+    tracker.observe(URL, IN, None, 0)
+    restored = AlertTracker(events=(RESTOCK, SOLD_OUT), debounce=60)
+    restored.import_states(tracker.export_states())
+    # Still quiet after the restart, and the restock isn't reported again
+    assert observe_all(restored, [(IN, None, 30), (OUT, None, 45), (OUT, None, 61)]) == [[], [], [SOLD_OUT]]
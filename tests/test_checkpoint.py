@@ -0,0 +1,74 @@
+import os
+import pickle
+import zlib
+from datetime import datetime
+
+from checkpoint import Checkpointer
+from printer import CustomPrinter
+from product import ProductInfo, StockStatus
+from product_cache import ProductTable
+from scheduler import PollScheduler
+from stock_checker import StockChecker
+from variants import Variant
+
+FINISHED = 'https://www.macys.com/shop/product/finished?ID=1'
+PENDING = 'https://www.macys.com/shop/product/pending?ID=2'
+
+
+def resumed_checker(path, relisted):
+    checker = StockChecker(printer=CustomPrinter(quiet=True), product_cache=ProductTable(),
+                           checkpointer=Checkpointer(str(path)))
+    checker.scheduler = PollScheduler(60)
+    checker.restore_checkpoint(checker.checkpointer.load(), [FINISHED, PENDING], relisted=relisted)
+    return checker
+
+
+def save_checkpoint(path):
+    checkpointer = Checkpointer(str(path))
+    checkpointer.save({'check_count': 3, 'completed': [FINISHED], 'alerts': [],
+                       'schedule': [(PENDING, 'normal', 0.0, 0.0, 0, 0, None, None)]}, wait=True)
+    checkpointer.close()
+
+
+def test_finished_products_from_the_watchlist_file_stay_finished(tmp_path):
+    save_checkpoint(tmp_path / 'checkpoint')
+    checker = resumed_checker(tmp_path / 'checkpoint', relisted=[])
+    assert checker.completed_urls == {FINISHED}
+    assert FINISHED not in checker.scheduler and PENDING in checker.scheduler
+
+
+def test_products_listed_again_are_monitored(tmp_path):
+    save_checkpoint(tmp_path / 'checkpoint')
+    checker = resumed_checker(tmp_path / 'checkpoint', relisted=[FINISHED])
+    assert checker.completed_urls == set()
+    assert FINISHED in checker.scheduler and PENDING in checker.scheduler
+
+
+def test_clear_removes_the_checkpoint(tmp_path):
+    save_checkpoint(tmp_path / 'checkpoint')
+    checkpointer = Checkpointer(str(tmp_path / 'checkpoint'))
+    checkpointer.clear()
+    assert checkpointer.load() is None
+
+
+def test_products_round_trip_through_json(tmp_path):
+    product_info = ProductInfo('1', 'Shirt', 'Brand', '$59.99 Sale $39.99', StockStatus.IN_STOCK, etag='"abc"',
+                               last_checked=datetime(2026, 1, 1), content_digest=bytes(range(16)),
+                               variants=(Variant('sku-1', 'Blue', 'M', True),))
+    checkpointer = Checkpointer(str(tmp_path / 'checkpoint'))
+    checkpointer.save({'completed': []}, lambda: [(FINISHED, product_info.raw_fields())], wait=True)
+    checkpointer.close()
+
+    [(url, fields)] = Checkpointer.products(Checkpointer(str(tmp_path / 'checkpoint')).load())
+    assert url == FINISHED
+    assert ProductInfo.from_raw_fields(fields) == product_info
+
+
+def test_pickled_checkpoint_is_never_unpickled(tmp_path):
+    class Exploit:
+        def __reduce__(self):
+            return os.system, (f"touch {tmp_path / 'pwned'}",)
+
+    (tmp_path / 'checkpoint').write_bytes(zlib.compress(pickle.dumps({'version': 1, 'exploit': Exploit()})))
+    assert Checkpointer(str(tmp_path / 'checkpoint')).load() is None
+    assert not (tmp_path / 'pwned').exists()
@@ -0,0 +1,94 @@
+import http.client
+import json
+import os
+import queue
+from urllib.parse import urlsplit
+
+import pytest
+
+from control import ADD_URLS, REMOVE_URLS, SET_INTERVAL, ControlServer
+
+URL = 'https://www.macys.com/shop/product/item?ID=1'
+
+
+class StubMonitor:
+    def __init__(self):
+        self.commands = queue.SimpleQueue()
+        self.interval = 60
+        self.stopping = False
+
+    def monitored_urls(self):
+        return [URL]
+
+    def product_info(self, url):
+        return None
+
+    def request_stop(self):
+        self.stopping = True
+
+
+@pytest.fixture
+def control(tmp_path):
+    server = ControlServer(StubMonitor(), port=0, token_path=str(tmp_path / 'token')).start()
+    yield server
+    server.stop()
+
+
+def request(control, method, path, body=None, content_type='application/json', token=True, host=None):
+    port = urlsplit(control.address).port
+    headers = {'Host': host or f"127.0.0.1:{port}"}
+    if content_type:
+        headers['Content-Type'] = content_type
+    if token:
+        headers['Authorization'] = f"Bearer {control.token}"
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    try:
+        connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def queued(control):
+    commands = []
+    while not control.monitor.commands.empty():
+        commands.append(control.monitor.commands.get())
+    return commands
+
+
+def test_routes_queue_changes(control):
+    assert request(control, 'GET', '/status') == (200, {'monitored': 1, 'interval': 60, 'stopping': False})
+    assert request(control, 'GET', '/products') == (200, [{'url': URL, 'product': None}])
+    assert request(control, 'POST', '/urls', {'urls': [URL], 'priority': 'high'})[0] == 202
+    assert request(control, 'DELETE', '/urls', {'urls': [URL]})[0] == 202
+    assert request(control, 'PUT', '/interval', {'seconds': 30})[0] == 202
+    assert request(control, 'PUT', '/interval', {'seconds': -1})[0] == 400
+    assert queued(control) == [(ADD_URLS, [URL], 'high'), (REMOVE_URLS, [URL]), (SET_INTERVAL, 30)]
+    assert request(control, 'POST', '/shutdown') == (202, {'stopping': True})
+    assert control.monitor.stopping
+
+
+def test_token_is_written_for_the_user_only(control):
+    with open(control.token_path) as file:
+        assert file.read() == control.token
+    assert os.stat(control.token_path).st_mode & 0o777 == 0o600
+    assert request(control, 'POST', '/shutdown', token=False)[0] == 401
+    assert not control.monitor.stopping
+
+
+def test_cross_site_requests_are_refused(control):
+    # A form or fetch() from a web page can send text/plain without a preflight, but not JSON
+    assert request(control, 'POST', '/urls', {'urls': [URL]}, content_type='text/plain')[0] == 415
+    assert request(control, 'POST', '/shutdown', content_type=None)[0] == 415
+    # A page served from a rebound domain sends its own name as Host
+    assert request(control, 'POST', '/shutdown', host='attacker.example:8765')[0] == 403
+    assert request(control, 'GET', '/status', host='attacker.example:8765')[0] == 403
+    assert queued(control) == []
+    assert not control.monitor.stopping
+
+
+def test_token_file_is_removed_on_stop(tmp_path):
+    server = ControlServer(StubMonitor(), port=0, token_path=str(tmp_path / 'token')).start()
+    server.stop()
+    assert not (tmp_path / 'token').exists()
@@ -0,0 +1,69 @@
+from constants import SECONDS_PER_DAY
+from journal import StatusJournal
+from product import StockStatus
+
+URL = 'https://www.macys.com/shop/product/item?ID=1'
+OTHER = 'https://www.macys.com/shop/product/item?ID=2'
+IN, OUT = StockStatus.IN_STOCK, StockStatus.OUT_OF_STOCK
+
+
+def test_only_changes_are_journaled(tmp_path):
+    journal = StatusJournal(str(tmp_path / 'journal.sqlite3'))
+    assert journal.record(URL, IN, 5999, at=0) is not None
+    assert journal.record(URL, IN, 5999, at=10) is None
+    assert journal.record(URL, IN, None, at=20) is None  # A missing price keeps the last one
+    assert journal.record(URL, StockStatus.UNKNOWN, at=30) is None
+    assert journal.record(URL, IN, 3999, at=40).previous_price_cents == 5999
+    assert [(transition.at, transition.price_cents) for transition in journal.history(URL)] == [(0, 5999), (40, 3999)]
+    journal.close()
+
+
+def test_restock_carries_how_long_the_product_was_out_of_stock(tmp_path):
+    journal = StatusJournal(str(tmp_path / 'journal.sqlite3'))
+    journal.record(URL, IN, 5999, at=0)
+    journal.record(URL, OUT, at=100)
+    journal.record(URL, OUT, 4999, at=150)  # A price change while out of stock doesn't restart the clock
+    restock = journal.record(URL, IN, at=400)
+    assert restock.is_restock and restock.out_of_stock_seconds == 300
+    assert [transition.at for transition in journal.restocked_since(0)] == [400]
+    assert journal.restocked_since(401) == []
+    journal.close()
+
+
+def test_out_of_stock_clock_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'journal.sqlite3')
+    journal = StatusJournal(path)
+    journal.record(URL, IN, at=0)
+    journal.record(URL, OUT, at=100)
+    journal.record(URL, OUT, 4999, at=150)
+    journal.close()
+
+    reopened = StatusJournal(path)
+    assert reopened.record(URL, IN, at=700).out_of_stock_seconds == 600
+    reopened.close()
+
+
+def test_median_out_of_stock_seconds(tmp_path):
+    journal = StatusJournal(str(tmp_path / 'journal.sqlite3'))
+    assert journal.median_out_of_stock_seconds() is None
+    at = 0
+    for url, durations in ((URL, (100, 300, 200)), (OTHER, (1000,))):
+        for duration in durations:
+            journal.record(url, OUT, at=at)
+            journal.record(url, IN, at=at + duration)
+            at += duration + 1
+    assert journal.median_out_of_stock_seconds(URL) == 200
+    assert journal.median_out_of_stock_seconds(OTHER) == 1000
+    # An even count averages the middle two: 100, 200, 300, 1000
+    assert journal.median_out_of_stock_seconds() == 250
+    journal.close()
+
+
+def test_restock_frequency(tmp_path):
+    journal = StatusJournal(str(tmp_path / 'journal.sqlite3'))
+    for at, status in ((0, OUT), (SECONDS_PER_DAY, IN), (2 * SECONDS_PER_DAY, OUT), (3 * SECONDS_PER_DAY, IN)):
+        journal.record(URL, status, at=at)
+    journal.record(OTHER, OUT, at=0)
+    journal.record(OTHER, IN, at=SECONDS_PER_DAY)
+    assert journal.restock_frequency(now=4 * SECONDS_PER_DAY) == [(URL, 2, 0.5), (OTHER, 1, 0.25)]
+    journal.close()
@@ -0,0 +1,67 @@
+import time
+
+import notifications
+from alerts import AVERAGE_DROP, PRICE_DROP, RESTOCK, SOLD_OUT
+from notifications import MemoryBackend, Notification, NotificationDispatcher, NotificationService, digest_subject
+
+
+def dispatch(notifications):
+    backend = MemoryBackend()
+    dispatcher = NotificationDispatcher(NotificationService(backends=[backend]), coalesce_window=5)
+    for subject, kind in notifications:
+        dispatcher.submit(subject, f"{subject} message", kind)
+    dispatcher.stop()
+    return backend.sent
+
+
+def test_mixed_batch_is_titled_by_its_alert_kinds():
+    sent = dispatch([("In Stock Alert: A", RESTOCK), ("Sold Out: B", SOLD_OUT), ("Sold Out: C", SOLD_OUT)])
+    assert [subject for subject, _ in sent] == ["🛍️ 3 Alerts: 1 In Stock, 2 Sold Out"]
+    assert "Sold Out: C message" in sent[0][1]
+
+
+def test_batch_of_one_kind_is_titled_by_that_kind():
+    assert dispatch([("Sold Out: B", SOLD_OUT), ("Sold Out: C", SOLD_OUT)])[0][0] == "🛍️ 2 Sold Out Alerts"
+    assert digest_subject([Notification("A", "", PRICE_DROP), Notification("B", "", AVERAGE_DROP)]) == \
+        "💲 2 Price Drop Alerts"
+
+
+def test_single_notification_keeps_its_subject():
+    assert dispatch([("Sold Out: B", SOLD_OUT)]) == [("Sold Out: B", "Sold Out: B message")]
+
+
+class FlakyBackend(MemoryBackend):
+    """Fails its first sends, then delivers"""
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+        self.attempts = 0
+
+    def send(self, subject, message, timeout):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectionError("connection refused")
+        super().send(subject, message, timeout)
+
+
+def test_failed_channel_is_resent_to(monkeypatch):
+    monkeypatch.setattr(notifications, 'NOTIFICATION_RETRY_DELAY_IN_SECONDS', 0)
+    backend = FlakyBackend(failures=2)
+    dispatcher = NotificationDispatcher(NotificationService(backends=[backend]), coalesce_window=0, max_retries=3)
+    dispatcher.submit("In Stock Alert: A", "message")
+    dispatcher.stop()
+    assert backend.attempts == 3 and len(backend.sent) == 1
+    assert dispatcher.stats()['sent'] == 1
+
+
+def test_timed_out_channel_is_not_resent_to(monkeypatch):
+    monkeypatch.setattr(notifications, 'NOTIFICATION_RETRY_DELAY_IN_SECONDS', 0)
+    slow, fast = MemoryBackend(delay=0.3, timeout=0.05), MemoryBackend()
+    dispatcher = NotificationDispatcher(NotificationService(backends=[slow, fast]), coalesce_window=0, max_retries=3)
+    dispatcher.submit("In Stock Alert: A", "message")
+    dispatcher.stop()
+    time.sleep(0.5)
+    # The slow send got through after its timeout, and only that once
+    assert len(slow.sent) == len(fast.sent) == 1
+    assert dispatcher.stats()['failed'] == 1
@@ -0,0 +1,44 @@
+import sqlite3
+
+from benchmarks.pages import render_product_page
+from page_archive import PageArchive, ReplayTransport, worker_archive_path
+from printer import CustomPrinter
+from product_cache import ProductTable
+from stock_checker import StockChecker
+
+URL = 'https://www.macys.com/shop/product/item?ID=1'
+
+
+class LockedArchive(PageArchive):
+    def record(self, *args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+
+
+def test_archive_failure_does_not_fail_the_check(tmp_path, fake_transport):
+    checker = StockChecker(printer=CustomPrinter(quiet=True), product_cache=ProductTable(),
+                           transport=fake_transport(render_product_page(1, in_stock=True, size=5000)),
+                           page_archive=LockedArchive(str(tmp_path / 'pages.sqlite3')))
+    try:
+        status, product_info = checker.check_product_stock(URL)
+    finally:
+        checker.close()
+        checker.page_archive.close()
+    assert status is True and product_info is not None
+
+
+def test_worker_archives_merge_in_order(tmp_path, fake_transport):
+    path = str(tmp_path / 'pages.sqlite3')
+    pages = [render_product_page(1, in_stock=in_stock, size=5000) for in_stock in (False, True)]
+    for worker_id, page in enumerate(pages):
+        worker_archive = PageArchive(worker_archive_path(path, worker_id))
+        worker_archive.record(URL, fake_transport(page).response)
+        worker_archive.close()
+
+    archive = PageArchive(path)
+    try:
+        assert [archive.merge(worker_archive_path(path, worker_id)) for worker_id in range(2)] == [1, 1]
+        replayed = ReplayTransport(archive)
+        assert [replayed.get(URL).text for _ in pages] == pages
+        assert archive.stats()['bodies'] == 2
+    finally:
+        archive.close()
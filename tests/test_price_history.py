@@ -0,0 +1,32 @@
+import price_history
+from price_history import PriceHistory
+from product import ProductInfo
+
+URL = 'https://www.macys.com/shop/product/item?ID=1'
+
+
+def priced(text):
+    return ProductInfo(id='1', name='Shirt', brand='Brand', price=text)
+
+
+def test_prices_are_saved_while_recording(tmp_path, monkeypatch):
+    monkeypatch.setattr(price_history, 'SAVE_EVERY_SECONDS', 0)
+    path = str(tmp_path / 'prices.npz')
+    history = PriceHistory(path)
+    history.record(URL, priced("$59.99"), at=1000)
+    history.record(URL, priced("$59.99 Sale $39.99"), at=2000)
+
+    # Never closed, like a monitor that was killed
+    reopened = PriceHistory(path)
+    assert reopened.urls == [URL]
+    assert reopened.summary(URL, window=2000, now=3000) == (3999, 3999, 4999.0)
+
+
+def test_flush_saves_only_new_prices(tmp_path):
+    path = tmp_path / 'prices.npz'
+    history = PriceHistory(str(path))
+    history.flush()
+    assert not path.exists()
+    history.record(URL, priced("$59.99"))
+    history.flush()
+    assert PriceHistory(str(path)).urls == [URL]
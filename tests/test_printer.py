@@ -0,0 +1,21 @@
+from printer import CustomPrinter
+
+
+def test_quiet_mode_still_reports_errors_on_stderr(capsys):
+    printer = CustomPrinter(use_colors=False, quiet=True)
+    printer.info("Checking 3 products")
+    printer.success("In stock")
+    printer.error("Error checking stock: timed out")
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert captured.err == "✗ Error checking stock: timed out\n"
+
+
+def test_errors_go_to_stderr(capsys):
+    printer = CustomPrinter(use_colors=False)
+    printer.indent()
+    printer.info("Checking 3 products")
+    printer.error("No retailer adapter for https://example.com/")
+    captured = capsys.readouterr()
+    assert captured.out == "  ℹ Checking 3 products\n"
+    assert captured.err == "  ✗ No retailer adapter for https://example.com/\n"
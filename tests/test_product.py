@@ -0,0 +1,29 @@
+import pytest
+
+from product import ProductInfo, parse_price
+
+
+@pytest.mark.parametrize('text, cents', [
+    ("$59.99 Sale $39.99", (5999, 3999)),
+    ("Was $59.99 Now $39.99", (5999, 3999)),
+    ("Sale $39.99 Reg. $59.99", (5999, 3999)),
+    ("$80.00 (25% off)", (8000, 6000)),
+    ("$39.99 - $59.99", (3999, None)),
+    ("$1,299.00", (129900, None)),
+    ("Price unavailable", None),
+])
+def test_parse_price(text, cents):
+    assert parse_price(text) == cents
+
+
+def test_price_range_is_not_a_sale():
+    info = ProductInfo(id='1', name='Shirt', brand='Brand', price="$39.99 - $59.99")
+    assert info.price == "$39.99 - $59.99"
+    assert info.price_cents == 3999
+    assert info.sale_price_cents is None and info.percent_off is None
+
+
+def test_sale_keeps_the_scraped_text():
+    info = ProductInfo(id='1', name='Shirt', brand='Brand', price="Was $59.99 Now $39.99")
+    assert info.price == "Was $59.99 Now $39.99"
+    assert (info.regular_price_cents, info.price_cents, info.percent_off) == (5999, 3999, 33)
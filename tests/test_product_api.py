@@ -0,0 +1,35 @@
+from benchmarks.pages import product_fields, render_api_product
+from parsers import format_price_range
+from product_api import ProductApiClient
+
+URLS = {str(product_id): f'https://www.macys.com/shop/product/item?ID={product_id}' for product_id in (1, 2, 3)}
+
+
+def fetch(transport):
+    return ProductApiClient(transport, 'http://api.test/products?ids={ids}').fetch(dict(URLS))
+
+
+def test_malformed_entries_fall_back_to_the_page(fake_transport):
+    valid = render_api_product(product_fields(1))
+    bad_price = dict(render_api_product(product_fields(2)), pricing={'price': {'tieredPrice': ['oops']}})
+    results = fetch(fake_transport({'product': [valid, bad_price, 'garbage', ['garbage'],
+                                                {'id': 3, 'availability': 'yes', 'detail': []}]}))
+    assert list(results) == [URLS['1']]
+
+
+def test_unreadable_product_list_falls_back_to_the_page(fake_transport):
+    assert fetch(fake_transport({'product': ['garbage']})) == {}
+    assert fetch(fake_transport([1, 2])) == {}
+
+
+def test_sale_tier_is_shown_as_a_sale(fake_transport):
+    fields = product_fields(1)
+    status, info = fetch(fake_transport({'product': [render_api_product(fields)]}))[URLS['1']]
+    assert status is True
+    assert info.price == f"${fields['regular']:.2f} Sale ${fields['sale']:.2f}"
+
+
+def test_price_range_is_shown_as_a_range():
+    assert format_price_range(['59.99', '39.99']) == "$39.99 - $59.99"
+    assert format_price_range(['39.99', '39.99']) == "$39.99"
+    assert format_price_range(['39.99'], regular_price='59.99') == "$59.99 Sale $39.99"
@@ -0,0 +1,91 @@
+from datetime import datetime
+
+import product_cache
+from product import ProductInfo, StockStatus
+from product_cache import ProductCache, ProductTable
+from variants import Variant
+
+
+def url(number):
+    return f'https://www.macys.com/shop/product/item?ID={number}'
+
+
+def product(number, **fields):
+    return ProductInfo(str(number), f'Shirt {number}', 'Brand', '$59.99 Sale $39.99', StockStatus.IN_STOCK,
+                       **fields)
+
+
+def test_entries_expire_after_the_ttl(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(product_cache.time, 'time', lambda: now[0])
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = ProductCache(path, ttl=60)
+    cache.put(url(1), product(1))
+    now[0] += 30
+    cache.put(url(2), product(2))
+    assert cache.get(url(1)) == product(1)
+
+    now[0] += 45
+    assert cache.get(url(1)) is None
+    assert cache.get(url(2)) == product(2)
+    cache.close()
+
+    # Expired entries are purged from disk when the cache is opened again
+    now[0] += 30
+    reopened = ProductCache(path, ttl=60)
+    assert len(reopened) == 0
+    reopened.close()
+
+
+def test_evicted_entries_reload_from_disk(tmp_path):
+    cache = ProductCache(str(tmp_path / 'cache.sqlite3'), max_entries=2)
+    for number in (1, 2, 3):
+        cache.put(url(number), product(number))
+    assert [item_url for item_url, _ in cache.raw_items()] == [url(2), url(3)]
+
+    assert cache.get(url(1)) == product(1)
+    # Reloading the least recently used product evicted the next one in line
+    assert [item_url for item_url, _ in cache.raw_items()] == [url(3), url(1)]
+    assert len(cache) == 3
+    cache.close()
+
+
+def test_memory_only_cache_forgets_evicted_entries():
+    cache = ProductCache(max_entries=2)
+    for number in (1, 2, 3):
+        cache.put(url(number), product(number))
+    cache.get(url(2))
+    cache.put(url(4), product(4))
+    assert cache.get(url(1)) is None and cache.get(url(3)) is None
+    assert cache.get(url(2)) == product(2) and cache.get(url(4)) == product(4)
+
+
+def test_warm_start_loads_the_latest_products(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = ProductCache(path)
+    for number in (1, 2, 3):
+        cache.put(url(number), product(number))
+    cache.close()
+
+    warm = ProductCache(path, max_entries=2)
+    assert [item_url for item_url, _ in warm.raw_items()] == [url(2), url(3)]
+    warm.close()
+
+
+def test_product_table_round_trips_every_field():
+    table = ProductTable()
+    full = product(1, description='Cotton', reviews_count='(12)', rating='4.5', last_checked=datetime(2026, 1, 1),
+                   etag='"abc"', last_modified='Thu, 01 Jan 2026 00:00:00 GMT', content_digest=bytes(range(16)),
+                   variants=(Variant('1-M', 'Blue', 'M', True),))
+    sparse = ProductInfo('2', 'Hat', None, None, StockStatus.UNKNOWN)
+    table.put(url(1), full)
+    table.put(url(2), sparse)
+    assert table.get(url(1)) == full
+    assert table.get(url(2)) == sparse
+
+    # Freed rows are reused without leaking the previous product's fields
+    table.discard(url(1))
+    assert table.get(url(1)) is None
+    table.put(url(3), sparse)
+    assert table.get(url(3)) == sparse
+    assert len(table) == 2
@@ -0,0 +1,27 @@
+from benchmarks.stand_in_server import StandInServer
+from printer import CustomPrinter
+from session_pool import build_identities
+from stock_checker import StockChecker
+
+CLIENT_RATE = 20
+
+
+def test_requests_rotate_across_identities_within_their_budgets():
+    # The server refuses a client (told apart by its User-Agent) that goes over CLIENT_RATE requests per second, with
+    # little burst allowance
+    server = StandInServer(page_size=5000, client_rate=CLIENT_RATE, client_burst=2).start()
+    urls = [server.product_url(product_id) for product_id in range(60)]
+    checker = StockChecker(printer=CustomPrinter(quiet=True), concurrency=8, host_rate=CLIENT_RATE,
+                           identities=build_identities(3))
+    try:
+        results = checker.check_batch(urls)
+    finally:
+        checker.close()
+        server.stop()
+
+    assert all(status is not None for _, status, _ in results)
+    user_agents = {identity['headers']['User-Agent'] for identity in build_identities(3)}
+    assert set(server.requests_by_client) == user_agents
+    # Each identity carried a fair share of the sweep, and none was ever throttled
+    assert min(server.requests_by_client.values()) >= len(urls) / 6
+    assert server.requests_throttled == 0
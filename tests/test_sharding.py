@@ -0,0 +1,34 @@
+import threading
+import time
+
+from benchmarks.stand_in_server import StandInServer
+from printer import CustomPrinter
+from product_cache import ProductTable
+from sharding import ShardedMonitor
+from stock_checker import StockChecker
+
+
+def test_summaries_continue_after_a_shard_empties():
+    server = StandInServer(page_size=5000).start()
+    try:
+        product_ids = [str(product_id) for product_id in range(1, 50)]
+        in_stock = next(product_id for product_id in product_ids if server.is_in_stock(product_id))
+        out_of_stock = next(product_id for product_id in product_ids if not server.is_in_stock(product_id))
+        checker = StockChecker(printer=CustomPrinter(quiet=True), product_cache=ProductTable())
+        monitor = ShardedMonitor([server.product_url(in_stock), server.product_url(out_of_stock)], 2, checker,
+                                 interval=0.2)
+        thread = threading.Thread(target=monitor.run)
+        thread.start()
+        try:
+            deadline = time.monotonic() + 20
+            while checker.check_count < 4 and time.monotonic() < deadline:
+                time.sleep(0.1)
+        finally:
+            monitor.request_stop()
+            thread.join()
+    finally:
+        server.stop()
+
+    # One worker's only product came back in stock, and the other worker's sweeps are still summarized
+    assert checker.check_count >= 4
+    assert monitor.monitored_urls() == [server.product_url(out_of_stock)]
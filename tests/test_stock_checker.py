@@ -0,0 +1,41 @@
+import pytest
+
+from benchmarks.pages import render_product_page
+from constants import MACYS_PRODUCT_URL_PREFIX
+from printer import CustomPrinter
+from product_cache import ProductTable
+from stock_checker import StockChecker
+from utils import is_product_url
+
+URL = 'https://www.macys.com/shop/product/item?ID=1'
+LAST_MODIFIED = 'Sat, 17 Oct 2026 08:00:00 GMT'
+
+
+def test_deprecated_macys_names_still_work(fake_transport):
+    checker = StockChecker(printer=CustomPrinter(quiet=True), product_cache=ProductTable(),
+                           transport=fake_transport(render_product_page(1, in_stock=True, size=5000)))
+    try:
+        with pytest.deprecated_call():
+            status, product_info = checker.check_macys_stock(URL)
+    finally:
+        checker.close()
+    assert status is True and product_info is not None
+    assert is_product_url(f"{MACYS_PRODUCT_URL_PREFIX}item?ID=1")
+
+
+def test_unchanged_page_takes_the_new_validators(fake_transport):
+    page = render_product_page(1, in_stock=True, size=5000)
+    checker = StockChecker(printer=CustomPrinter(quiet=True), product_cache=ProductTable(),
+                           transport=fake_transport(page, headers={'ETag': '"v1"'}))
+    try:
+        _, product_info = checker.check_product_stock(URL)
+        checker.cache_product_info(URL, product_info)
+        # Same bytes, but the server now tags them differently
+        checker.transport = fake_transport(page, headers={'ETag': '"v2"', 'Last-Modified': LAST_MODIFIED})
+        status, product_info = checker.check_product_stock(URL)
+        checker.cache_product_info(URL, product_info)
+    finally:
+        checker.close()
+    assert status is True
+    assert StockChecker.conditional_headers(checker.get_cached_product_info(URL)) == {
+        'If-None-Match': '"v2"', 'If-Modified-Since': LAST_MODIFIED}
@@ -0,0 +1,125 @@
+import io
+import time
+from email.utils import formatdate
+
+import pytest
+import requests
+
+import transport
+from rate_limiter import HostRateLimiter
+from transport import CircuitBreaker, MAX_RETRY_AFTER_IN_SECONDS, ResilientTransport
+
+URL = 'https://www.macys.com/shop/product/item?ID=1'
+
+
+def response(status_code: int, headers: dict = None) -> requests.Response:
+    scripted = requests.Response()
+    scripted.status_code = status_code
+    scripted.headers.update(headers or {})
+    scripted.raw = io.BytesIO(b'')
+    return scripted
+
+
+class ScriptedSession:
+    """Answers requests with the given responses (or raises the given exceptions) in turn"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = 0
+
+    def get(self, url, **kwargs):
+        self.requests += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def mount(self, prefix, adapter):
+        pass
+
+
+class CountingRateLimiter(HostRateLimiter):
+    def __init__(self):
+        super().__init__(0)
+        self.tokens_taken = 0
+
+    def bucket_for(self, url):
+        self.tokens_taken += 1
+        return super().bucket_for(url)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Seconds the transport slept for, without sleeping"""
+    slept = []
+    monkeypatch.setattr(transport.time, 'sleep', slept.append)
+    return slept
+
+
+def test_every_attempt_spends_a_host_token(sleeps):
+    rate_limiter = CountingRateLimiter()
+    session = ScriptedSession(response(503), response(500), requests.ConnectionError(), response(200))
+    resilient = ResilientTransport(session, max_retries=3, breaker_threshold=10, rate_limiter=rate_limiter)
+    assert resilient.get(URL).status_code == 200
+    assert session.requests == rate_limiter.tokens_taken == 4
+
+
+def test_retry_after_is_honoured(sleeps):
+    session = ScriptedSession(response(429, {'Retry-After': '7'}), response(200))
+    resilient = ResilientTransport(session, max_retries=1, breaker_threshold=10)
+    assert resilient.get(URL).status_code == 200
+    assert sleeps == [7.0]
+
+
+def test_retry_after_formats():
+    assert ResilientTransport.retry_after(response(429, {'Retry-After': '2.5'})) == 2.5
+    http_date = ResilientTransport.retry_after(response(429, {'Retry-After': formatdate(time.time() + 60)}))
+    assert 55 <= http_date <= 60
+    assert ResilientTransport.retry_after(response(429, {'Retry-After': '86400'})) == MAX_RETRY_AFTER_IN_SECONDS
+    assert ResilientTransport.retry_after(response(429, {'Retry-After': 'soon'})) is None
+    assert ResilientTransport.retry_after(response(429)) is None
+
+
+def test_backoff_is_full_jitter_and_capped(sleeps):
+    resilient = ResilientTransport(ScriptedSession(), backoff_base=1, backoff_max=5)
+    for attempt, ceiling in ((0, 1), (1, 2), (2, 4), (5, 5)):
+        delays = [resilient.backoff_delay(attempt) for _ in range(200)]
+        assert all(0 <= delay <= ceiling for delay in delays)
+        assert max(delays) > ceiling / 2
+
+    session = ScriptedSession(*[requests.Timeout()] * 3)
+    with pytest.raises(requests.Timeout):
+        ResilientTransport(session, max_retries=2, backoff_base=1, backoff_max=5).get(URL)
+    assert session.requests == 3
+    assert len(sleeps) == 2 and sleeps[0] <= 1 and sleeps[1] <= 2
+
+
+def test_last_retryable_response_is_returned(sleeps):
+    session = ScriptedSession(response(502), response(502))
+    assert ResilientTransport(session, max_retries=1).get(URL).status_code == 502
+
+
+def test_breaker_opens_then_half_opens():
+    breaker = CircuitBreaker(threshold=2, cooldown=0.05)
+    assert not breaker.record_throttle()
+    assert breaker.record_throttle()
+    assert breaker.is_open and breaker.wait_time() > 0
+    assert not breaker.record_throttle()  # Requests finishing while it is open don't extend it
+
+    time.sleep(0.06)
+    assert not breaker.is_open
+    # Half-open: the first throttle after cooling down opens it again
+    assert breaker.record_throttle()
+    time.sleep(0.06)
+    breaker.record_success()
+    # Closed: it takes the full threshold again
+    assert not breaker.record_throttle()
+    assert breaker.record_throttle()
+
+
+def test_open_breaker_pauses_requests_to_the_host(sleeps):
+    session = ScriptedSession(response(429), response(429), response(200))
+    resilient = ResilientTransport(session, max_retries=2, backoff_base=0, breaker_threshold=2, breaker_cooldown=30)
+    assert resilient.get(URL).status_code == 200
+    # The second throttle opened the breaker, so the retry waited out its cooldown before going out
+    assert any(25 < pause <= 30 for pause in sleeps)
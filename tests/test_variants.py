@@ -0,0 +1,63 @@
+import json
+
+import stock_checker
+from printer import CustomPrinter
+from product_cache import ProductTable
+from stock_checker import StockChecker
+from variants import variants_from_json_ld
+
+URL = 'https://www.macys.com/shop/product/shirt?ID=1'
+
+
+def product_page(product: dict) -> str:
+    return (f'<html><head><script type="application/ld+json">{json.dumps(product)}</script></head><body>'
+            '<h1 class="product-title"><label>Brand</label><span>Shirt</span></h1></body></html>')
+
+
+def test_single_has_variant_object():
+    product = {'@type': 'Product', 'hasVariant': {'sku': '1-M', 'size': 'M',
+                                                  'offers': {'availability': 'https://schema.org/InStock'}}}
+    variants = variants_from_json_ld(product)
+    assert [(variant.sku, variant.size, variant.available) for variant in variants] == [('1-M', 'M', True)]
+
+
+def test_single_nested_aggregate_offer():
+    product = {'@type': 'Product', 'offers': {'@type': 'AggregateOffer', 'offers': {
+        'sku': '1-L', 'itemOffered': {'size': 'L'}, 'availability': 'https://schema.org/OutOfStock'}}}
+    variants = variants_from_json_ld(product)
+    assert [(variant.sku, variant.size, variant.available) for variant in variants] == [('1-L', 'L', False)]
+
+
+def test_non_object_nodes_are_skipped():
+    product = {'@type': 'Product', 'hasVariant': ['1-S', None, {'sku': '1-M', 'offers': ['oops']}],
+               'offers': 'https://schema.org/InStock'}
+    variants = variants_from_json_ld(product)
+    assert [(variant.sku, variant.available) for variant in variants] == [('1-M', False)]
+    assert variants_from_json_ld(['not', 'a', 'product']) is None
+
+
+def check(transport):
+    checker = StockChecker(printer=CustomPrinter(quiet=True), product_cache=ProductTable(),
+                           variant_subscriptions=[(URL, 'M')], transport=transport)
+    try:
+        return checker.check_product_stock(URL)
+    finally:
+        checker.close()
+
+
+def test_checker_reads_single_has_variant(fake_transport):
+    status, product_info = check(fake_transport(product_page({'@type': 'Product', 'hasVariant': {
+        'sku': '1-M', 'size': 'M', 'offers': {'availability': 'https://schema.org/InStock'}}})))
+    assert status is True
+    assert [variant.sku for variant in product_info.variants] == ['1-M']
+
+
+def test_checker_falls_back_to_page_status_on_unreadable_variants(monkeypatch, fake_transport):
+    def broken(product):
+        raise AttributeError("'str' object has no attribute 'get'")
+    monkeypatch.setattr(stock_checker, 'variants_from_json_ld', broken)
+
+    status, product_info = check(fake_transport(product_page({'@type': 'Product', 'hasVariant': {'sku': '1-M'}})))
+    assert product_info is not None and product_info.variants is None
+    # No variant answers the subscription, so the page's own status stands
+    assert status is True
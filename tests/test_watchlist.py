@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from scheduler import PollScheduler
+from watchlist import Watchlist
+
+FIRST = 'https://www.macys.com/shop/product/first?ID=1'
+SECOND = 'https://www.macys.com/shop/product/second?ID=2'
+
+
+def test_unreadable_file_keeps_the_watchlist(tmp_path):
+    path = tmp_path / 'watchlist.txt'
+    path.write_text(f"{FIRST}\n{SECOND}\n")
+    watchlist = Watchlist(path=str(path)).load()
+
+    os.replace(path, tmp_path / 'moved.txt')
+    assert watchlist.changed()
+    with pytest.raises(OSError):
+        watchlist.reload()
+    assert list(watchlist) == [FIRST, SECOND]
+
+    os.replace(tmp_path / 'moved.txt', path)
+    assert watchlist.changed()
+    assert watchlist.reload() == ([], [])
+    assert list(watchlist) == [FIRST, SECOND]
+
+
+def test_adding_a_scheduled_url_keeps_its_schedule():
+    scheduler = PollScheduler(60)
+    scheduler.add(FIRST)
+    assert scheduler.pop_due() == [FIRST]
+    scheduler.record(FIRST, False, None)
+
+    scheduler.add(FIRST)
+    assert scheduler.pop_due() == []
+    assert FIRST in scheduler
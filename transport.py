@@ -0,0 +1,186 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from constants import (DEFAULT_CONNECT_TIMEOUT_IN_SECONDS, DEFAULT_READ_TIMEOUT_IN_SECONDS, DEFAULT_MAX_RETRIES,
+                       BACKOFF_BASE_IN_SECONDS, BACKOFF_MAX_IN_SECONDS, CIRCUIT_BREAKER_THRESHOLD,
+                       CIRCUIT_BREAKER_COOLDOWN_IN_SECONDS)
+from metrics import REGISTRY
+from printer import CustomPrinter
+from rate_limiter import HostRateLimiter
+from session_pool import SessionPool
+
+# Responses worth retrying, and the subset that means the host is throttling us
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+THROTTLE_STATUSES = {429, 503}
+# Longest Retry-After we are willing to honour for a single retry
+MAX_RETRY_AFTER_IN_SECONDS = 300
+
+
+class CircuitBreaker:
+    """Host-level breaker that opens after repeated throttling responses and pauses requests until it cools down.
+
+    Once it has cooled down it is half-open: a single throttle opens it again, and only a success closes it.
+    """
+
+    def __init__(self, threshold: int = CIRCUIT_BREAKER_THRESHOLD,
+                 cooldown: float = CIRCUIT_BREAKER_COOLDOWN_IN_SECONDS):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.consecutive_throttles = 0
+        self.open_until = 0.0
+        self.half_open = False  # Opened and cooled down since the last success
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return time.monotonic() < self.open_until
+
+    def wait_time(self) -> float:
+        """Seconds until requests to the host may resume"""
+        return max(0.0, self.open_until - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_throttles = 0
+            self.half_open = False
+
+    def record_throttle(self, retry_after: Optional[float] = None) -> bool:
+        """Count a throttling response. Returns True if this opened the breaker"""
+        with self._lock:
+            if self.is_open:
+                return False
+            self.consecutive_throttles += 1
+            if self.consecutive_throttles < self.threshold and not self.half_open:
+                return False
+            self.open_until = time.monotonic() + max(self.cooldown, retry_after or 0)
+            self.consecutive_throttles = 0
+            self.half_open = True
+            return True
+
+
+class ResilientTransport:
+    """Wraps a requests.Session with timeouts, jittered retries and per-host circuit breakers.
+
+    Every attempt, retries included, first takes a token from the host's bucket in `rate_limiter`, so a burst of
+    failures is retried within the host's rate budget. With a session pool every attempt goes out through the pool's
+    least-loaded healthy identity instead, which spends its own budget, and a request throttled on one identity is
+    retried straight away on another.
+    """
+
+    def __init__(self, session: requests.Session, printer: CustomPrinter = None,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT_IN_SECONDS,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT_IN_SECONDS, max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff_base: float = BACKOFF_BASE_IN_SECONDS, backoff_max: float = BACKOFF_MAX_IN_SECONDS,
+                 pool_size: int = 10, breaker_threshold: int = CIRCUIT_BREAKER_THRESHOLD,
+                 breaker_cooldown: float = CIRCUIT_BREAKER_COOLDOWN_IN_SECONDS, session_pool: SessionPool = None,
+                 rate_limiter: HostRateLimiter = None):
+        self.session = session
+        self.session_pool = session_pool
+        self.rate_limiter = rate_limiter
+        self.printer = printer
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self.configure_pool(pool_size)
+
+    def configure_pool(self, pool_size: int):
+        """Size the connection pools so every concurrent check can keep a connection alive"""
+        for session in self.session_pool.sessions if self.session_pool else [self.session]:
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+
+    def breaker_for(self, url: str) -> CircuitBreaker:
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+            return breaker
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """GET a URL, retrying connection errors, timeouts and retryable statuses with backoff"""
+        breaker = self.breaker_for(url)
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            # While the host is throttling us every request to it waits, which pauses the sweep
+            pause = breaker.wait_time()
+            if pause:
+                time.sleep(pause)
+            if self.rate_limiter:
+                self.rate_limiter.bucket_for(url).acquire()
+
+            identity = self.session_pool.acquire() if self.session_pool else None
+            try:
+                response = (identity.session if identity else self.session).get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if identity:
+                    # A dead proxy shows up as connection errors, so the identity rests like a throttled one
+                    self.session_pool.release(identity, failed=True)
+                if attempt == self.max_retries:
+                    raise
+                REGISTRY.increment('mstock_http_retries_total', reason=type(e).__name__)
+                time.sleep(self.backoff_delay(attempt))
+                continue
+            except Exception:
+                if identity:
+                    self.session_pool.release(identity, failed=True)
+                raise
+
+            retry_after = self.retry_after(response)
+            throttled = response.status_code in THROTTLE_STATUSES
+            if identity:
+                self.session_pool.release(identity, throttled=throttled, retry_after=retry_after)
+            if response.status_code not in RETRY_STATUSES:
+                breaker.record_success()
+                return response
+
+            # Throttling of one identity only counts against the host once no identity is left to send from
+            if throttled and identity and not self.session_pool.all_resting():
+                if attempt == self.max_retries:
+                    return response
+                REGISTRY.increment('mstock_http_retries_total', reason=str(response.status_code))
+                response.close()
+                continue
+            if throttled and breaker.record_throttle(retry_after):
+                REGISTRY.increment('mstock_circuit_opened_total', host=urlsplit(url).netloc)
+                if self.printer:
+                    self.printer.warning(f"{urlsplit(url).netloc} is throttling requests, "
+                                         f"pausing for {breaker.wait_time():.0f} seconds")
+            if attempt == self.max_retries:
+                return response
+            REGISTRY.increment('mstock_http_retries_total', reason=str(response.status_code))
+            response.close()
+            time.sleep(retry_after if retry_after is not None else self.backoff_delay(attempt))
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def retry_after(response: requests.Response) -> Optional[float]:
+        """Seconds requested by a Retry-After header (delta-seconds or HTTP date), if any"""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(MAX_RETRY_AFTER_IN_SECONDS, max(0.0, delay))
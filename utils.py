@@ -1,14 +1,63 @@
-from constants import MACYS_PRODUCT_URL_PREFIX
+from typing import Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+from retailers import RetailerAdapter, adapter_for
+
+
+def is_product_url(url: str) -> bool:
+    """Whether a URL is a product page of a supported retailer"""
+    adapter = adapter_for(url)
+    return adapter is not None and adapter.is_product_url(url)
+
 
 def verify_urls(urls):
-    """Verify if URLs are valid Macy's product URLs"""
+    """Verify if URLs are product URLs of a supported retailer"""
     valid_urls = []
     invalid_urls = []
 
     for url in urls:
-        if url.startswith(MACYS_PRODUCT_URL_PREFIX):
+        if is_product_url(url):
             valid_urls.append(url)
         else:
             invalid_urls.append(url)
 
-    return valid_urls, invalid_urls
\ No newline at end of file
+    return valid_urls, invalid_urls
+
+
+def normalize_url(url: str) -> str:
+    """Drop tracking parameters and fragments, keeping only what identifies the product for its retailer"""
+    adapter = adapter_for(url)
+    if adapter is not None:
+        return adapter.normalize_url(url)
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ''))
+
+
+def product_key(url: str, adapter: RetailerAdapter = None) -> str:
+    """Identity of the product behind a URL: its retailer and product ID, or the normalized URL if it has none"""
+    adapter = adapter or adapter_for(url)
+    product_id = adapter.product_id(url) if adapter is not None else None
+    return f"{adapter.name}:{product_id}" if product_id else url
+
+
+def iter_url_lines(lines: Iterable[str]) -> Iterator[str]:
+    """URLs from text lines, skipping blank lines and # comments"""
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def stream_urls(lines: Iterable[str], seen: Optional[set] = None) -> Iterator[Tuple[str, bool]]:
+    """Normalize, deduplicate and validate URLs one at a time, yielding (url, is_valid)"""
+    seen = set() if seen is None else seen
+    for raw_url in iter_url_lines(lines):
+        adapter = adapter_for(raw_url)
+        if adapter is None or not adapter.is_product_url(raw_url):
+            yield raw_url, False
+            continue
+        url = adapter.normalize_url(raw_url)
+        key = product_key(url, adapter)
+        if key not in seen:
+            seen.add(key)
+            yield url, True
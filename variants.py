@@ -0,0 +1,137 @@
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Separators between the parts of a variant spec, e.g. "Blue / M" or "blue,m"
+SPEC_SEPARATOR = re.compile(r'\s*[/,]\s*')
+IN_STOCK_AVAILABILITY = ('InStock', 'LimitedAvailability', 'OnlineOnly', 'InStoreOnly', 'PreOrder', 'BackOrder')
+
+
+class Variant:
+    """Availability of one SKU (a size/color combination) of a product"""
+    __slots__ = ('sku', 'color', 'size', 'available')
+
+    def __init__(self, sku: Optional[str] = None, color: Optional[str] = None, size: Optional[str] = None,
+                 available: bool = False):
+        self.sku = sku
+        self.color = color
+        self.size = size
+        self.available = available
+
+    @property
+    def label(self) -> str:
+        return " / ".join(part for part in (self.color, self.size) if part) or self.sku or "Default"
+
+    def matches(self, tokens: Tuple[str, ...]) -> bool:
+        """Whether every token of a spec names this variant's color, size or SKU"""
+        attributes = {value.lower() for value in (self.sku, self.color, self.size) if value}
+        return all(token in attributes for token in tokens)
+
+    def to_dict(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Variant':
+        return cls(**data)
+
+    def __eq__(self, other):
+        if not isinstance(other, Variant):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __repr__(self):
+        return f"Variant({self.label!r}, available={self.available})"
+
+
+def _is_available(availability) -> bool:
+    return str(availability or '').rsplit('/', 1)[-1] in IN_STOCK_AVAILABILITY
+
+
+def _dict_list(value) -> List[dict]:
+    """The objects of a JSON-LD property, which may hold a single object or a list of them"""
+    values = value if isinstance(value, list) else [value]
+    return [item for item in values if isinstance(item, dict)]
+
+
+def variants_from_json_ld(product: Optional[dict]) -> Optional[Tuple[Variant, ...]]:
+    """Variants of a schema.org Product: its per-SKU offers, or the offers of its hasVariant products"""
+    if not isinstance(product, dict):
+        return None
+
+    def offer_list(node):
+        offers = _dict_list(node.get('offers'))
+        # An AggregateOffer lists the individual offers under its own "offers"
+        nested = [offer for aggregate in offers for offer in _dict_list(aggregate.get('offers'))]
+        return nested or offers
+
+    variants = []
+    for variant_product in _dict_list(product.get('hasVariant')):
+        offers = offer_list(variant_product)
+        variants.append(Variant(sku=variant_product.get('sku'), color=variant_product.get('color'),
+                                size=variant_product.get('size'),
+                                available=any(_is_available(offer.get('availability')) for offer in offers)))
+    if not variants:
+        for offer in offer_list(product):
+            item = offer.get('itemOffered') if isinstance(offer.get('itemOffered'), dict) else {}
+            sku = offer.get('sku') or item.get('sku')
+            color = offer.get('color') or item.get('color')
+            size = offer.get('size') or item.get('size')
+            if sku or color or size:
+                variants.append(Variant(sku, color, size, _is_available(offer.get('availability'))))
+    return tuple(variants) or None
+
+
+def parse_spec(spec: str) -> Tuple[str, ...]:
+    return tuple(token.lower() for token in SPEC_SEPARATOR.split(spec.strip()) if token)
+
+
+class VariantWatcher:
+    """Variant subscriptions per product URL, all answered from the variants of a single page fetch.
+
+    A subscription like "Blue / M" is available when any variant whose color, size or SKU matches every part of it is
+    in stock, so "M" alone watches size M in every color.
+    """
+
+    def __init__(self, subscriptions: Iterable[Tuple[str, str]] = ()):
+        self._subscriptions: Dict[str, Dict[str, Tuple[str, ...]]] = {}
+        for url, spec in subscriptions:
+            self.subscribe(url, spec)
+
+    def subscribe(self, url: str, spec: str):
+        tokens = parse_spec(spec)
+        if not tokens:
+            raise ValueError(f"Empty variant for {url}")
+        self._subscriptions.setdefault(url, {})[spec] = tokens
+
+    def unsubscribe(self, url: str, spec: str = None):
+        if spec is None:
+            self._subscriptions.pop(url, None)
+        else:
+            self._subscriptions.get(url, {}).pop(spec, None)
+
+    def specs_for(self, url: str) -> List[str]:
+        return list(self._subscriptions.get(url, ()))
+
+    def evaluate(self, url: str, variants: Optional[Iterable[Variant]]) -> Dict[str, Optional[bool]]:
+        """Per subscription: True if a matching variant is in stock, False if none is, None if none match"""
+        variants = tuple(variants or ())
+        results = {}
+        for spec, tokens in self._subscriptions.get(url, {}).items():
+            matching = [variant for variant in variants if variant.matches(tokens)]
+            results[spec] = any(variant.available for variant in matching) if matching else None
+        return results
+
+    def status_for(self, url: str, variants: Optional[Iterable[Variant]]) -> Optional[bool]:
+        """Stock status of a subscribed URL: in stock when any subscription is, unknown when none can be answered"""
+        results = [result for result in self.evaluate(url, variants).values() if result is not None]
+        if not results:
+            return None
+        return any(results)
+
+    def available_specs(self, url: str, variants: Optional[Iterable[Variant]]) -> List[str]:
+        return [spec for spec, result in self.evaluate(url, variants).items() if result]
+
+    def __contains__(self, url: str) -> bool:
+        return bool(self._subscriptions.get(url))
+
+    def __len__(self) -> int:
+        return sum(len(specs) for specs in self._subscriptions.values())
@@ -0,0 +1,87 @@
+import os
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils import product_key, stream_urls
+
+# Invalid entries kept for reporting; the rest are only counted
+MAX_REPORTED_INVALID_URLS = 20
+
+
+class Watchlist:
+    """Deduplicated product URLs from the command line and an optional file (or stdin, as "-").
+
+    URLs are normalized and keyed by product ID, so the same product with different tracking parameters is only
+    monitored once. A watchlist file can be reloaded while monitoring: only products that were added or removed are
+    reported, so existing products keep their schedule and cached information.
+    """
+
+    def __init__(self, urls: Iterable[str] = (), path: Optional[str] = None):
+        self.path = path
+        self._fixed_urls = list(urls)
+        self.urls: Dict[str, str] = {}  # product key -> normalized URL, in the order they were read
+        self.invalid_urls: List[str] = []
+        self.invalid_count = 0
+        self.command_line_urls: List[str] = []  # Normalized URLs given directly rather than read from the file
+        self._signature = None
+
+    @property
+    def reloadable(self) -> bool:
+        return bool(self.path) and self.path != '-'
+
+    def load(self) -> 'Watchlist':
+        """Read every source, streaming the file line by line. The URLs only change once every source was read, so a
+        file that can't be read leaves the previous ones in place"""
+        urls, invalid_urls = {}, []
+        invalid_count = self._read(self._fixed_urls, urls, invalid_urls)
+        command_line_urls = list(urls.values())
+        if self.path == '-':
+            invalid_count += self._read(sys.stdin, urls, invalid_urls)
+        elif self.path:
+            # Taken before reading, so a file that is missing for a moment is retried once it changes again
+            self._signature = self._file_signature()
+            with open(self.path, encoding='utf-8') as f:
+                invalid_count += self._read(f, urls, invalid_urls)
+        self.urls, self.invalid_urls, self.invalid_count = urls, invalid_urls, invalid_count
+        self.command_line_urls = command_line_urls
+        return self
+
+    def changed(self) -> bool:
+        """Whether the watchlist file was modified since it was last read"""
+        return self.reloadable and self._file_signature() != self._signature
+
+    def reload(self) -> Tuple[List[str], List[str]]:
+        """Re-read the sources and return the (added, removed) URLs. Raises OSError, keeping the current URLs, when
+        the file can't be read"""
+        previous = self.urls
+        self.load()
+        added = [url for key, url in self.urls.items() if key not in previous]
+        removed = [url for key, url in previous.items() if key not in self.urls]
+        # Products that are still listed keep the URL they are already monitored under
+        self.urls = {key: previous.get(key, url) for key, url in self.urls.items()}
+        return added, removed
+
+    def __iter__(self):
+        return iter(self.urls.values())
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def _read(self, lines, urls: Dict[str, str], invalid_urls: List[str]) -> int:
+        """Add the valid URLs of some lines to `urls`, returning how many were invalid"""
+        invalid_count = 0
+        for url, valid in stream_urls(lines, set(urls)):
+            if valid:
+                urls[product_key(url)] = url
+            else:
+                invalid_count += 1
+                if len(invalid_urls) < MAX_REPORTED_INVALID_URLS:
+                    invalid_urls.append(url)
+        return invalid_count
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size